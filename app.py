@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, flash, redirect, session, jsonify, g
+from flask import Flask, render_template, request, flash, redirect, session, jsonify, g, Response, stream_with_context, get_template_attribute
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
 
@@ -6,19 +6,31 @@ import os
 import datetime
 import json
 import requests
+import click
+import time
 
 from engine.engine import *
 from engine.constants import * 
-from models import db, connect_db, User, Stock, Owned_Stock, Transaction, App_Config
+from models import db, connect_db, User, Stock, Owned_Stock, Transaction, App_Config, Price_Rollup, Pending_Order, Price_Alert
 from forms import LoginSignupForm, StockTransactionForm, StockSearchForm, UserEditForm
 from secrets import keys
 from engine.exceptions import * 
+from engine.quote_cache import quote_cache
+from engine.symbols import listing_cache, CachedJSON
+from engine.export import export_transactions, EXPORT_FORMATS
+from engine.metrics import metrics
+from engine.notify import broadcaster, Portfolio
+from engine.user_cache import user_cache
+from engine.config import SETTINGS
+from engine.fixtures import quote_fixtures
+from engine.fragments import fragment_cache
+from engine import seeding
 
 # app = setup_app_config()
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = (os.environ.get('DATABASE_URL', 'postgres:///stocks-app'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
+app.config['SQLALCHEMY_ECHO'] = SQLALCHEMY_ECHO
 app.config['SECRET_KEY'] = keys['flask_debug']
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 
@@ -27,14 +39,26 @@ CURR_USER_KEY = "curr_user"
 
 connect_db(app)
 db.create_all()
-debug = DebugToolbarExtension(app)
+if DEBUG_TOOLBAR:
+    debug = DebugToolbarExtension(app)
+metrics.init_app(app)
+
+@app.before_first_request
+def build_stock_search_index():
+    """Builds the stock search index up front, rather than during the first search."""
+    Stock.get_search_index()
+
+@app.before_first_request
+def load_quote_fixtures():
+    """Parses the sample quote data up front, rather than on the first stock page."""
+    quote_fixtures.get()
 
 #********************** USER ROUTES ******************************
 @app.before_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = User.get_snapshot(session[CURR_USER_KEY])
     else:
         g.user = None
 
@@ -45,16 +69,15 @@ def root():
         return render_template("home-anon.html")
 
     owned_stocks = Owned_Stock.get_owned_stock_for_user(g.user.id)
-  
-    update_toggle = App_Config.query.get(1)
 
-    if update_toggle.toggle and not update_user_stocks(owned_stocks):     #TOO SLOW and calls external API. Implement with AJAX and load symbols instead
-        flash("Error updating stocks from external API")
+    transactions, cursor = Transaction.get_user_transactions_page(g.user.id)
 
-    transactions= Transaction.query.filter(Transaction.user_id == g.user.id).all()
-    users_list = User.query.order_by(User.total_asset_value.desc()).all()
+    leaderboard = User.get_leaderboard()
+    users_list = leaderboard.top(LEADERBOARD_TOP_N)
+    user_rank = leaderboard.entry(g.user.id)
     
-    return render_template('/home.html', owned_stocks=owned_stocks, transactions=transactions, users_list=users_list)    
+    return render_template('/home.html', owned_stocks=owned_stocks, transactions=transactions, 
+                           cursor=encode_transaction_cursor(cursor), users_list=users_list, user_rank=user_rank)    
 
 @app.route("/signup", methods=['GET', 'POST'])
 def signup():
@@ -74,6 +97,8 @@ def signup():
             return render_template('users/signup')
 
         db.session.commit()
+        user_cache.invalidate(user.id)
+        user.update_leaderboard()
         do_login(user)
         return redirect("/")
     else:
@@ -125,7 +150,6 @@ def edit_user():
             flash("Wrong password, try again!", "danger")
             return redirect('/users/edit')
     else: 
-        form.populate_obj(g.user)
         return render_template("/users/edit.html", form=form)
         
 
@@ -157,16 +181,10 @@ def show_portfolio():
         return redirect("/user/portfolio") 
 
     else:
+        User.query.get(g.user.id).update_asset_value()     #before loading the stocks, its commit would expire them
         stocks = Owned_Stock.get_owned_stock_for_user(g.user.id)
-        g.user.update_asset_value()
-        
-        update_toggle = App_Config.query.get(1)
-        if update_toggle.toggle:
-            stock_ids = [stock.Owned_Stock.stock_id for stock in stocks]
-            for stock_id in stock_ids:            #Calls API: Extremely slow, add AXIOS request later 
-                Stock.get_update(stock_id)
+        g.user = User.get_snapshot(g.user.id)
 
-        
         return render_template("/users/portfolio.html",stocks=stocks, form=form)
 
 #********************************** STOCK ROUTES ****************************************
@@ -182,12 +200,13 @@ def show_stocks():
     if form.validate_on_submit():
         input_val = form.data['search']
 
-        #processes string
-        symbol = input_val[input_val.rfind("(")+1:input_val.rfind(")")]
+        #accepts an autocomplete label "Name (SYM)", a symbol or (part of) a name
+        match = Stock.get_search_index().resolve(input_val)
+        if match is None:
+            flash("No matching stock found", "danger")
+            return render_template("/stocks/index.html", form=form)
 
-        s = Stock.query.filter(Stock.stock_symbol == symbol).one()
-        
-        return redirect(f'/stocks/{s.id}')
+        return redirect(f'/stocks/{match.id}')
 
     return render_template("/stocks/index.html", form=form)
 
@@ -217,23 +236,32 @@ def show_stock(stock_id):
 
     else:
         stock = Stock.query.get(stock_id)
+        if stock is None:
+            return "stock not found", 404
         currently_owned = Owned_Stock.get_owned_stock_for_user(g.user.id, stock_id)
         currently_owned = currently_owned[0].Owned_Stock.quantity if currently_owned else 0
         
-        update_toggle = App_Config.query.get(2)
-        
-        if update_toggle.toggle:
+        live = App_Config.get_setting("GET_SMALL_UPDATES")
+        if live:
 
             try:
                 Stock.get_update(stock_id)
             except:                                 
                 flash("Error getting update from external API", "danger")
-        else:
-            with open('util/sample.json') as json_file:         #loads sample data
-                stock.data = json.load(json_file)
 
-        data = stock.data
-        return render_template('/stocks/details.html', stock=stock, data=data, form=form, currently_owned=currently_owned)  #data will be stock.data when get_update is running
+        def render_data():
+            """The parts of the page drawn from the quote data, which only change when the stock is updated."""
+            if live:
+                data = Stock.get_data_fields(stock_id, STOCK_DETAIL_FIELDS)     #only the parts of stock.data the page shows
+            else:
+                data = quote_fixtures.get(stock.stock_symbol)                   #sample data, parsed once and read-only
+            summary = get_template_attribute('/stocks/_details_data.html', 'summary')(data)
+            overview = get_template_attribute('/stocks/_details_data.html', 'overview')(stock, data) if data else ""
+            return summary, overview
+
+        summary, overview = fragment_cache.get_or_render(stock.id, (stock.last_updated, stock.share_price, live), render_data)
+        return render_template('/stocks/details.html', stock=stock, summary=summary, overview=overview, form=form,
+                               currently_owned=currently_owned)
 
     
 
@@ -242,32 +270,381 @@ def show_stock(stock_id):
 def get_stock_json(stock_id):
     """
         Returns JSON data of a particular stock. Used in javscript Axios 
-        for retrieving complete stock data
+        for retrieving complete stock data. The fields query parameter (e.g. price,summaryDetail)
+        selects the parts of the data to return, which are extracted by the database.
     """
     if not g.user:
         return "unauthorized access", 401
 
-    stock = Stock.query.get(stock_id)
-    return jsonify(stock.data)
+    if request.args.get('fields'):
+        try:
+            fields = parse_stock_fields(request.args['fields'])
+        except InvalidFormInput as e:
+            return jsonify({"error": str(e)}), 400
+        data = Stock.get_data_fields(stock_id, fields)
+    else:
+        data = db.session.query(Stock.data).filter(Stock.id == stock_id).scalar()
+
+    if data is None:
+        return "stock not found", 404
+    return jsonify(data)
+
+@app.route('/api/stocks/<int:stock_id>/history')
+def get_stock_history_json(stock_id):
+    """
+        Returns the open, high, low and close share price of a stock over the range query
+        parameter (1d, 5d, 1mo, 3mo, 6mo, 1y, 5y or max, default 1mo), in buckets of interval
+        (1m, 1h or 1d, by default the finest that fits the range). Read from the price rollups.
+    """
+    if not g.user:
+        return "unauthorized access", 401
+
+    try:
+        start, interval = parse_history_params(request.args.get('range', '1mo'), request.args.get('interval'))
+    except InvalidFormInput as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "stock_id": stock_id,
+        "range": request.args.get('range', '1mo'),
+        "interval": interval,
+        "points": Price_Rollup.get_range(stock_id, interval, start)
+    })
 
 @app.route('/api/stocks')
 def get_stock_name_list():
     """
         Returns JSON data of a list of stock names and symbols.
         Used in the javascript Axios get request for autocompletion data.
+        The list is built once from the names and symbols only, and served from memory
+        until the stocks table changes.
     """
     if not g.user:
         return "unauthorized access", 401
 
-    data = []
-    stocks = Stock.query.all()
-    for s in stocks:
-        r = f"{s.name} ({s.stock_symbol})"
-        data.append(r)
-    with open('test.txt', 'w') as f:
-        for item in data:
-            f.write("\"%s\","  % item)
-    return jsonify({"stock_names": [data]})
-  
-        
+    def build():
+        stocks = db.session.query(Stock.name, Stock.stock_symbol).order_by(Stock.id).all()
+        data = [f"{name} ({symbol})" for name, symbol in stocks]
+        return CachedJSON.from_obj({"stock_names": [data]})
+
+    return cached_json_response(listing_cache.get("stock_names", build))
+
+@app.route('/api/stocks/search')
+def search_stocks():
+    """
+        Returns the stocks best matching the q query parameter by symbol or name, best first.
+        Used by the stock search autocompletion. limit sets the number of matches (at most 50).
+    """
+    if not g.user:
+        return "unauthorized access", 401
 
+    limit = min(max(request.args.get('limit', STOCK_SEARCH_LIMIT, type=int), 1), 50)
+    matches = Stock.get_search_index().search(request.args.get('q', ''), limit)
+    return jsonify({
+        "results": [
+            {"id": m.id, "symbol": m.symbol, "name": m.name, "label": f"{m.name} ({m.symbol})"}
+            for m in matches
+        ]
+    })
+
+@app.route('/api/orders/batch', methods=["POST"])
+def submit_batch_orders():
+    """
+        Executes a list of buy and sell orders of the current user, all or nothing (see User.apply_orders).
+        Takes a JSON body, {"orders": [{"stock_id": 1, "type": "buy", "amount": 10}, ...]}, and returns the
+        result of each order. Answers 409 with the rejected order if the batch could not be executed.
+        Only JSON bodies are accepted, which browsers do not send cross-site without CORS.
+    """
+    if not g.user:
+        return "unauthorized access", 401
+
+    try:
+        orders = parse_batch_orders(request.get_json(silent=True))
+    except InvalidFormInput as e:
+        return jsonify({"error": str(e)}), 400
+
+    user = User.query.get(g.user.id)
+    executed, results = user.apply_orders(orders)
+    return jsonify({
+        "executed": executed,
+        "results": results,
+        "current_money": user.current_money
+    }), 200 if executed else 409
+
+@app.route('/api/orders', methods=["GET", "POST"])
+def pending_orders():
+    """
+        GET lists the current user's limit and stop orders, newest first, only those of the status
+        query parameter (open, filled, failed or cancelled) if given. POST places an order from a JSON
+        body, {"stock_id": 1, "type": "buy", "order_type": "limit", "amount": 10, "price": 95.5}, which
+        fills when a refreshed share price reaches price (see Pending_Order).
+    """
+    if not g.user:
+        return "unauthorized access", 401
+
+    if request.method == "GET":
+        orders = Pending_Order.get_user_orders(g.user.id, request.args.get('status'))
+        return jsonify({"orders": [order.serialize() for order in orders]})
+
+    try:
+        order = parse_pending_order(request.get_json(silent=True))
+    except InvalidFormInput as e:
+        return jsonify({"error": str(e)}), 400
+
+    placed = Pending_Order.place(g.user, order["stock_id"], order["type"] == "buy", order["order_type"],
+                                 order["amount"], order["price"])
+    if placed is None:
+        return "stock not found", 404
+    return jsonify(placed.serialize()), 201
+
+@app.route('/api/orders/<int:order_id>', methods=["DELETE"])
+def cancel_pending_order(order_id):
+    """Cancels an open limit or stop order of the current user. Answers 409 if it is no longer open."""
+    if not g.user:
+        return "unauthorized access", 401
+
+    order = Pending_Order.cancel(g.user.id, order_id)
+    if order is None:
+        return "order not found", 404
+    return jsonify(order.serialize()), 200 if order.status == "cancelled" else 409
+
+@app.route('/api/alerts', methods=["GET", "POST"])
+def price_alerts():
+    """
+        GET lists the current user's price alerts, newest first. POST sets an alert from a JSON body,
+        {"stock_id": 1, "kind": "above", "threshold": 120}, kind one of above, below or percent.
+    """
+    if not g.user:
+        return "unauthorized access", 401
+
+    if request.method == "GET":
+        return jsonify({"alerts": [alert.serialize() for alert in Price_Alert.get_user_alerts(g.user.id)]})
+
+    try:
+        alert = parse_price_alert(request.get_json(silent=True))
+    except InvalidFormInput as e:
+        return jsonify({"error": str(e)}), 400
+
+    created = Price_Alert.create(g.user, alert["stock_id"], alert["kind"], alert["threshold"])
+    if created is None:
+        return "stock not found", 404
+    return jsonify(created.serialize()), 201
+
+@app.route('/api/alerts/<int:alert_id>', methods=["DELETE"])
+def delete_price_alert(alert_id):
+    if not g.user:
+        return "unauthorized access", 401
+
+    if not Price_Alert.delete(g.user.id, alert_id):
+        return "alert not found", 404
+    return jsonify({"deleted": alert_id})
+
+@app.route('/api/alerts/triggered')
+def poll_price_alerts():
+    """
+        Returns the current user's alerts triggered since the last poll, oldest first. Each alert is
+        returned by one poll only. Meant to be polled every few seconds instead of reloading stock pages.
+    """
+    if not g.user:
+        return "unauthorized access", 401
+
+    return jsonify({"alerts": Price_Alert.poll(g.user.id)})
+
+@app.route('/api/stream')
+def stream_updates():
+    """
+        Server-Sent Events stream of the current user's portfolio: a "price" event whenever the share
+        price of a held stock changes, followed by a "portfolio" event with their current money,
+        total asset value and net worth, also sent after each of their trades. Updates arrive through
+        the process' broadcaster (see engine/notify.py), and the stream holds no database connection
+        while it waits. Run under an async worker (gunicorn -k gevent, with gunicorn.conf.py making psycopg2
+        cooperative) so idle streams do not hold threads.
+    """
+    if not g.user:
+        return "unauthorized access", 401
+
+    user_id = g.user.id
+    current_money, holdings = User.get_holdings(user_id)
+    broadcaster.start(app.config['SQLALCHEMY_DATABASE_URI'])     #started by gunicorn.conf.py, except under `flask run`
+    subscriber = broadcaster.subscribe(user_id, holdings)
+
+    def stream():
+        portfolio = Portfolio(current_money, holdings)
+        try:
+            yield b"retry: 5000\n\n" + portfolio.event()
+            while True:
+                updates = subscriber.get(STREAM_HEARTBEAT)
+                if not updates:
+                    yield b": keep-alive\n\n"      #lets the server notice closed connections
+                    continue
+
+                if any(update[0] == "portfolio" for update in updates):
+                    with app.app_context():
+                        money, held = User.get_holdings(user_id) or (0, {})
+                    portfolio = Portfolio(money, held)
+                    broadcaster.follow(subscriber, held)
+
+                events = []
+                for update in updates:
+                    if update[0] == "price":
+                        _, stock_id, price, event = update
+                        portfolio.prices[stock_id] = price
+                        events.append(event)
+                events.append(portfolio.event())
+                yield b"".join(events)
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/api/users/<int:user_id>/transactions')
+def get_user_transactions_json(user_id):
+    """
+        Returns a page of the user's transaction history, newest first. The cursor query parameter
+        is the next_cursor of the previous page. Used by the home page to load older transactions.
+    """
+    if not g.user:
+        return "unauthorized access", 401
+    if g.user.id != user_id:
+        return "forbidden", 403
+
+    limit = min(max(request.args.get('limit', TRANSACTION_PAGE_SIZE, type=int), 1), 100)
+    before = None
+    if request.args.get('cursor'):
+        try:
+            before = decode_transaction_cursor(request.args['cursor'])
+        except InvalidFormInput as e:
+            return jsonify({"error": str(e)}), 400
+
+    transactions, cursor = Transaction.get_user_transactions_page(user_id, before, limit)
+    return jsonify({
+        "transactions": [t.serialize() for t in transactions],
+        "next_cursor": encode_transaction_cursor(cursor)
+    })
+
+@app.route('/api/users/<int:user_id>/transactions/export')
+def export_user_transactions(user_id):
+    """
+        Streams the user's complete transaction ledger as a csv (default) or ndjson
+        file download, chosen with the format query parameter.
+    """
+    if not g.user:
+        return "unauthorized access", 401
+    if g.user.id != user_id:
+        return "forbidden", 403
+
+    format = request.args.get('format', 'csv')
+    if format not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+
+    return Response(
+        stream_with_context(export_transactions(format, user_id)),
+        mimetype=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f"attachment; filename=transactions-{user_id}.{format}"}
+    )
+
+@app.route('/api/leaderboard')
+def get_leaderboard_json():
+    """
+        Returns a page of the user ranking by net worth, along with the current user's rank.
+        Accepts page and per_page (at most 100) query parameters.
+    """
+    if not g.user:
+        return "unauthorized access", 401
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 25, type=int), 1), 100)
+
+    leaderboard = User.get_leaderboard()
+    return jsonify({
+        "page": page,
+        "per_page": per_page,
+        "total": len(leaderboard),
+        "users": leaderboard.page(page, per_page),
+        "me": leaderboard.entry(g.user.id)
+    })
+
+@app.route('/metrics')
+def get_metrics():
+    """Request latency, SQL query and quote api metrics of this process, for Prometheus to scrape."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/quotes/stats')
+def get_quote_cache_stats():
+    """
+        Returns the quote cache's hit, miss and coalesced counters for this process.
+        Used for tuning QUOTE_CACHE_TTL against the external api quota.
+    """
+    if not g.user:
+        return "unauthorized access", 401
+
+    return jsonify(quote_cache.stats())
+
+@app.route('/api/fragments/stats')
+def get_fragment_cache_stats():
+    """
+        Returns the size and hit and miss counters of this process' cache of rendered stock page parts.
+        Used for tuning FRAGMENT_CACHE_BYTES.
+    """
+    if not g.user:
+        return "unauthorized access", 401
+
+    return jsonify(fragment_cache.stats())
+
+# *********************************** CLI ************************************************
+@app.cli.command('export-transactions')
+@click.option('--user-id', type=int, help="only export this user's transactions")
+@click.option('--format', 'format', type=click.Choice(list(EXPORT_FORMATS)), default='csv')
+@click.option('--output', type=click.File('w'), default='-', help="file to write to, stdout by default")
+def export_transactions_command(user_id, format, output):
+    """Streams the transactions ledger of one or all users as csv or ndjson."""
+    for chunk in export_transactions(format, user_id):
+        output.write(chunk)
+
+@app.cli.command('set-toggle')
+@click.argument('name', type=click.Choice([name for name, (kind, default) in SETTINGS.items() if kind is bool]))
+@click.argument('state', type=click.Choice(['on', 'off', 'flip']), default='flip')
+def set_toggle_command(name, state):
+    """Turns a boolean runtime setting on or off, or flips it. Running processes reload it within CONFIG_MAX_AGE."""
+    toggle = App_Config.set_toggle(name, None if state == 'flip' else state == 'on')
+    click.echo(f"{name} is {'on' if toggle else 'off'}")
+
+@app.cli.group('seed')
+def seed_command():
+    """
+        Bulk loads CSV files (without header lines, unless --header is given) of stocks, users,
+        holdings or transactions, or generates synthetic users and transactions. Loading a file
+        again changes nothing. See engine/seeding.py for the columns of each file.
+    """
+
+def seed_file_command(name, load, columns):
+    """Adds `flask seed <name> FILE`, loading FILE with load in one transaction."""
+    @seed_command.command(name, help=f"Loads {name} from a CSV file of {', '.join(columns)}.")
+    @click.argument('csv_file', type=click.File('rb'))
+    @click.option('--header', is_flag=True, help="skip the first line of the file")
+    def command(csv_file, header):
+        started = time.perf_counter()
+        count = load(csv_file, header)
+        db.session.commit()
+        seeding.after_seeding()
+        click.echo(f"{count} {name} inserted or changed in {time.perf_counter() - started:.1f}s")
+
+seed_file_command("stocks", seeding.load_stocks, seeding.STOCK_COLUMNS)
+seed_file_command("users", seeding.load_users, seeding.USER_COLUMNS)
+seed_file_command("holdings", seeding.load_holdings, seeding.HOLDING_COLUMNS)
+seed_file_command("transactions", seeding.load_transactions, seeding.TRANSACTION_COLUMNS)
+
+@seed_command.command('synthetic')
+@click.option('--users', type=int, default=0, help="synthetic users to add, named synthetic0, synthetic1, ...")
+@click.option('--password', default="synthetic", help="password of the synthetic users")
+@click.option('--transactions', type=int, default=1000000, help="random transactions of existing users and stocks to add")
+@click.option('--seed', type=int, default=0, help="seed of the random transactions")
+def seed_synthetic_command(users, password, transactions, seed):
+    """Generates users and random transactions in the database, for benchmarks and load tests."""
+    started = time.perf_counter()
+    added_users = seeding.generate_users(users, password) if users else 0
+    added_transactions = seeding.generate_transactions(transactions, seed=seed) if transactions else 0
+    db.session.commit()
+    seeding.after_seeding()
+    click.echo(f"{added_users} users and {added_transactions} transactions added in {time.perf_counter() - started:.1f}s")
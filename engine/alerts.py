@@ -0,0 +1,83 @@
+"""In-process index of the thresholds of active price alerts, checked against every new quote."""
+from datetime import timedelta
+import logging
+import threading
+
+from engine.constants import ALERTS_MAX_AGE, ALERTS_RELOAD_AGE
+from engine.matching import ThresholdIndex
+
+logger = logging.getLogger(__name__)
+
+ALERT_KINDS = ("above", "below", "percent")
+SYNC_OVERLAP = timedelta(minutes=1)     #syncs also read alerts created this long before the last read, to allow for late commits and clock skew
+
+
+def alert_thresholds(kind, threshold, reference_price):
+    """
+        The (price, at_or_below) thresholds of an alert: threshold itself for above and below
+        alerts, and threshold percent either side of reference_price for a percent move.
+    """
+    if kind == "above":
+        return [(threshold, False)]
+    if kind == "below":
+        return [(threshold, True)]
+    move = reference_price * threshold / 100
+    return [(reference_price + move, False), (reference_price - move, True)]
+
+
+class AlertIndex(ThresholdIndex):
+    """
+        The thresholds of every active price alert, in per stock heaps (see ThresholdIndex), so a
+        quote only looks at the alerts it crosses. A percent alert has a threshold on either side,
+        and triggers on the first one reached. With up to millions of alerts, a full reload takes
+        seconds, so alerts set in other processes are synced every max_age seconds, and the whole
+        index is only reloaded every reload_age seconds, in a thread of its own while the current
+        index stays in use (see reload_in_background).
+    """
+
+    def __init__(self, max_age=ALERTS_MAX_AGE, reload_age=ALERTS_RELOAD_AGE):
+        super().__init__(max_age, reload_age)
+        self._loader = None
+
+    def reload_in_background(self, load):
+        """Starts load(), which does a full load of the index, in a thread unless one is already running."""
+        with self._lock:
+            if self._loader is not None and self._loader.is_alive():
+                return
+            self._loader = threading.Thread(target=self._reload, args=(load,), daemon=True)
+            self._loader.start()
+
+    def wait(self, timeout=None):
+        """Waits for a running reload to finish. Returns whether the index is loaded."""
+        loader = self._loader
+        if loader is not None:
+            loader.join(timeout)
+        return self.loaded_at is not None
+
+    @staticmethod
+    def _reload(load):
+        try:
+            load()
+        except Exception:
+            logger.exception("loading the price alerts failed")     #the next use of the index starts another load
+
+    @staticmethod
+    def _thresholds(rows):
+        return (
+            (alert_id, stock_id, alert_thresholds(kind, threshold, reference_price))
+            for alert_id, stock_id, kind, threshold, reference_price in rows
+        )
+
+    def load(self, rows, as_of=None):
+        """Replaces the index with rows of active alerts, (alert_id, stock_id, kind, threshold, reference_price)."""
+        self.load_thresholds(self._thresholds(rows), as_of)
+
+    def sync(self, rows, as_of=None):
+        """Adds the alerts of rows, as in load, that the index does not have yet."""
+        self.sync_thresholds(self._thresholds(rows), as_of)
+
+    def add(self, alert_id, stock_id, kind, threshold, reference_price):
+        self.add_thresholds(alert_id, stock_id, alert_thresholds(kind, threshold, reference_price))
+
+
+alert_index = AlertIndex()
@@ -0,0 +1,66 @@
+"""In-process registry of the runtime settings stored in the app_config table."""
+import threading
+import time
+
+from engine.constants import CONFIG_MAX_AGE
+
+#every setting the app reads, name -> (type, default). Booleans are stored in App_Config.toggle,
+#other types as text in App_Config.value
+SETTINGS = {
+    "GET_LARGE_UPDATES": (bool, False),     #the refresh worker updates stock prices (engine/refresh.py)
+    "GET_SMALL_UPDATES": (bool, False),     #stock details pages fetch a fresh quote for their stock
+}
+
+
+class RuntimeConfig():
+    """
+        The settings of SETTINGS by name, converted to their types, with defaults for settings that
+        have no row. Loaded from the database in one query and reloaded once older than max_age
+        seconds, or sooner when invalidated, by a change in this process or a notification of a
+        change in another (see engine/notify.py), so reading a setting does no I/O.
+    """
+
+    def __init__(self, max_age=CONFIG_MAX_AGE):
+        self.max_age = max_age
+        self.loaded_at = None
+
+        self._lock = threading.Lock()
+        self._values = {name: default for name, (kind, default) in SETTINGS.items()}
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age
+
+    def invalidate(self):
+        """Forces a reload on the next read."""
+        self.loaded_at = None
+
+    def load(self, rows):
+        """
+            Replaces the settings with rows of (name, value, toggle). Rows of unknown settings are
+            ignored, and values that do not convert to their setting's type fall back to its default.
+        """
+        values = {name: default for name, (kind, default) in SETTINGS.items()}
+        for name, value, toggle in rows:
+            if name in SETTINGS:
+                values[name] = convert(name, value, toggle)
+
+        with self._lock:
+            self._values = values
+            self.loaded_at = time.monotonic()
+
+    def get(self, name):
+        return self._values[name]
+
+
+def convert(name, value, toggle):
+    """The typed value of a setting from its App_Config columns."""
+    kind, default = SETTINGS[name]
+    if kind is bool:
+        return default if toggle is None else toggle
+    try:
+        return default if value is None else kind(value)
+    except ValueError:
+        return default
+
+
+runtime_config = RuntimeConfig()
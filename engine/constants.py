@@ -1,15 +1,71 @@
 
 from flask import Flask
 from secrets import keys
+from datetime import timedelta
 import os
 CURR_USER_KEY = "curr_user"
 
+#external quote api (yahoo finance hosted on rapid-api)
+QUOTE_URL = os.environ.get('QUOTE_URL', "https://apidojo-yahoo-finance-v1.p.rapidapi.com/stock/get-detail")
+QUOTE_HEADERS = {
+    'x-rapidapi-host': "apidojo-yahoo-finance-v1.p.rapidapi.com",
+    'x-rapidapi-key': keys["rapid_api"]
+}
+QUOTE_MAX_WORKERS = int(os.environ.get('QUOTE_MAX_WORKERS', 8))     #max concurrent requests to the quote api
+QUOTE_TIMEOUT = float(os.environ.get('QUOTE_TIMEOUT', 5))           #seconds, per quote request
+QUOTE_CACHE_TTL = float(os.environ.get('QUOTE_CACHE_TTL', 60))      #seconds a quote is considered fresh
+#offline quotes (engine/fixtures.py), shown on stock pages while GET_SMALL_UPDATES is off
+QUOTE_FIXTURE_PATH = os.environ.get('QUOTE_FIXTURE_PATH', 'util/sample.json')   #payload of symbols without a file of their own
+QUOTE_FIXTURE_DIR = os.environ.get('QUOTE_FIXTURE_DIR')                         #optional directory of <SYMBOL>.json payloads
+
+#background price refresh worker (python -m engine.refresh)
+REFRESH_INTERVAL = float(os.environ.get('REFRESH_INTERVAL', 60))    #seconds between refresh cycles
+REFRESH_BATCH_SIZE = int(os.environ.get('REFRESH_BATCH_SIZE', 50))  #stocks not held by anyone refreshed per cycle
+#trades between full revaluations of a user's total_asset_value (see User.adjust_asset_value)
+ASSET_RECONCILE_INTERVAL = int(os.environ.get('ASSET_RECONCILE_INTERVAL', 20))
+#user rankings on the home page
+LEADERBOARD_MAX_AGE = float(os.environ.get('LEADERBOARD_MAX_AGE', 30))     #seconds before the ranking is reloaded from the database
+LEADERBOARD_TOP_N = 10                                                      #users shown on the home page
+TRANSACTION_PAGE_SIZE = 25          #transactions per page of history, on the home page and /api/users/<id>/transactions
+EXPORT_BATCH_SIZE = 5000            #rows fetched from the server-side cursor, and written, at a time by ledger exports
+STOCK_SEARCH_LIMIT = 10             #default number of matches returned by /api/stocks/search (at most 50)
+LISTING_MAX_AGE = float(os.environ.get('LISTING_MAX_AGE', 300))    #seconds before the cached stock names and symbols are rebuilt (engine/symbols.py)
+#Stock.data subtrees loaded by the stock details page, and the most a request to /api/stocks/<id> may select
+STOCK_DETAIL_FIELDS = ("summaryProfile", "summaryDetail", "financialData")
+STOCK_MAX_FIELDS = 20
+FRAGMENT_CACHE_BYTES = int(os.environ.get('FRAGMENT_CACHE_BYTES', 8 * 1024 * 1024))  #rendered stock page fragments kept per process
+BATCH_MAX_ORDERS = 100              #orders accepted by one request to /api/orders/batch
+#price history (see Price_History and Price_Rollup), charted by /api/stocks/<id>/history
+PRICE_INTERVALS = {"1m": timedelta(minutes=1), "1h": timedelta(hours=1), "1d": timedelta(days=1)}   #rollup bucket sizes
+HISTORY_RANGES = {
+    "1d": timedelta(days=1), "5d": timedelta(days=5), "1mo": timedelta(days=31), "3mo": timedelta(days=92),
+    "6mo": timedelta(days=183), "1y": timedelta(days=366), "5y": timedelta(days=1827), "max": None
+}
+HISTORY_MAX_POINTS = 1500           #buckets a history request may return, which decides the default interval of a range
+#limit and stop orders (engine/matching.py) and price alerts (engine/alerts.py), checked against each new quote
+MATCHING_MAX_AGE = float(os.environ.get('MATCHING_MAX_AGE', 30))      #seconds before the books of pending orders are reloaded from the database
+ALERTS_MAX_AGE = float(os.environ.get('ALERTS_MAX_AGE', 30))          #seconds before price alerts set in other processes are synced
+ALERTS_RELOAD_AGE = float(os.environ.get('ALERTS_RELOAD_AGE', 3600))  #seconds before all active price alerts are reloaded from the database
+#live prices and portfolio values (engine/notify.py, served on /api/stream)
+STREAM_HEARTBEAT = 15               #seconds between keep-alive comments on idle /api/stream connections
+#current user details cached per process (engine/user_cache.py)
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))       #users kept, least recently seen dropped first
+USER_CACHE_MAX_AGE = float(os.environ.get('USER_CACHE_MAX_AGE', 5))   #seconds before a user's details are reloaded from the database
+#runtime settings of the app_config table (engine/config.py)
+CONFIG_MAX_AGE = float(os.environ.get('CONFIG_MAX_AGE', 10))    #seconds before the settings are reloaded from the database
+#instrumentation (engine/metrics.py, served on /metrics)
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1))  #share of requests timed and query counted, 0 to 1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))   #runs of one statement in a request flagged as N+1
+#development aids, both slow down every request
+SQLALCHEMY_ECHO = os.environ.get('SQLALCHEMY_ECHO', 'false').lower() == 'true'
+DEBUG_TOOLBAR = os.environ.get('DEBUG_TOOLBAR', 'false').lower() == 'true'
+
 def setup_app_config():
 
     app = Flask(__name__)
     app.config['SQLALCHEMY_DATABASE_URI'] = (os.environ.get('DATABASE_URL', 'postgres:///stocks-app'))
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config['SQLALCHEMY_ECHO'] = True
+    app.config['SQLALCHEMY_ECHO'] = SQLALCHEMY_ECHO
 
     
 
@@ -1,9 +1,15 @@
-from flask import Flask, render_template, request, flash, redirect, session, jsonify, g
+from flask import Flask, render_template, request, flash, redirect, session, jsonify, g, Response
 from models import db, connect_db, User, Stock, Owned_Stock, Transaction, App_Config
 from engine.constants import * 
 from engine.exceptions import * 
+from engine.matching import ORDER_TYPES
+from engine.alerts import ALERT_KINDS
+from engine.user_cache import user_cache
+from engine.config import runtime_config, SETTINGS
+from engine.seeding import load_stocks, after_seeding
+from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime
-import csv
+import re
 
 def do_login(user):
     """Log in user."""
@@ -20,9 +26,12 @@ def do_logout():
     
 def authenticate_user_edit(form):
     """Verifies user password when submitting user edit form"""
-    if User.authenticate(g.user.username, form.password.data):
-            db.session.add(g.user)
+    user = User.authenticate(g.user.username, form.password.data)
+    if user:
+            db.session.add(user)
             db.session.commit()
+            user_cache.invalidate(user.id)
+            user.update_leaderboard()
             return True
 
     return False
@@ -55,14 +64,15 @@ def do_transaction(form):
     stock_id = form.data['stock_id']
     amount = form.data['amount']
     transaction_type = form.data["transaction_type"]
+    user = User.query.get(g.user.id)     #g.user is a read-only snapshot
 
     if transaction_type == "buy":
-        if g.user.buy_stock(amount, stock_id):
+        if user.buy_stock(amount, stock_id):
             return True
         else:
             return False
     if transaction_type == "sell":
-        if g.user.sell_stock(amount, stock_id):
+        if user.sell_stock(amount, stock_id):
             return True
         else:
             return False
@@ -70,53 +80,176 @@ def do_transaction(form):
 def update_user_stocks(owned_stocks):
     """
         Takes a list of OwnedStocks as owned_stocks, and updates them using the external API.
-        This can be time consuming given that the external api takes around 1 second per stock
-        when getting updates.
+        The quotes are fetched concurrently and written back in one commit, so this takes
+        about as long as the slowest quote rather than around 1 second per stock.
     """
-    
-    update_success = True
+    stock_ids = [stock.Owned_Stock.stock_id for stock in owned_stocks]
+    if not stock_ids:
+        return True
+
+    stocks = Stock.query.filter(Stock.id.in_(stock_ids)).all()
+    return Stock.update_many(stocks)
+
+def parse_batch_orders(payload):
+    """
+        Validates the JSON body of /api/orders/batch, {"orders": [{"stock_id": 1, "type": "buy", "amount": 10}, ...]},
+        and returns its list of orders (see User.apply_orders). Raises InvalidFormInput, naming the first invalid
+        order, if the body is not of that shape, a type is not buy or sell, a stock_id or amount is not a positive
+        integer, or there are more than BATCH_MAX_ORDERS orders.
+    """
+    orders = payload.get("orders") if isinstance(payload, dict) else None
+    if not isinstance(orders, list) or not orders:
+        raise InvalidFormInput("orders", "missing", "body must be a JSON object with a non-empty list of orders")
+    if len(orders) > BATCH_MAX_ORDERS:
+        raise InvalidFormInput("orders", len(orders), f"at most {BATCH_MAX_ORDERS} orders can be submitted at once")
+
+    return [parse_order(order, f"orders[{i}]") for i, order in enumerate(orders)]
+
+def parse_order(order, name="order"):
+    """
+        Validates one order of a JSON body, {"stock_id": 1, "type": "buy", "amount": 10}, and returns a
+        dict of just those keys. Raises InvalidFormInput if it is not of that shape, the type is not buy
+        or sell, or the stock_id or amount is not a positive integer. name is the order's name in errors.
+    """
+    if not isinstance(order, dict):
+        raise InvalidFormInput(name, order, "order must be an object")
+    if order.get("type") not in ("buy", "sell"):
+        raise InvalidFormInput(f"{name}.type", order.get("type"), "type must be buy or sell")
+    for field in ("stock_id", "amount"):
+        value = order.get(field)
+        if type(value) is not int or value < 1:     #bools are ints, but not valid here
+            raise InvalidFormInput(f"{name}.{field}", value, f"{field} must be a positive integer")
+
+    return {"stock_id": order["stock_id"], "type": order["type"], "amount": order["amount"]}
+
+def parse_pending_order(payload):
+    """
+        Validates the JSON body of a new limit or stop order, an order (see parse_order) with an
+        order_type of limit or stop and the trigger price, and returns it as a dict. Raises
+        InvalidFormInput if any of them is missing or invalid.
+    """
+    order = parse_order(payload)
+
+    if payload.get("order_type") not in ORDER_TYPES:
+        raise InvalidFormInput("order_type", payload.get("order_type"), f"order_type must be one of {', '.join(ORDER_TYPES)}")
+    price = payload.get("price")
+    if type(price) not in (int, float) or not 0 < price < float("inf"):
+        raise InvalidFormInput("price", price, "price must be a positive number")
+
+    order.update(order_type=payload["order_type"], price=price)
+    return order
+
+def parse_price_alert(payload):
+    """
+        Validates the JSON body of a new price alert, {"stock_id": 1, "kind": "above", "threshold": 120},
+        kind one of above, below or percent (a move of threshold percent either way), and returns it as a
+        dict. Raises InvalidFormInput if any of them is missing or invalid.
+    """
+    if not isinstance(payload, dict):
+        raise InvalidFormInput("alert", payload, "body must be a JSON object")
+    stock_id, kind, threshold = payload.get("stock_id"), payload.get("kind"), payload.get("threshold")
+
+    if type(stock_id) is not int or stock_id < 1:
+        raise InvalidFormInput("stock_id", stock_id, "stock_id must be a positive integer")
+    if kind not in ALERT_KINDS:
+        raise InvalidFormInput("kind", kind, f"kind must be one of {', '.join(ALERT_KINDS)}")
+    if type(threshold) not in (int, float) or not 0 < threshold < float("inf"):
+        raise InvalidFormInput("threshold", threshold, "threshold must be a positive number")
+
+    return {"stock_id": stock_id, "kind": kind, "threshold": threshold}
 
-    for stock in owned_stocks:          #TODO: AJAX requests. It is too slow on its own
-        if not Stock.get_update(stock.Owned_Stock.stock_id):
-            update_success=False
-    if not update_success:
-        return False
-    return True
+def encode_transaction_cursor(cursor):
+    """Encodes a (time, id) cursor from Transaction.get_user_transactions_page as a url safe string"""
+    if cursor is None:
+        return None
+    time, transaction_id = cursor
+    return f"{time.isoformat()}_{transaction_id}"
+
+def decode_transaction_cursor(cursor):
+    """Decodes a cursor made by encode_transaction_cursor. Raises InvalidFormInput if it is malformed."""
+    try:
+        time, transaction_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(time), int(transaction_id)
+    except ValueError:
+        raise InvalidFormInput("cursor", cursor, "cursor is not valid")
+
+def parse_stock_fields(fields):
+    """
+        Splits a comma separated fields parameter of /api/stocks/<id> into Stock.data paths
+        (see Stock.get_data_fields). Raises InvalidFormInput if a field is not a dotted path
+        of plain keys or there are more than STOCK_MAX_FIELDS fields.
+    """
+    parsed = [field.strip() for field in fields.split(",") if field.strip()]
+    if len(parsed) > STOCK_MAX_FIELDS:
+        raise InvalidFormInput("fields", fields, f"at most {STOCK_MAX_FIELDS} fields can be selected")
+    for field in parsed:
+        if not re.fullmatch(r"\w+(\.\w+)*", field):
+            raise InvalidFormInput("fields", field, "field is not valid")
+    return parsed
+
+def parse_history_params(range_name, interval=None):
+    """
+        Validates the range and interval parameters of /api/stocks/<id>/history and returns the
+        start of the range (None for "max") and the rollup interval to read. Without an interval,
+        the finest one giving at most HISTORY_MAX_POINTS buckets over the range is chosen.
+        Raises InvalidFormInput for an unknown range or interval, or an interval too fine for the range.
+    """
+    if range_name not in HISTORY_RANGES:
+        raise InvalidFormInput("range", range_name, f"range must be one of {', '.join(HISTORY_RANGES)}")
+    span = HISTORY_RANGES[range_name]
+
+    if interval is None:
+        fitting = [name for name, size in PRICE_INTERVALS.items() if span is not None and span / size <= HISTORY_MAX_POINTS]
+        interval = min(fitting, key=PRICE_INTERVALS.get) if fitting else max(PRICE_INTERVALS, key=PRICE_INTERVALS.get)
+    elif interval not in PRICE_INTERVALS:
+        raise InvalidFormInput("interval", interval, f"interval must be one of {', '.join(PRICE_INTERVALS)}")
+    elif span is not None and span / PRICE_INTERVALS[interval] > HISTORY_MAX_POINTS:
+        raise InvalidFormInput("interval", interval, f"interval is too fine for a range of {range_name}")
+
+    start = datetime.now() - span if span is not None else None
+    return start, interval
+
+def cached_json_response(cached):
+    """
+        Makes a response from a CachedJSON. Answers 304 Not Modified when the client already has
+        the current version (If-None-Match), and sends the gzipped body to clients that accept it.
+    """
+    use_gzip = bool(request.accept_encodings['gzip'])
+    etag = f"{cached.etag}-gz" if use_gzip else cached.etag
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif use_gzip:
+        response = Response(cached.gzipped, mimetype="application/json")
+        response.headers['Content-Encoding'] = "gzip"
+    else:
+        response = Response(cached.body, mimetype="application/json")
+
+    response.set_etag(etag)
+    response.headers['Vary'] = "Accept-Encoding"
+    response.headers['Cache-Control'] = "private, no-cache"      #revalidate with the etag on every use
+    return response
 
 def seed_stock_symbol_and_names():
-    """Seeds stock database table with names and symbols of each stock."""
-    with open('util/stock_seed_data.csv') as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=',')
-        for row in csv_reader:
-            s = Stock()
-            s.stock_symbol = row[0]
-            s.name = row[1]
-            s.last_updated = datetime.now()
-            db.session.add(s)
+    """Seeds stock database table with the symbol, name and sector of each stock, in one COPY (see engine/seeding.py)."""
+    with open('util/stock_seed_data.csv', 'rb') as csv_file:
+        load_stocks(csv_file)
 
     db.session.commit()
-
-def clean_empty(d):
-    """Removes empty entries (entries that evaluate to false) in a dictionary object"""
-    if not isinstance(d, (dict, list)):
-        return d
-    if isinstance(d, list):
-        return [v for v in (clean_empty(v) for v in d) if v]
-    return {k: v for k, v in ((k, clean_empty(v)) for k, v in d.items()) if v}
+    after_seeding()
 
 def setup_app_config():
-    a = App_Config(name="GET_LARGE_UPDATES", toggle=False)  
-    b = App_Config(name="GET_SMALL_UPDATES", toggle=False) 
-    db.session.add_all([a,b])
+    """Sets every runtime setting to its default, adding the app_config rows that are missing."""
+    stmt = insert(App_Config.__table__).values([
+        {"name": name, "toggle": default if kind is bool else None, "value": None if kind is bool else str(default)}
+        for name, (kind, default) in SETTINGS.items()
+    ])
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[App_Config.name],
+        set_={"toggle": stmt.excluded.toggle, "value": stmt.excluded.value}
+    ))
     db.session.commit()
-
-def clean_empty(d):
-    """Removes empty entries (entries that evaluate to false) in a dictionary object"""
-    if not isinstance(d, (dict, list)):
-        return d
-    if isinstance(d, list):
-        return [v for v in (clean_empty(v) for v in d) if v]
-    return {k: v for k, v in ((k, clean_empty(v)) for k, v in d.items()) if v}
+    runtime_config.invalidate()
 
 
 def connect_db(app):
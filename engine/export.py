@@ -0,0 +1,87 @@
+"""Streams the transactions ledger as CSV or NDJSON in constant memory."""
+import csv
+import io
+import json
+
+from models import db, Transaction
+from engine.constants import EXPORT_BATCH_SIZE
+
+EXPORT_COLUMNS = ("id", "user_id", "stock_id", "stock_symbol", "time", "quantity", "stock_value_at_time", "is_purchase")
+#formatting the object directly is much faster than json.dumps of a dict per row
+NDJSON_LINE = '{{"id": {}, "user_id": {}, "stock_id": {}, "stock_symbol": {}, "time": "{}", "quantity": {}, ' \
+              '"stock_value_at_time": {}, "is_purchase": {}}}'
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson"
+}
+
+
+def iter_transaction_rows(user_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+        Yields the rows of the transactions table (of one user, or of all users if user_id is None)
+        as tuples of EXPORT_COLUMNS, ordered by user, time and id. Rows are read from a server-side
+        cursor batch_size at a time, without building ORM objects.
+    """
+    table = Transaction.__table__
+    query = db.select([table.c[column] for column in EXPORT_COLUMNS]) \
+        .order_by(table.c.user_id, table.c.time, table.c.id)
+    if user_id is not None:
+        query = query.where(table.c.user_id == user_id)
+
+    compiled = query.compile(dialect=db.engine.dialect)
+
+    conn = db.engine.raw_connection()       #plain dbapi tuples, without result proxy overhead
+    try:
+        cursor = conn.cursor(name="export_transactions")    #named, so psycopg2 uses a server-side cursor
+        cursor.execute(str(compiled), compiled.params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+        cursor.close()
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def iter_csv(rows, batch_size=EXPORT_BATCH_SIZE):
+    """Yields rows as CSV text with a header line, in chunks of batch_size rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def iter_ndjson(rows, batch_size=EXPORT_BATCH_SIZE):
+    """Yields rows as newline delimited JSON objects, in chunks of batch_size rows."""
+    dumps = json.dumps
+    lines = []
+
+    for id, user_id, stock_id, stock_symbol, time, quantity, stock_value_at_time, is_purchase in rows:
+        lines.append(NDJSON_LINE.format(id, user_id, stock_id, dumps(stock_symbol), time.isoformat(), quantity,
+                                        dumps(stock_value_at_time), "true" if is_purchase else "false"))
+        if len(lines) == batch_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def export_transactions(format, user_id=None):
+    """Yields the transactions ledger in format ("csv" or "ndjson"), see iter_transaction_rows."""
+    rows = iter_transaction_rows(user_id)
+    if format == "csv":
+        return iter_csv(rows)
+    if format == "ndjson":
+        return iter_ndjson(rows)
+    raise ValueError(f"unknown export format {format}")
@@ -0,0 +1,70 @@
+"""Offline quote payloads, read from files once and shared read-only by every request."""
+from types import MappingProxyType
+import json
+import os
+import re
+import threading
+
+from engine.constants import QUOTE_FIXTURE_PATH, QUOTE_FIXTURE_DIR
+
+FIXTURE_SYMBOL = re.compile(r"^[A-Za-z0-9.^=-]{1,10}$")     #symbols that may name a file in the fixture directory
+
+
+def freeze(payload):
+    """A read-only copy of a decoded JSON payload: dicts become mapping proxies and lists tuples."""
+    if isinstance(payload, dict):
+        return MappingProxyType({key: freeze(value) for key, value in payload.items()})
+    if isinstance(payload, list):
+        return tuple(freeze(value) for value in payload)
+    return payload
+
+
+class QuoteFixtures():
+    """
+        get-detail payloads for working without the quote api: the payload of path for every
+        symbol, or of directory/<SYMBOL>.json for symbols that have one. Each file is read and
+        parsed once. get returns the shared frozen payload, which templates can read but no one
+        can change, so it never ends up in a Stock row by accident.
+    """
+
+    def __init__(self, path=QUOTE_FIXTURE_PATH, directory=QUOTE_FIXTURE_DIR):
+        self.path = path
+        self.directory = directory
+
+        self._lock = threading.Lock()
+        self._files = {}        #path -> frozen payload
+        self._paths = {}        #symbol -> path of its payload
+
+    def get(self, symbol=None):
+        """The frozen payload of symbol, or of path when there is no symbol."""
+        return self._load(self._path(symbol))
+
+    def clear(self):
+        """Forgets the parsed files, so they are read again."""
+        with self._lock:
+            self._files = {}
+            self._paths = {}
+
+    def _path(self, symbol):
+        if symbol is None or not self.directory:
+            return self.path
+
+        path = self._paths.get(symbol)
+        if path is None:
+            own = os.path.join(self.directory, f"{symbol}.json")
+            path = own if FIXTURE_SYMBOL.match(symbol) and os.path.isfile(own) else self.path
+            self._paths[symbol] = path
+        return path
+
+    def _load(self, path):
+        loaded = self._files.get(path)
+        if loaded is None:
+            with self._lock:
+                loaded = self._files.get(path)
+                if loaded is None:
+                    with open(path) as json_file:
+                        loaded = self._files[path] = freeze(json.load(json_file))
+        return loaded
+
+
+quote_fixtures = QuoteFixtures()
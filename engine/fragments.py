@@ -0,0 +1,80 @@
+"""Per-process cache of rendered template fragments that change only with the data they show."""
+from collections import OrderedDict
+import threading
+
+from engine.constants import FRAGMENT_CACHE_BYTES
+
+
+class FragmentCache():
+    """
+        LRU cache of rendered fragments, one version per name: a fragment is cached under a name
+        (like a stock id) with the version of the data it was rendered from (like the stock's
+        last_updated), and a request for another version renders it again and replaces it. The
+        characters of all fragments are kept under max_bytes, dropping the least recently used
+        first. hits and misses are counted.
+    """
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._fragments = OrderedDict()     #name -> (version, fragments, size), least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def get_or_render(self, name, version, render):
+        """
+            The fragments cached for name at version, or else render(), a string or a tuple of
+            strings, which is cached unless it alone is over max_bytes. Concurrent misses may each render.
+        """
+        with self._lock:
+            cached = self._fragments.get(name)
+            if cached is not None and cached[0] == version:
+                self._fragments.move_to_end(name)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        fragments = render()
+        size = sum(len(fragment) for fragment in fragments) if isinstance(fragments, tuple) else len(fragments)
+
+        with self._lock:
+            self._discard(name)
+            if size <= self.max_bytes:
+                self._fragments[name] = (version, fragments, size)
+                self.size += size
+                while self.size > self.max_bytes:
+                    self.size -= self._fragments.popitem(last=False)[1][2]
+        return fragments
+
+    def invalidate(self, name):
+        with self._lock:
+            self._discard(name)
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+            self.size = 0
+
+    def _discard(self, name):
+        cached = self._fragments.pop(name, None)
+        if cached is not None:
+            self.size -= cached[2]
+
+    def stats(self):
+        """Counters since startup, as a dict."""
+        with self._lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "bytes": self.size,
+                "fragments": len(self._fragments),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,98 @@
+"""In-process ranking of users by net worth (current_money + total_asset_value)."""
+from bisect import bisect_left, insort
+import threading
+import time
+
+from engine.constants import LEADERBOARD_MAX_AGE
+
+
+class Leaderboard():
+    """
+        Keeps every user's (-net_worth, user_id) key in a sorted list, so a user's rank is a
+        binary search and a page of the ranking is a slice. Equal net worths are ordered by
+        user id. The ranking is loaded from the database in one projected query, updated in place
+        when a user's balances change in this process, and reloaded once it is older than
+        max_age seconds to pick up changes made by other processes.
+    """
+
+    def __init__(self, max_age=LEADERBOARD_MAX_AGE):
+        self.max_age = max_age
+        self.loaded_at = None
+
+        self._lock = threading.RLock()
+        self._keys = []
+        self._entries = {}      #user id -> (username, net_worth)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age
+
+    def invalidate(self):
+        """Forces a reload on the next read."""
+        self.loaded_at = None
+
+    def load(self, rows):
+        """Replaces the ranking with rows of (user_id, username, net_worth)."""
+        entries = {user_id: (username, net_worth or 0) for user_id, username, net_worth in rows}
+        keys = sorted((-net_worth, user_id) for user_id, (username, net_worth) in entries.items())
+
+        with self._lock:
+            self._entries = entries
+            self._keys = keys
+            self.loaded_at = time.monotonic()
+
+    def update(self, user_id, username, net_worth):
+        """Moves a user to their new position. Does nothing until the ranking has been loaded."""
+        with self._lock:
+            if self.loaded_at is None:
+                return
+
+            self._remove(user_id)
+            self._entries[user_id] = (username, net_worth or 0)
+            insort(self._keys, (-(net_worth or 0), user_id))
+
+    def remove(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def _remove(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            i = bisect_left(self._keys, (-entry[1], user_id))
+            del self._keys[i]
+
+    def rank(self, user_id):
+        """1-based rank of the user, or None if the user is not ranked."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            return bisect_left(self._keys, (-entry[1], user_id)) + 1
+
+    def entry(self, user_id):
+        """The user's ranking entry as a dict, or None if the user is not ranked."""
+        with self._lock:
+            rank = self.rank(user_id)
+            if rank is None:
+                return None
+            username, net_worth = self._entries[user_id]
+            return {"rank": rank, "id": user_id, "username": username, "net_worth": net_worth}
+
+    def page(self, page=1, per_page=25):
+        """Entries ranked ((page - 1) * per_page, page * per_page], as dicts."""
+        start = (max(page, 1) - 1) * per_page
+
+        with self._lock:
+            keys = self._keys[start:start + per_page]
+            return [
+                {"rank": start + i + 1, "id": user_id, "username": self._entries[user_id][0], "net_worth": -key}
+                for i, (key, user_id) in enumerate(keys)
+            ]
+
+    def top(self, n):
+        return self.page(1, n)
+
+
+leaderboard = Leaderboard()
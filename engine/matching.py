@@ -0,0 +1,173 @@
+"""In-process order books of pending limit and stop orders, matched against refreshed share prices."""
+from heapq import heapify, heappush, heappop
+import threading
+import time
+
+from engine.constants import MATCHING_MAX_AGE
+
+ORDER_TYPES = ("limit", "stop")
+
+
+def triggers_at_or_below(is_buy, order_type):
+    """
+        Whether an order triggers when the share price falls to its price (a buy limit or a sell stop)
+        rather than when it rises to it (a sell limit or a buy stop).
+    """
+    return is_buy == (order_type == "limit")
+
+
+class OrderBook():
+    """
+        The price thresholds of one stock in two heaps: those triggering at or below their price,
+        highest price first, and those triggering at or above it, lowest price first. The thresholds
+        crossed by a new price are popped off the tops, O(log n) each, and the rest are not looked at.
+        Removed entries are left in the heaps and dropped when they reach the top.
+    """
+
+    def __init__(self, thresholds=()):
+        """thresholds is an iterable of (entry id, price, at_or_below), heapified at once."""
+        self._below = []        #(-price, entry id)
+        self._above = []        #(price, entry id)
+        for entry_id, price, at_or_below in thresholds:
+            if at_or_below:
+                self._below.append((-price, entry_id))
+            else:
+                self._above.append((price, entry_id))
+        heapify(self._below)
+        heapify(self._above)
+
+    def __len__(self):
+        return len(self._below) + len(self._above)
+
+    def add(self, entry_id, price, at_or_below):
+        if at_or_below:
+            heappush(self._below, (-price, entry_id))
+        else:
+            heappush(self._above, (price, entry_id))
+
+    def crossed(self, price, live):
+        """Pops and returns the ids of entries in live triggered at price, in the order they trigger."""
+        ids = []
+        while self._below and -self._below[0][0] >= price:
+            entry_id = heappop(self._below)[1]
+            if entry_id in live:
+                ids.append(entry_id)
+        while self._above and self._above[0][0] <= price:
+            entry_id = heappop(self._above)[1]
+            if entry_id in live:
+                ids.append(entry_id)
+        return ids
+
+
+class ThresholdIndex():
+    """
+        Order books of price thresholds of every stock, for entries (pending orders, price alerts)
+        that each trigger once when a stock's share price reaches one of their thresholds. Loaded
+        from the database in one projected query and updated in place as entries are added and
+        removed in this process. Entries of other processes are picked up by syncing, adding the
+        entries created since the last load or sync, once older than max_age seconds, and by a full
+        reload once older than reload_age seconds (max_age by default), which also drops entries
+        removed elsewhere. Finding the entries crossed by a price change is O(log n + k) for k
+        crossed entries; the database row of each entry decides whether it is still active, so an
+        entry triggered by two processes, or removed elsewhere, is acted on at most once.
+    """
+
+    def __init__(self, max_age, reload_age=None):
+        self.max_age = max_age
+        self.reload_age = max_age if reload_age is None else reload_age
+        self.loaded_at = None       #monotonic time of the last full load
+        self.synced_at = None       #monotonic time of the last load or sync
+        self.as_of = None           #time the database was last read at, given by the caller
+
+        self._lock = threading.RLock()
+        self._books = {}        #stock id -> OrderBook
+        self._live = {}         #entry id -> stock id, of entries in the books and not removed
+
+    def __len__(self):
+        return len(self._live)
+
+    def needs_reload(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.reload_age
+
+    def is_stale(self):
+        return self.synced_at is None or time.monotonic() - self.synced_at > self.max_age
+
+    def invalidate(self):
+        """Forces a full reload on the next use."""
+        self.loaded_at = None
+        self.synced_at = None
+
+    def load_thresholds(self, rows, as_of=None):
+        """
+            Replaces the books with rows of (entry_id, stock_id, thresholds), thresholds a list of
+            (price, at_or_below). as_of is when the rows were read, kept for the next sync.
+        """
+        by_stock = {}
+        live = {}
+        for entry_id, stock_id, thresholds in rows:
+            by_stock.setdefault(stock_id, []).extend((entry_id, price, at_or_below) for price, at_or_below in thresholds)
+            live[entry_id] = stock_id
+        books = {stock_id: OrderBook(thresholds) for stock_id, thresholds in by_stock.items()}
+
+        with self._lock:
+            self._books = books
+            self._live = live
+            self.loaded_at = self.synced_at = time.monotonic()
+            self.as_of = as_of
+
+    def sync_thresholds(self, rows, as_of=None):
+        """Adds the entries of rows, as in load_thresholds, that the books do not have yet."""
+        with self._lock:
+            for entry_id, stock_id, thresholds in rows:
+                self.add_thresholds(entry_id, stock_id, thresholds)
+            self.synced_at = time.monotonic()
+            self.as_of = as_of
+
+    def add_thresholds(self, entry_id, stock_id, thresholds):
+        """Adds an entry, unless the books are not loaded yet (they will be loaded with it) or already have it."""
+        with self._lock:
+            if self.loaded_at is None or entry_id in self._live:
+                return
+            book = self._books.setdefault(stock_id, OrderBook())
+            for price, at_or_below in thresholds:
+                book.add(entry_id, price, at_or_below)
+            self._live[entry_id] = stock_id
+
+    def remove(self, entry_id):
+        """Takes an entry out of matching."""
+        with self._lock:
+            self._live.pop(entry_id, None)
+
+    def crossed(self, stock_id, price):
+        """Removes and returns the ids of the stock's entries triggered by its share price changing to price."""
+        with self._lock:
+            book = self._books.get(stock_id)
+            if book is None or price is None:
+                return []
+
+            ids = book.crossed(price, self._live)
+            for entry_id in ids:
+                del self._live[entry_id]
+            if not book:
+                del self._books[stock_id]
+            return ids
+
+
+class MatchingEngine(ThresholdIndex):
+    """The books of pending limit and stop orders, each with one threshold at its price."""
+
+    def __init__(self, max_age=MATCHING_MAX_AGE):
+        super().__init__(max_age)
+
+    def load(self, rows):
+        """Replaces the books with rows of open orders, (order_id, stock_id, is_buy, order_type, price)."""
+        self.load_thresholds(
+            (order_id, stock_id, [(price, triggers_at_or_below(is_buy, order_type))])
+            for order_id, stock_id, is_buy, order_type, price in rows
+        )
+
+    def add(self, order_id, stock_id, is_buy, order_type, price):
+        self.add_thresholds(order_id, stock_id, [(price, triggers_at_or_below(is_buy, order_type))])
+
+
+matching_engine = MatchingEngine()
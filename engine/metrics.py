@@ -0,0 +1,198 @@
+"""
+    Lightweight request, SQL and quote api instrumentation, exported in the Prometheus text format
+    on /metrics. Requests are sampled at METRICS_SAMPLE_RATE; only sampled requests are timed and
+    have their queries counted, all of them are counted in app_requests_total.
+"""
+from bisect import bisect_left
+import logging
+import random
+import threading
+import time
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from engine.constants import METRICS_SAMPLE_RATE, N_PLUS_ONE_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter():
+    """A Prometheus counter, one value per combination of label values."""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram():
+    """A Prometheus histogram with fixed buckets, one per combination of label values."""
+
+    def __init__(self, name, help, buckets, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labelnames = labelnames
+        self._series = {}       #labels -> [count per bucket (the last one +Inf), sum]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class _RequestStats():
+    """Queries run while handling one sampled request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.statements = {}        #sql -> times run
+
+
+class Metrics():
+    """
+        Collects the metrics of this process. init_app hooks it into a Flask app, and
+        SQLAlchemy engine events count the queries of the current request (per thread).
+        A statement run N_PLUS_ONE_THRESHOLD or more times in one request, like a query per
+        item of a list, is counted in app_n_plus_one_total and logged.
+    """
+
+    def __init__(self, sample_rate=METRICS_SAMPLE_RATE, n_plus_one_threshold=N_PLUS_ONE_THRESHOLD):
+        self.sample_rate = sample_rate
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.requests = Counter("app_requests_total", "Requests handled, sampled or not.", ("route", "method", "status"))
+        self.latency = Histogram("app_request_duration_seconds", "Time to handle a sampled request.",
+                                 LATENCY_BUCKETS, ("route", "method"))
+        self.queries = Histogram("app_request_queries", "SQL queries run by a sampled request.",
+                                 QUERY_COUNT_BUCKETS, ("route",))
+        self.query_time = Histogram("app_request_query_duration_seconds", "Time spent in SQL queries by a sampled request.",
+                                    LATENCY_BUCKETS, ("route",))
+        self.n_plus_one = Counter("app_n_plus_one_total", "Sampled requests running the same SQL statement repeatedly.",
+                                  ("route",))
+        self.quote_fetches = Histogram("app_quote_fetch_duration_seconds", "Time of requests to the external quote api.",
+                                       LATENCY_BUCKETS, ("outcome",))
+
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def close(self):
+        """Stops counting queries."""
+        event.remove(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.remove(Engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def init_app(self, app):
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+
+    #request hooks
+    def _start_request(self):
+        self._local.route = None
+        self._local.stats = _RequestStats() if random.random() < self.sample_rate else None
+
+    def _finish_request(self, response):
+        self.record_request(response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        if getattr(self._local, "route", None) is None and exc is not None:
+            self.record_request(500)
+        self._local.stats = None
+        self._local.route = None
+
+    def record_request(self, status):
+        """Records the current request, which is finishing with status."""
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        self._local.route = route
+        stats = getattr(self._local, "stats", None)
+
+        with self._lock:
+            self.requests.inc((route, request.method, status))
+            if stats is None:
+                return
+            self.latency.observe((route, request.method), time.perf_counter() - stats.started)
+            self.queries.observe((route,), stats.queries)
+            self.query_time.observe((route,), stats.query_seconds)
+
+            repeated = [sql for sql, count in stats.statements.items() if count >= self.n_plus_one_threshold]
+            if repeated:
+                self.n_plus_one.inc((route,))
+
+        for sql in repeated:
+            logger.warning("possible N+1 query in %s, run %d times: %s", route, stats.statements[sql], sql[:200])
+
+    #sql hooks
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self._local, "stats", None) is not None:
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = getattr(self._local, "stats", None)
+        if stats is None or not conn.info.get("query_started"):
+            return
+        stats.queries += 1
+        stats.query_seconds += time.perf_counter() - conn.info["query_started"].pop()
+        stats.statements[statement] = stats.statements.get(statement, 0) + 1
+
+    def observe_quote_fetch(self, seconds, ok):
+        with self._lock:
+            self.quote_fetches.observe(("ok" if ok else "error",), seconds)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                "# HELP app_metrics_sample_rate Share of requests that are timed.",
+                "# TYPE app_metrics_sample_rate gauge",
+                f"app_metrics_sample_rate {self.sample_rate}"
+            ]
+            for metric in (self.requests, self.latency, self.queries, self.query_time, self.n_plus_one, self.quote_fetches):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,249 @@
+"""
+    Live share prices and portfolio values for Server-Sent Events streams. Price changes and trades
+    are announced with Postgres NOTIFY in the transaction that writes them, so every process (web
+    workers, the refresh worker) can cause updates, and each web process has one Broadcaster that
+    LISTENs on a dedicated connection and fans the updates out to the streams it serves. Changes of
+    runtime settings are announced the same way, and reload the process' settings (engine/config.py),
+    as are changes of the stock listing, which invalidate the process' listing_cache (engine/symbols.py).
+
+    Streams wait on queues, not on the database, so under an async worker (gunicorn -k gevent)
+    thousands of idle streams cost a greenlet each rather than a thread or a connection.
+"""
+import json
+import logging
+import queue
+import select
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from engine.config import runtime_config
+from engine.symbols import listing_cache
+
+logger = logging.getLogger(__name__)
+
+PRICES_CHANNEL = "price_updates"            #payload: [[stock_id, share_price], ...]
+PORTFOLIOS_CHANNEL = "portfolio_updates"    #payload: user id
+CONFIG_CHANNEL = "config_updates"           #payload: setting name
+STOCKS_CHANNEL = "stock_listing_updates"    #payload: empty, stocks were listed, delisted or renamed
+NOTIFY_MAX_BYTES = 7000                     #payloads must stay under 8000 bytes, longer price lists are split
+
+
+def notify_prices(session, prices):
+    """
+        Announces new share prices, (stock_id, share_price) pairs, on PRICES_CHANNEL. Sent in the
+        session's transaction, so listeners hear of them only once it commits, and not if it rolls back.
+    """
+    chunk = []
+    size = 1                #the opening bracket, each item adds itself and a comma or the closing bracket
+    for stock_id, price in prices:
+        item = json.dumps([stock_id, price])
+        if chunk and size + len(item) + 1 > NOTIFY_MAX_BYTES:
+            _notify(session, PRICES_CHANNEL, "[" + ",".join(chunk) + "]")
+            chunk, size = [], 1
+        chunk.append(item)
+        size += len(item) + 1
+    if chunk:
+        _notify(session, PRICES_CHANNEL, "[" + ",".join(chunk) + "]")
+
+
+def notify_portfolio(session, user_id):
+    """Announces that the user's money or holdings changed, in the session's transaction."""
+    _notify(session, PORTFOLIOS_CHANNEL, str(user_id))
+
+
+def notify_config(session, name):
+    """Announces that a runtime setting changed, in the session's transaction."""
+    _notify(session, CONFIG_CHANNEL, name)
+
+
+def notify_stocks(session):
+    """Announces that stocks were listed, delisted or renamed, in the session's transaction."""
+    _notify(session, STOCKS_CHANNEL, "")
+
+
+def _notify(session, channel, payload):
+    session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+
+
+def sse_event(event, data):
+    """A Server-Sent Event of data as JSON, encoded for the response."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class Portfolio():
+    """
+        The money and holdings of a user as seen by one stream, valued at the latest prices it was
+        sent, so a price change is turned into a new net worth without a query.
+    """
+
+    def __init__(self, current_money, holdings):
+        """holdings is a dict of stock id -> (quantity, share_price)."""
+        self.current_money = current_money
+        self.quantities = {stock_id: quantity for stock_id, (quantity, price) in holdings.items()}
+        self.prices = {stock_id: price for stock_id, (quantity, price) in holdings.items()}
+
+    def total_asset_value(self):
+        return sum(quantity * (self.prices.get(stock_id) or 0) for stock_id, quantity in self.quantities.items())
+
+    def event(self):
+        total = self.total_asset_value()
+        return sse_event("portfolio", {
+            "current_money": self.current_money,
+            "total_asset_value": total,
+            "net_worth": self.current_money + total
+        })
+
+
+class Subscriber():
+    """A stream's interests, the stocks it follows and its user, and its queue of updates."""
+    __slots__ = ("user_id", "stock_ids", "queue")
+
+    def __init__(self, user_id, stock_ids):
+        self.user_id = user_id
+        self.stock_ids = frozenset(stock_ids)
+        self.queue = queue.Queue()
+
+    def get(self, timeout):
+        """Waits up to timeout seconds for updates, then returns all of them (possibly none)."""
+        try:
+            updates = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                updates.append(self.queue.get_nowait())
+            except queue.Empty:
+                return updates
+
+
+class Broadcaster():
+    """
+        Listens for NOTIFY on PRICES_CHANNEL and PORTFOLIOS_CHANNEL in a background thread, and puts
+        each update on the queues of the subscribers it concerns: ("price", stock_id, price, event)
+        for a price, where event is the Server-Sent Event built once for every subscriber of the stock,
+        and ("portfolio",) when the subscriber's user traded. Notifications on CONFIG_CHANNEL
+        invalidate the runtime settings, and those on STOCKS_CHANNEL the cached stock listing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_stock = {}         #stock id -> set of subscribers
+        self._by_user = {}          #user id -> set of subscribers
+        self._thread = None
+        self._stop = threading.Event()
+        self.listening = threading.Event()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._by_user.values())
+
+    def start(self, database_url):
+        """Starts listening on a connection of its own to database_url, unless already listening."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._listen, args=(database_url,), daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def subscribe(self, user_id, stock_ids):
+        subscriber = Subscriber(user_id, stock_ids)
+        with self._lock:
+            self._by_user.setdefault(user_id, set()).add(subscriber)
+            for stock_id in subscriber.stock_ids:
+                self._by_stock.setdefault(stock_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._discard(self._by_user, subscriber.user_id, subscriber)
+            for stock_id in subscriber.stock_ids:
+                self._discard(self._by_stock, stock_id, subscriber)
+
+    def follow(self, subscriber, stock_ids):
+        """Changes the stocks a subscriber follows, after its user's holdings changed."""
+        stock_ids = frozenset(stock_ids)
+        with self._lock:
+            for stock_id in subscriber.stock_ids - stock_ids:
+                self._discard(self._by_stock, stock_id, subscriber)
+            for stock_id in stock_ids - subscriber.stock_ids:
+                self._by_stock.setdefault(stock_id, set()).add(subscriber)
+            subscriber.stock_ids = stock_ids
+
+    @staticmethod
+    def _discard(index, key, subscriber):
+        subscribers = index.get(key)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del index[key]
+
+    def publish_prices(self, prices):
+        """Sends each (stock_id, price) to the subscribers of the stock, serialized once."""
+        with self._lock:
+            for stock_id, price in prices:
+                subscribers = self._by_stock.get(stock_id)
+                if not subscribers:
+                    continue
+                update = ("price", stock_id, price, sse_event("price", {"id": stock_id, "price": price}))
+                for subscriber in subscribers:
+                    subscriber.queue.put(update)
+
+    def publish_portfolio(self, user_id):
+        with self._lock:
+            for subscriber in self._by_user.get(user_id, ()):
+                subscriber.queue.put(("portfolio",))
+
+    def _dispatch(self, channel, payload):
+        try:
+            if channel == PRICES_CHANNEL:
+                self.publish_prices(json.loads(payload))
+            elif channel == PORTFOLIOS_CHANNEL:
+                self.publish_portfolio(int(payload))
+            elif channel == CONFIG_CHANNEL:
+                runtime_config.invalidate()
+            elif channel == STOCKS_CHANNEL:
+                listing_cache.invalidate()
+        except ValueError:
+            logger.warning("ignoring malformed %s notification: %s", channel, payload[:200])
+
+    def _listen(self, database_url):
+        engine = create_engine(database_url, poolclass=NullPool)
+        while not self._stop.is_set():
+            try:
+                conn = engine.raw_connection()
+                try:
+                    conn.connection.set_session(autocommit=True)
+                    cursor = conn.cursor()
+                    cursor.execute(f"LISTEN {PRICES_CHANNEL}; LISTEN {PORTFOLIOS_CHANNEL}; LISTEN {CONFIG_CHANNEL}; "
+                                   f"LISTEN {STOCKS_CHANNEL}")
+                    self.listening.set()
+                    self._receive(conn.connection)
+                finally:
+                    self.listening.clear()
+                    conn.close()
+            except Exception:
+                logger.exception("lost the notification connection, reconnecting")
+                time.sleep(1)
+        engine.dispose()
+
+    def _receive(self, connection):
+        while not self._stop.is_set():
+            if select.select([connection], [], [], 1) == ([], [], []):
+                continue
+            connection.poll()
+            while connection.notifies:
+                notification = connection.notifies.pop(0)
+                self._dispatch(notification.channel, notification.payload)
+
+
+broadcaster = Broadcaster()
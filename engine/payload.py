@@ -0,0 +1,88 @@
+"""Cleaning of the JSON payloads of the external quote api before they are stored in Stock.data."""
+
+_CONTAINERS = (dict, list)
+
+
+class _Frame():
+    """A dict or list being cleaned: the entries left to visit and what is kept of the visited ones."""
+    __slots__ = ("entries", "container", "kept", "is_dict", "key")
+
+    def __init__(self, container, in_place):
+        self.container = container
+        self.is_dict = isinstance(container, dict)
+        self.entries = iter(container.items()) if self.is_dict else iter(container)
+        #a new dict or list of the kept entries, except dicts cleaned in place, which collect the keys to delete
+        self.kept = {} if self.is_dict and not in_place else []
+        self.key = None     #key of the child container being visited
+
+
+def clean_empty(payload, in_place=False):
+    """
+        Removes the entries of dicts and lists that evaluate to false (None, 0, "", [], ...),
+        at any depth, including dicts and lists left empty once their own entries are removed.
+        Returns the cleaned payload, a new structure unless in_place is True, in which case
+        the dicts and lists of payload are pruned and reused.
+
+        Payloads are walked once with an explicit stack, so deep nesting cannot reach the
+        recursion limit, and no intermediate containers are built.
+    """
+    if not isinstance(payload, _CONTAINERS):
+        return payload
+
+    stack = [_Frame(payload, in_place)]
+    while True:
+        frame = stack[-1]
+        kept = frame.kept
+        child = None
+
+        #visits entries until a non-empty child container, which is cleaned before the rest of the entries
+        if not frame.is_dict:
+            for value in frame.entries:
+                if not value:
+                    continue
+                if isinstance(value, _CONTAINERS):
+                    child = value
+                    break
+                kept.append(value)
+        elif not in_place:
+            for key, value in frame.entries:
+                if not value:
+                    continue
+                if isinstance(value, _CONTAINERS):
+                    frame.key, child = key, value
+                    break
+                kept[key] = value
+        else:
+            for key, value in frame.entries:
+                if not value:
+                    kept.append(key)
+                elif isinstance(value, _CONTAINERS):
+                    frame.key, child = key, value
+                    break
+
+        if child is not None:
+            stack.append(_Frame(child, in_place))
+            continue
+
+        #every entry of frame is visited, so kept becomes its cleaned container
+        stack.pop()
+        if in_place:
+            if frame.is_dict:
+                for key in kept:
+                    del frame.container[key]
+            else:
+                frame.container[:] = kept
+            kept = frame.container
+
+        if not stack:
+            return kept
+
+        parent = stack[-1]
+        if not parent.is_dict:
+            if kept:
+                parent.kept.append(kept)
+        elif not in_place:
+            if kept:
+                parent.kept[parent.key] = kept
+        elif not kept:
+            parent.kept.append(parent.key)
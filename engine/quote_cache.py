@@ -0,0 +1,91 @@
+"""Freshness cache and request coalescing in front of the external quote api."""
+from datetime import datetime, timedelta
+import threading
+
+from engine.constants import QUOTE_CACHE_TTL
+from engine.quotes import quote_fetcher
+
+
+class _Flight():
+    """An upstream fetch in progress, shared by every caller asking for the same symbol."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = False
+
+
+class QuoteCache():
+    """
+        Decides whether a stock needs a new quote, and makes sure concurrent requests for the
+        same symbol share a single upstream fetch (single-flight).
+
+        Freshness is based on Stock.last_updated, so the database row is the cache and a quote
+        fetched by any process counts. hits, misses and coalesced are counted so the ttl can be
+        tuned against the api quota.
+    """
+
+    def __init__(self, fetcher=None, ttl=QUOTE_CACHE_TTL):
+        self.fetcher = fetcher or quote_fetcher
+        self.ttl = timedelta(seconds=ttl)
+
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def is_fresh(self, stock):
+        """True if stock has a price that was updated less than ttl ago."""
+        if stock.share_price is None or stock.last_updated is None:
+            return False
+        return datetime.now() - stock.last_updated < self.ttl
+
+    def refresh(self, stock, apply):
+        """
+            Gets a new quote for stock unless it is still fresh. apply(json_dict) is called with the
+            fetched payload (None if the fetch failed) and should write it to the database, returning
+            True on success. Callers that arrive while a fetch for the same symbol is in flight wait for
+            it and get the same result instead of fetching again. Returns True if stock is up to date.
+        """
+        if self.is_fresh(stock):
+            with self._lock:
+                self.hits += 1
+            return True
+
+        symbol = stock.stock_symbol
+        with self._lock:
+            flight = self._in_flight.get(symbol)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._in_flight[symbol] = flight
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            flight.done.wait()
+            return flight.result
+
+        try:
+            flight.result = apply(self.fetcher.fetch(symbol))
+        finally:
+            with self._lock:
+                del self._in_flight[symbol]
+            flight.done.set()
+
+        return flight.result
+
+    def stats(self):
+        """Counters since startup, as a dict."""
+        with self._lock:
+            return {
+                "ttl": self.ttl.total_seconds(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._in_flight)
+            }
+
+
+quote_cache = QuoteCache()
@@ -0,0 +1,97 @@
+"""Fetches stock quotes from the external yahoo finance api hosted on rapid-api."""
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+import threading
+import time
+import requests
+
+from engine.constants import QUOTE_URL, QUOTE_HEADERS, QUOTE_MAX_WORKERS, QUOTE_TIMEOUT
+from engine.metrics import metrics
+
+
+class QuoteFetcher():
+    """
+        Fetches get-detail payloads over one pooled keep-alive requests.Session.
+        fetch_many fans the symbols out over a bounded thread pool, so updating a
+        portfolio takes about as long as its slowest quote instead of the sum of all
+        of them. Only the http requests run on the pool, database work stays with the caller.
+    """
+
+    def __init__(self, url=QUOTE_URL, headers=QUOTE_HEADERS, max_workers=QUOTE_MAX_WORKERS, timeout=QUOTE_TIMEOUT):
+        self.url = url
+        self.headers = headers
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._pool = None
+
+    @property
+    def session(self):
+        """Shared session, created on first use. Its connection pool is sized to max_workers."""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    session.headers.update(self.headers)
+                    self._session = session
+        return self._session
+
+    @property
+    def pool(self):
+        """Shared thread pool, so max_workers bounds concurrency across all callers."""
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="quote-fetcher")
+        return self._pool
+
+    def fetch(self, symbol):
+        """Returns the decoded get-detail payload for symbol, or None if the request failed. The request is timed in metrics."""
+        started = time.perf_counter()
+        payload = self._fetch(symbol)
+        metrics.observe_quote_fetch(time.perf_counter() - started, payload is not None)
+        return payload
+
+    def _fetch(self, symbol):
+        querystring = {"region": "US", "lang": "en", "symbol": symbol}
+        try:
+            res = self.session.get(self.url, params=querystring, timeout=self.timeout)
+        except requests.RequestException:
+            return None
+
+        if res.status_code != 200:
+            return None
+        try:
+            return res.json()
+        except ValueError:
+            return None
+
+    def fetch_many(self, symbols):
+        """
+            Fetches every symbol concurrently. Returns a dict of symbol -> payload,
+            where the payload is None for symbols that could not be fetched.
+        """
+        symbols = list(dict.fromkeys(symbols))      #drops duplicates, keeps order
+
+        if len(symbols) <= 1:                       #not worth a trip through the pool
+            return {symbol: self.fetch(symbol) for symbol in symbols}
+
+        return dict(zip(symbols, self.pool.map(self.fetch, symbols)))
+
+    def close(self):
+        """Closes the pooled connections and shuts down the thread pool."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+quote_fetcher = QuoteFetcher()
@@ -0,0 +1,121 @@
+"""
+    Background worker that keeps Stock.share_price and Stock.data fresh, so web requests
+    only read what is already in the database.
+
+    Run it as its own process from the project root:
+
+        python -m engine.refresh
+        python -m engine.refresh --interval 30 --batch-size 100 --force
+"""
+import argparse
+import logging
+import threading
+
+from models import db, User, Stock, Owned_Stock, App_Config, Price_Alert
+from engine.constants import REFRESH_INTERVAL, REFRESH_BATCH_SIZE
+from engine.quotes import QuoteFetcher, quote_fetcher
+
+logger = logging.getLogger(__name__)
+
+
+class PriceRefresher():
+    """
+        Refreshes stock quotes on a schedule. Each cycle updates every stock held by at least
+        one user first, then the batch_size stocks that have gone the longest without an update,
+        so the rest of the universe is cycled through over several runs. Every user's
+        total_asset_value is then revalued against the new prices.
+
+        fetcher is the quote backend, any object with a fetch_many(symbols) method that
+        returns a dict of symbol -> get-detail payload (or None). Tests point a QuoteFetcher
+        at a local fake quote server instead of rapid-api.
+    """
+
+    def __init__(self, fetcher=None, interval=REFRESH_INTERVAL, batch_size=REFRESH_BATCH_SIZE, force=False):
+        self.fetcher = fetcher or quote_fetcher
+        self.interval = interval
+        self.batch_size = batch_size
+        self.force = force
+
+    def is_enabled(self):
+        """Refreshing follows the GET_LARGE_UPDATES toggle unless the worker was started with force."""
+        if self.force:
+            return True
+        return App_Config.get_setting("GET_LARGE_UPDATES")
+
+    def held_stocks(self):
+        """Stocks that are currently owned by at least one user."""
+        return Stock.query \
+            .filter(Stock.id.in_(db.session.query(Owned_Stock.stock_id))) \
+            .all()
+
+    def stale_stocks(self, exclude_ids):
+        """The batch_size stocks not in exclude_ids with the oldest (or no) update."""
+        query = Stock.query
+        if exclude_ids:
+            query = query.filter(~Stock.id.in_(exclude_ids))
+
+        return query \
+            .order_by(Stock.last_updated.asc().nullsfirst()) \
+            .limit(self.batch_size) \
+            .all()
+
+    def refresh_once(self):
+        """
+            Runs one refresh cycle, held stocks first. Each group is written in its own commit.
+            Returns the list of stocks that were refreshed.
+        """
+        held = self.held_stocks()
+        if held:
+            if not Stock.update_many(held, fetcher=self.fetcher):
+                logger.warning("Some held stocks could not be updated from the quote api")
+            User.revalue_all()
+
+        rest = self.stale_stocks([s.id for s in held])
+        if rest and not Stock.update_many(rest, fetcher=self.fetcher):
+            logger.warning("Some stocks could not be updated from the quote api")
+
+        return held + rest
+
+    def run(self, stop_event=None):
+        """Runs refresh cycles every interval seconds until stop_event is set."""
+        stop_event = stop_event or threading.Event()
+
+        while not stop_event.is_set():
+            try:
+                if self.is_enabled():
+                    stocks = self.refresh_once()
+                    logger.info("Refreshed %d stocks", len(stocks))
+            except Exception:
+                logger.exception("Price refresh cycle failed")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+            stop_event.wait(self.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keeps stock prices in the database fresh.")
+    parser.add_argument("--interval", type=float, default=REFRESH_INTERVAL, help="seconds between refresh cycles")
+    parser.add_argument("--batch-size", type=int, default=REFRESH_BATCH_SIZE, help="stocks not held by anyone refreshed per cycle")
+    parser.add_argument("--quote-url", help="get-detail endpoint to use instead of rapid-api, e.g. a local fake quote server")
+    parser.add_argument("--force", action="store_true", help="refresh even when the GET_LARGE_UPDATES toggle is off")
+    parser.add_argument("--once", action="store_true", help="run a single refresh cycle and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    from app import app     #binds the models to the configured database
+
+    fetcher = QuoteFetcher(url=args.quote_url, headers={}) if args.quote_url else quote_fetcher
+    refresher = PriceRefresher(fetcher, interval=args.interval, batch_size=args.batch_size, force=args.force)
+    Price_Alert.load_alert_index()      #up front, so the first cycle checks the alerts; later reloads run in the background
+
+    if args.once:
+        refresher.refresh_once()
+    else:
+        refresher.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+    Bulk loading of stocks, users, holdings and transactions. CSV files are streamed into temporary
+    staging tables with COPY, without parsing them in Python, and merged into the real tables with
+    one set-based statement each, so loading is idempotent: stocks and users are upserted by
+    symbol and username, holdings by user and stock, and transactions already present are skipped.
+    Synthetic users and transactions for benchmarks are generated in the database.
+
+    Used by the `flask seed` commands (see app.py). Every function runs in the session's
+    transaction and leaves committing to the caller, who then calls after_seeding.
+"""
+import csv
+
+from models import db, bcrypt, User, Transaction
+from engine.symbols import listing_cache
+from engine.notify import notify_stocks
+from engine.leaderboard import leaderboard
+from engine.user_cache import user_cache
+
+#columns of each kind of CSV file, in order. Trailing columns may be left out of a file
+STOCK_COLUMNS = ("stock_symbol", "name", "sector")
+USER_COLUMNS = ("username", "password", "current_money")
+HOLDING_COLUMNS = ("username", "stock_symbol", "quantity", "value_when_purchased")
+TRANSACTION_COLUMNS = ("username", "stock_symbol", "time", "quantity", "stock_value_at_time", "is_purchase")
+DEFAULT_IMAGE_URL = User.__table__.c.image_url.default.arg
+REBUILD_MIN_ROWS = 100000       #generated transactions from which indexes are rebuilt rather than updated row by row
+
+
+class _Rest():
+    """A binary file read from the start again, after its first line was already read off it."""
+
+    def __init__(self, first, rest):
+        self.first = first
+        self.rest = rest
+
+    def read(self, size=-1):
+        if self.first:
+            chunk, self.first = self.first, b""
+            return chunk
+        return self.rest.read(size)
+
+    def readline(self, size=-1):
+        if self.first:
+            return self.read()
+        return self.rest.readline(size)
+
+
+def _copy(csv_file, table, columns, header=False):
+    """
+        Creates the temporary table of text columns, and a line column numbering the rows, and
+        streams csv_file, opened in binary mode so its bytes are passed through as they are, into it
+        with COPY. Every line of the file has the first columns, as many as its first line.
+        Returns the number of rows copied.
+    """
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(f"CREATE TEMP TABLE {table} (line bigint GENERATED ALWAYS AS IDENTITY, "
+                   f"{', '.join(f'{column} text' for column in columns)}) ON COMMIT DROP")
+
+    first = csv_file.readline()
+    if not first.strip():
+        return 0
+    width = min(len(next(csv.reader([first.decode()]))), len(columns))
+
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns[:width])}) FROM STDIN WITH (FORMAT csv)",
+                       csv_file if header else _Rest(first, csv_file))
+    return cursor.rowcount
+
+
+def load_stocks(csv_file, header=False):
+    """
+        Upserts stocks from rows of STOCK_COLUMNS by symbol, updating the name and sector of known
+        symbols. New stocks get ids in the order of the file, and the last row of a symbol counts.
+        Returns the number of stocks inserted or changed.
+    """
+    _copy(csv_file, "seed_stocks", STOCK_COLUMNS, header)
+    return db.session.execute("""
+        INSERT INTO stocks (stock_symbol, name, sector, data, last_updated)
+        SELECT stock_symbol, name, nullif(sector, ''), '{}', now()
+        FROM (SELECT DISTINCT ON (stock_symbol) * FROM seed_stocks ORDER BY stock_symbol, line DESC) latest
+        ORDER BY line
+        ON CONFLICT (stock_symbol) DO UPDATE SET name = excluded.name, sector = excluded.sector
+        WHERE (stocks.name, stocks.sector) IS DISTINCT FROM (excluded.name, excluded.sector)
+    """).rowcount
+
+
+def load_users(csv_file, header=False, current_money=10000):
+    """
+        Upserts users from rows of USER_COLUMNS by username. Each distinct password is hashed once,
+        rather than once per user. Existing users keep their password, and get the row's
+        current_money when it has one. Returns the number of users inserted or changed.
+    """
+    _copy(csv_file, "seed_users", USER_COLUMNS, header)
+
+    db.session.execute("CREATE TEMP TABLE seed_passwords (password text, hash text) ON COMMIT DROP")
+    passwords = [password for password, in db.session.execute("SELECT DISTINCT password FROM seed_users")]
+    if passwords:
+        db.session.execute(
+            "INSERT INTO seed_passwords VALUES (:password, :hash)",
+            [{"password": password, "hash": bcrypt.generate_password_hash(password).decode('UTF-8')} for password in passwords]
+        )
+
+    return db.session.execute("""
+        INSERT INTO users (username, password, image_url, current_money, total_asset_value)
+        SELECT u.username, p.hash, :image_url, coalesce(nullif(u.current_money, '')::float, :current_money), 0
+        FROM (SELECT DISTINCT ON (username) * FROM seed_users ORDER BY username, line DESC) u
+        JOIN seed_passwords p ON p.password = u.password
+        ORDER BY u.line
+        ON CONFLICT (username) DO UPDATE SET current_money = excluded.current_money
+        WHERE users.current_money IS DISTINCT FROM excluded.current_money
+    """, {"image_url": DEFAULT_IMAGE_URL, "current_money": current_money}).rowcount
+
+
+def load_holdings(csv_file, header=False):
+    """
+        Sets holdings from rows of HOLDING_COLUMNS, updating the quantity of the user's existing
+        holding of the stock or adding one. value_when_purchased defaults to the current share price.
+        Rows of unknown users or symbols are skipped. Returns the number of holdings inserted or changed.
+    """
+    _copy(csv_file, "seed_holdings", HOLDING_COLUMNS, header)
+    db.session.execute("""
+        CREATE TEMP TABLE seed_owned ON COMMIT DROP AS
+        SELECT DISTINCT ON (u.id, s.id) u.id AS user_id, s.id AS stock_id, h.quantity::int AS quantity,
+            coalesce(nullif(h.value_when_purchased, '')::float, s.share_price, 0) AS value_when_purchased
+        FROM seed_holdings h
+        JOIN users u ON u.username = h.username
+        JOIN stocks s ON s.stock_symbol = h.stock_symbol
+        ORDER BY u.id, s.id, h.line DESC
+    """)
+
+    #owned_stocks has no unique (user_id, stock_id) to upsert on, so existing holdings are updated first
+    updated = db.session.execute("""
+        UPDATE owned_stocks o SET quantity = s.quantity, value_when_purchased = s.value_when_purchased
+        FROM seed_owned s
+        WHERE o.user_id = s.user_id AND o.stock_id = s.stock_id
+        AND (o.quantity, o.value_when_purchased) IS DISTINCT FROM (s.quantity, s.value_when_purchased)
+    """).rowcount
+    inserted = db.session.execute("""
+        INSERT INTO owned_stocks (user_id, stock_id, time, quantity, value_when_purchased)
+        SELECT s.user_id, s.stock_id, now(), s.quantity, s.value_when_purchased
+        FROM seed_owned s
+        WHERE NOT EXISTS (SELECT 1 FROM owned_stocks o WHERE o.user_id = s.user_id AND o.stock_id = s.stock_id)
+    """).rowcount
+    return updated + inserted
+
+
+def load_transactions(csv_file, header=False):
+    """
+        Appends transactions from rows of TRANSACTION_COLUMNS, skipping rows identical to a
+        transaction the user already has and rows of unknown users or symbols.
+        Returns the number of transactions inserted.
+    """
+    _copy(csv_file, "seed_transactions", TRANSACTION_COLUMNS, header)
+    return db.session.execute("""
+        INSERT INTO transactions (user_id, stock_id, stock_symbol, time, quantity, stock_value_at_time, is_purchase)
+        SELECT u.id, s.id, s.stock_symbol, t.time::timestamp, t.quantity::int, t.stock_value_at_time::float,
+            t.is_purchase::boolean
+        FROM seed_transactions t
+        JOIN users u ON u.username = t.username
+        JOIN stocks s ON s.stock_symbol = t.stock_symbol
+        WHERE NOT EXISTS (
+            SELECT 1 FROM transactions e
+            WHERE e.user_id = u.id AND e.time = t.time::timestamp AND e.stock_id = s.id
+            AND e.quantity = t.quantity::int AND e.stock_value_at_time = t.stock_value_at_time::float
+            AND e.is_purchase = t.is_purchase::boolean
+        )
+    """).rowcount
+
+
+def generate_users(count, password, prefix="synthetic", current_money=10000):
+    """
+        Upserts count users named prefix0, prefix1, ... with one password, hashed once.
+        Returns the number of users inserted.
+    """
+    return db.session.execute("""
+        INSERT INTO users (username, password, image_url, current_money, total_asset_value)
+        SELECT :prefix || g, :password, :image_url, :current_money, 0
+        FROM generate_series(0, :count - 1) g
+        ON CONFLICT (username) DO NOTHING
+    """, {"prefix": prefix, "password": bcrypt.generate_password_hash(password).decode('UTF-8'),
+          "image_url": DEFAULT_IMAGE_URL, "current_money": current_money, "count": count}).rowcount
+
+
+def generate_transactions(count, days=365, seed=0):
+    """
+        Inserts count random transactions of random users and stocks over the last days days,
+        generated by the database in one statement. The same seed gives the same transactions
+        for the same users and stocks. Returns the number of transactions inserted.
+
+        From REBUILD_MIN_ROWS transactions on, the table's foreign keys and secondary indexes are
+        dropped for the insert and recreated after it, which checks and sorts all rows at once
+        instead of one by one. The table is locked against reads until the transaction ends.
+    """
+    db.session.execute("SELECT setseed(:seed)", {"seed": (seed % 2000) / 1000 - 1})
+    restore = _drop_constraints(Transaction.__table__) if count >= REBUILD_MIN_ROWS else None
+
+    inserted = db.session.execute("""
+        WITH u AS (SELECT row_number() OVER (ORDER BY id) AS n, id FROM users),
+        s AS (SELECT row_number() OVER (ORDER BY id) AS n, id, stock_symbol, coalesce(share_price, 100) AS price FROM stocks),
+        picks AS (
+            SELECT 1 + floor(random() * (SELECT count(*) FROM u))::int AS ui,
+                1 + floor(random() * (SELECT count(*) FROM s))::int AS si, random() AS r, random() AS t
+            FROM generate_series(1, :count)
+        )
+        INSERT INTO transactions (user_id, stock_id, stock_symbol, time, quantity, stock_value_at_time, is_purchase)
+        SELECT u.id, s.id, s.stock_symbol, now() - t * make_interval(days => :days),
+            1 + floor(r * 20)::int, round((s.price * (0.5 + r))::numeric, 2)::float, r < 0.6
+        FROM picks
+        JOIN u ON u.n = picks.ui
+        JOIN s ON s.n = picks.si
+    """, {"count": count, "days": days}).rowcount
+
+    if restore is not None:
+        restore()
+    return inserted
+
+
+def _drop_constraints(table):
+    """
+        Drops the foreign keys and the indexes declared on the model of table, in the session's
+        transaction. Returns a function that recreates them.
+    """
+    foreign_keys = db.session.execute("""
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'
+    """, {"table": table.name}).fetchall()
+    connection = db.session.connection()
+
+    for name, definition in foreign_keys:
+        db.session.execute(f'ALTER TABLE {table.name} DROP CONSTRAINT "{name}"')
+    for index in table.indexes:
+        index.drop(connection)
+
+    def restore():
+        db.session.execute("SET LOCAL maintenance_work_mem = '256MB'")     #sorts the index in memory
+        for index in table.indexes:
+            index.create(connection)
+        for name, definition in foreign_keys:
+            db.session.execute(f'ALTER TABLE {table.name} ADD CONSTRAINT "{name}" {definition}')
+
+    return restore
+
+
+def after_seeding():
+    """
+        Revalues every user at the current share prices and drops this process' state derived
+        from the seeded tables, and announces the new listing to the other processes (see
+        engine/notify.py). Call it once the seeding was committed.
+    """
+    notify_stocks(db.session)
+    db.session.commit()
+    User.revalue_all()
+    listing_cache.invalidate()
+    leaderboard.invalidate()
+    user_cache.clear()
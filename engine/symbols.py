@@ -0,0 +1,237 @@
+"""In-process caches of the stock names and symbols, used for stock search and autocompletion."""
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+
+from engine.constants import LISTING_MAX_AGE
+
+
+class ListingCache():
+    """
+        Holds values derived from the names and symbols in the stocks table, such as the
+        autocomplete list. A value is built once and reused until invalidate() is called, which
+        models.py does after any commit that inserts, deletes or renames a stock. Such commits, and
+        bulk loads (engine/seeding.py), also announce the change with NOTIFY, which invalidates the
+        cache of every other process listening (engine/notify.py). Values older than max_age seconds
+        are rebuilt anyway, for processes that missed an announcement.
+    """
+
+    def __init__(self, max_age=LISTING_MAX_AGE):
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._values = {}       #key -> (built at, value)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._values.clear()
+
+    def get(self, key, build):
+        """Returns the value cached under key, calling build() to create it if needed."""
+        with self._lock:
+            cached = self._values.get(key)
+            generation = self._generation
+
+        now = time.monotonic()
+        if cached is not None and now - cached[0] <= self.max_age:
+            return cached[1]
+
+        value = build()
+        with self._lock:
+            if generation == self._generation:      #don't cache a value built from a listing that changed meanwhile
+                self._values[key] = (now, value)
+
+        return value
+
+
+listing_cache = ListingCache()
+
+
+class CachedJSON(namedtuple('CachedJSON', 'body gzipped etag')):
+    """A JSON response body serialized once, along with its gzipped form and an ETag."""
+
+    @classmethod
+    def from_obj(cls, obj):
+        body = json.dumps(obj, separators=(",", ":")).encode()
+        return cls(body, gzip.compress(body), hashlib.sha1(body).hexdigest())
+
+
+SearchEntry = namedtuple('SearchEntry', 'id symbol name')
+
+
+def _tokens(text):
+    """Lowercase alphanumeric words of text."""
+    return [token for token in re.split(r"[^0-9a-z]+", text.lower()) if token]
+
+
+def _intersect(lists, chunk=256):
+    """
+        Yields the numbers in all of the sorted lists, in order, shortest list first. The shortest
+        list is intersected with the same range of the others a chunk at a time, so callers that
+        stop early do not pay for intersecting the whole lists.
+    """
+    first, rest = lists[0], lists[1:]
+    for start in range(0, len(first), chunk):
+        ids = first[start:start + chunk]
+        common = set(ids)
+        for other in rest:
+            common.intersection_update(other[bisect_left(other, ids[0]):bisect_right(other, ids[-1])])
+            if not common:
+                break
+        yield from sorted(common)
+
+
+def _trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SymbolSearchIndex():
+    """
+        Ranked prefix and fuzzy search over stock symbols and names.
+
+        Entries are numbered shortest name first, and symbols and every word of every name are
+        indexed by each of their prefixes (up to MAX_PREFIX characters) in lists of entry
+        numbers, which are therefore in ranking order without sorting. A query is a dict lookup
+        per word, and only the first MAX_CANDIDATES matches are scored, so a one word query takes
+        the same time however large the universe is. The lists of several words are intersected
+        a chunk at a time until MAX_CANDIDATES matches are found, which is quick when the words
+        often appear together, but intersects the whole lists, in time growing with the universe,
+        when they rarely do.
+
+        Results are ranked exact symbol, symbol prefix, name prefix, then word prefix, with names
+        matching more of the query words in full ranked higher. When that finds fewer than limit
+        stocks, each query word is replaced by the closest word (by shared trigrams) appearing in
+        any name and the search is repeated, which finds names despite typos.
+    """
+
+    MAX_PREFIX = 12
+    MAX_CANDIDATES = 100        #name matches that are scored, in ranking order
+    MIN_SIMILARITY = 0.4        #trigram similarity a word needs to be taken as a correction of a query word
+
+    def __init__(self, rows):
+        """rows are (id, stock_symbol, name) tuples."""
+        self.entries = sorted((SearchEntry(*row) for row in rows), key=lambda e: (len(e.name), e.name.lower()))
+        self.by_symbol = {}
+        self.symbol_prefixes = {}
+        self.word_prefixes = {}
+        self._words = []
+        self._phrases = []
+
+        for i, entry in enumerate(self.entries):
+            symbol = entry.symbol.lower()
+            self.by_symbol[symbol] = i
+            for end in range(1, min(len(symbol), self.MAX_PREFIX) + 1):
+                self.symbol_prefixes.setdefault(symbol[:end], []).append(i)
+
+            words = _tokens(entry.name)
+            self._words.append(words)
+            self._phrases.append(" ".join(words))
+
+            prefixes = {word[:end] for word in words for end in range(1, min(len(word), self.MAX_PREFIX) + 1)}
+            for prefix in prefixes:
+                self.word_prefixes.setdefault(prefix, []).append(i)
+
+        for ids in self.symbol_prefixes.values():
+            ids.sort(key=lambda i: (len(self.entries[i].symbol), self.entries[i].symbol))
+
+        #the distinct words of all names, for correcting misspelled query words
+        self._vocabulary = sorted({word for words in self._words for word in words})
+        self._vocabulary_trigrams = {}
+        for v, word in enumerate(self._vocabulary):
+            for trigram in _trigrams(word):
+                self._vocabulary_trigrams.setdefault(trigram, []).append(v)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, q, limit=10):
+        """Returns up to limit SearchEntry matches for q, best first."""
+        q = q.strip()
+        if not q:
+            return []
+
+        #"Name (SYM)" autocomplete labels resolve to the symbol
+        label_symbol = re.search(r"\(([^()]+)\)\s*$", q)
+        if label_symbol and label_symbol.group(1).lower() in self.by_symbol:
+            return [self.entries[self.by_symbol[label_symbol.group(1).lower()]]]
+
+        words = _tokens(q)
+        if not words:
+            return []
+
+        scored = {}
+
+        def add(i, score):
+            if score < scored.get(i, score + 1):
+                scored[i] = score
+
+        if len(words) == 1:
+            if words[0] in self.by_symbol:
+                add(self.by_symbol[words[0]], 0)
+            for i in self.symbol_prefixes.get(words[0][:self.MAX_PREFIX], [])[:limit]:
+                add(i, 1)
+
+        self._match_names(words, add, 2)
+
+        if len(scored) < limit:
+            corrected = [self._correct(word) for word in words]
+            if corrected != words:
+                self._match_names(corrected, add, 4)
+
+        def rank(i):
+            #symbol matches are ordered shortest symbol first, name matches by entry number
+            if scored[i] < 2:
+                return (scored[i], len(self.entries[i].symbol), self.entries[i].symbol, i)
+            return (scored[i], 0, "", i)
+
+        return [self.entries[i] for i in sorted(scored, key=rank)[:limit]]
+
+    def _match_names(self, words, add, base_score):
+        """Scores the first MAX_CANDIDATES names with a word starting with each of words."""
+        lists = sorted((self.word_prefixes.get(word[:self.MAX_PREFIX], []) for word in words), key=len)
+        candidates = lists[0]
+        if len(lists) > 1:
+            candidates = _intersect(lists)
+
+        long_words = [word for word in words if len(word) > self.MAX_PREFIX]
+        phrase = " ".join(words)
+        matched = 0
+        for i in candidates:
+            name_words = self._words[i]
+            if long_words and not all(any(w.startswith(word) for w in name_words) for word in long_words):
+                continue
+
+            whole_words = sum(word in name_words for word in words) / len(words)
+            add(i, base_score + (0 if self._phrases[i].startswith(phrase) else 1) - whole_words / 2)
+            matched += 1
+            if matched >= self.MAX_CANDIDATES:
+                break
+
+    def _correct(self, word):
+        """The word of the vocabulary most similar to word, or word itself if none is similar enough."""
+        query_trigrams = _trigrams(word)
+        counts = {}
+        for trigram in query_trigrams:
+            for v in self._vocabulary_trigrams.get(trigram, ()):
+                counts[v] = counts.get(v, 0) + 1
+
+        best, best_similarity = word, self.MIN_SIMILARITY
+        for v, shared in counts.items():
+            candidate = self._vocabulary[v]
+            similarity = shared / (len(query_trigrams) + len(candidate) + 2 - shared)    #a word has len + 2 trigrams
+            if similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+
+    def resolve(self, q):
+        """The best match for q, or None."""
+        matches = self.search(q, limit=1)
+        return matches[0] if matches else None
@@ -0,0 +1,73 @@
+"""Per-process cache of the logged in users' details, so requests can identify the caller without a query."""
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+from engine.constants import USER_CACHE_SIZE, USER_CACHE_MAX_AGE
+
+#what requests need of the current user (g.user), without the password hash
+UserSnapshot = namedtuple("UserSnapshot", "id username image_url current_money total_asset_value")
+
+
+class UserCache():
+    """
+        LRU cache of UserSnapshot by user id, holding at most max_size users. Snapshots are immutable;
+        code that changes a user invalidates their snapshot in this process, and snapshots older than
+        max_age seconds are reloaded to pick up changes made by other processes (like revaluations by
+        the refresh worker). hits and misses are counted.
+    """
+
+    def __init__(self, max_size=USER_CACHE_SIZE, max_age=USER_CACHE_MAX_AGE):
+        self.max_size = max_size
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._snapshots = OrderedDict()     #user id -> (loaded at, snapshot), least recently used first
+        self._invalidations = 0             #snapshots loaded while an invalidation happened are not cached
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def get(self, user_id, load):
+        """
+            The snapshot of the user, from the cache or else from load(), which returns a UserSnapshot
+            or None if there is no such user. Missing users are not cached.
+        """
+        with self._lock:
+            cached = self._snapshots.get(user_id)
+            if cached is not None and time.monotonic() - cached[0] <= self.max_age:
+                self._snapshots.move_to_end(user_id)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+            invalidations = self._invalidations
+
+        snapshot = load()
+        if snapshot is not None:
+            self.put(snapshot, invalidations)
+        return snapshot
+
+    def put(self, snapshot, invalidations=None):
+        """Caches snapshot, unless invalidations (as counted before loading it) is out of date."""
+        with self._lock:
+            if invalidations is not None and invalidations != self._invalidations:
+                return
+            self._snapshots[snapshot.id] = (time.monotonic(), snapshot)
+            self._snapshots.move_to_end(snapshot.id)
+            while len(self._snapshots) > self.max_size:
+                self._snapshots.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Drops the user's snapshot, after their details or balances changed."""
+        with self._lock:
+            self._snapshots.pop(user_id, None)
+            self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+
+
+user_cache = UserCache()
@@ -0,0 +1,27 @@
+"""
+    gunicorn settings, read from the working directory by `gunicorn app:app`.
+"""
+
+
+def post_fork(server, worker):
+    """
+        Under the gevent worker, makes psycopg2 wait on Postgres through gevent, so a query yields to
+        the worker's other greenlets (like the /api/stream streams) instead of blocking all of them.
+    """
+    if "gevent" in server.cfg.worker_class_str:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def post_worker_init(worker):
+    """
+        Starts the worker's broadcaster once its app is loaded, so every worker LISTENs for changed
+        settings and stocks (engine/notify.py) from the start, not only those that served a stream.
+        Also starts loading the price alerts in the background, before the first quote needs them.
+    """
+    from app import app
+    from models import Price_Alert
+    from engine.notify import broadcaster
+    broadcaster.start(app.config['SQLALCHEMY_DATABASE_URI'])
+    with app.app_context():
+        Price_Alert.get_alert_index()
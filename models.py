@@ -1,22 +1,25 @@
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime, date, timedelta
 from flask_bcrypt import Bcrypt
 from os import environ
-import requests
 import json
-from engine.engine import clean_empty
-from secrets import keys
+from engine.payload import clean_empty
+from engine.quotes import quote_fetcher
+from engine.quote_cache import quote_cache
+from engine.constants import ASSET_RECONCILE_INTERVAL, TRANSACTION_PAGE_SIZE, PRICE_INTERVALS, HISTORY_MAX_POINTS
+from engine.leaderboard import leaderboard
+from engine.matching import matching_engine
+from engine.alerts import alert_index, SYNC_OVERLAP
+from engine.notify import notify_prices, notify_portfolio, notify_config, notify_stocks
+from engine.user_cache import user_cache, UserSnapshot
+from engine.config import runtime_config, SETTINGS
+from engine.symbols import listing_cache, SymbolSearchIndex
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
 
-URL = "https://apidojo-yahoo-finance-v1.p.rapidapi.com/stock/get-detail"
-HEADERS = {
-    'x-rapidapi-host': "apidojo-yahoo-finance-v1.p.rapidapi.com",
-    'x-rapidapi-key': keys["rapid_api"]
-}
-
 class Transaction(db.Model):
     """Many to many table of transactions made by users, and the associated stock in the transaction"""
     __tablename__ = "transactions"
@@ -64,6 +67,44 @@ class Transaction(db.Model):
         nullable=False
     )
 
+    __table_args__ = (
+        db.Index('ix_transactions_user_time_id', 'user_id', 'time', 'id'),     #backs get_user_transactions_page
+    )
+
+    def serialize(self):
+        """Returns a dict of the transaction, for JSON responses"""
+        return {
+            "id": self.id,
+            "stock_id": self.stock_id,
+            "stock_symbol": self.stock_symbol,
+            "time": self.time.isoformat(),
+            "quantity": self.quantity,
+            "stock_value_at_time": self.stock_value_at_time,
+            "is_purchase": self.is_purchase
+        }
+
+    @classmethod
+    def get_user_transactions_page(cls, user_id, before=None, limit=TRANSACTION_PAGE_SIZE):
+        """
+            Gets a page of the user's transactions, newest first. before is the (time, id) cursor
+            returned with the previous page, pages are found by seeking the (user_id, time, id) index
+            rather than with an offset. Returns (transactions, cursor), cursor is None on the last page.
+        """
+        query = cls.query.filter(cls.user_id == user_id)
+        if before is not None:
+            query = query.filter(db.tuple_(cls.time, cls.id) < db.tuple_(*before))
+
+        transactions = query \
+            .order_by(cls.time.desc(), cls.id.desc()) \
+            .limit(limit + 1) \
+            .all()
+
+        if len(transactions) <= limit:
+            return transactions, None
+
+        transactions = transactions[:limit]
+        return transactions, (transactions[-1].time, transactions[-1].id)
+
     @classmethod
     def get_user_transactions(cls, user_id):
         return cls.query \
@@ -223,6 +264,13 @@ class User(db.Model):
         default=0
     )
 
+    asset_adjustments = db.Column(      #trades adjusting total_asset_value since its last full valuation
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0"
+    )
+
     user_transactions = db.relationship(  # TODO rewrite as Transactions @classmethod with joins.
         "Transaction",
         secondary="transactions",
@@ -233,56 +281,296 @@ class User(db.Model):
     
     def buy_stock(self, amount, stock_id):
         """Buy a stock"""
-        stock = Stock.query.get(stock_id)
-
-        if self.current_money < (amount * stock.share_price):
-            return False                                        #TODO: make exception instead
-        else:
-            Transaction.generate_transaction(self, stock, amount, True)
-            Owned_Stock.add_owned_stock_for_user(self, stock, amount)
-            self.current_money -= (amount * stock.share_price)
-            self.update_asset_value()
-
-            db.session.add(self)
-        
-            db.session.commit()
-            return True
+        return self._apply_trade(amount, stock_id, is_buy=True)
     
     def sell_stock(self, amount, stock_id):
         """"Sells a stock that the user owns."""
-        stock = Stock.query.get(stock_id)
-        owned_stock = Owned_Stock.user_owns_stock(self.id, stock_id)
+        return self._apply_trade(amount, stock_id, is_buy=False)
 
-        if owned_stock:
-            if amount > owned_stock.quantity:   #prevents negative stocks
-                amount = owned_stock.quantity 
-            
-            Transaction.generate_transaction(self, stock, amount, False)
-            Owned_Stock.remove_owned_stock_for_user(self, stock, amount)
-            self.current_money += (amount * stock.share_price)
-            self.update_asset_value()
+    def _apply_trade(self, amount, stock_id, is_buy, pending_order=None):
+        """
+            Executes a trade as one short database transaction with a single commit. The user's row
+            and then the position's row are locked (SELECT ... FOR UPDATE, always in that order so
+            concurrent trades cannot deadlock), and the balance and quantity are checked against the
+            locked values, so concurrent trades by the same user are serialized instead of
+            overspending or losing updates. Returns False (rolling back) if a buy is not affordable
+            or the stock sold is not owned. A sell of more shares than owned sells all of them.
+            pending_order, a locked Pending_Order being filled by the trade, is marked filled in the
+            same commit.
+        """
+        stock = db.session.query(Stock.id, Stock.stock_symbol, Stock.share_price) \
+            .filter(Stock.id == stock_id) \
+            .first()
+        if stock is None or stock.share_price is None:
+            return False
 
-            db.session.add(self)
-        
-            db.session.commit()
-            return True
+        User.query.filter(User.id == self.id).with_for_update().populate_existing().one()    #refreshes self under the lock
+        owned_stock = Owned_Stock.query \
+            .filter(Owned_Stock.user_id == self.id, Owned_Stock.stock_id == stock.id) \
+            .with_for_update() \
+            .populate_existing() \
+            .first()
+
+        if is_buy:
+            if self.current_money < (amount * stock.share_price):
+                db.session.rollback()
+                return False                                        #TODO: make exception instead
+
+            if owned_stock is None:
+                owned_stock = Owned_Stock(user_id=self.id, stock_id=stock.id, quantity=0)
+                db.session.add(owned_stock)
+            owned_stock.quantity += amount
+            owned_stock.value_when_purchased = stock.share_price
+            owned_stock.time = datetime.now()
+            value = amount * stock.share_price
         else:
-            return False            #TODO: make exceptions instead
+            if owned_stock is None:
+                db.session.rollback()
+                return False                                        #TODO: make exceptions instead
+
+            amount = min(amount, owned_stock.quantity)              #prevents negative stocks
+            if amount == owned_stock.quantity:
+                db.session.delete(owned_stock)
+            else:
+                owned_stock.quantity -= amount
+            value = -(amount * stock.share_price)
 
-    def update_asset_value(self):
+        Transaction.generate_transaction(self, stock, amount, is_buy)
+        self.current_money -= value
+        self.adjust_asset_value(value)
+        if pending_order is not None:
+            pending_order.mark_filled(stock.share_price, amount)
+        notify_portfolio(db.session, self.id)
+
+        db.session.commit()
+        user_cache.invalidate(self.id)
+        self.update_leaderboard()
+        return True
+
+    def apply_orders(self, orders):
+        """
+            Executes a batch of orders, dicts of stock_id, type ("buy" or "sell") and amount (see
+            parse_batch_orders), in the given order and all or nothing. The stocks are read with one
+            query and the user's row and positions locked with one query each, as in _apply_trade.
+            The orders are then checked and applied in memory, so a sell can fund a later buy, and
+            written with a few bulk statements and a single commit. Unlike sell_stock, a sell of
+            more shares than owned is rejected rather than reduced.
+
+            Returns (executed, results), with a result dict per order. When an order is rejected,
+            nothing is executed: that order's result has the error, those before it are rolled back
+            and those after it are skipped.
+        """
+        stock_ids = {order["stock_id"] for order in orders}
+        stocks = {
+            stock.id: stock for stock in db.session.query(Stock.id, Stock.stock_symbol, Stock.share_price) \
+                .filter(Stock.id.in_(stock_ids))
+        }
+
+        User.query.filter(User.id == self.id).with_for_update().populate_existing().one()    #refreshes self under the lock
+        positions = {
+            owned_stock.stock_id: owned_stock for owned_stock in Owned_Stock.query \
+                .filter(Owned_Stock.user_id == self.id, Owned_Stock.stock_id.in_(stock_ids)) \
+                .order_by(Owned_Stock.stock_id) \
+                .with_for_update() \
+                .populate_existing()
+        }
+        quantities = {stock_id: owned_stock.quantity for stock_id, owned_stock in positions.items()}
+
+        money = self.current_money
+        value = 0
+        bought_at = {}              #stock id -> share price of its last buy
+        transactions = []
+        results = []
+        now = datetime.now()
+        rejected = False
+
+        for order in orders:
+            result = dict(order)
+            results.append(result)
+            if rejected:
+                result["status"] = "skipped"
+                continue
+
+            stock = stocks.get(order["stock_id"])
+            is_buy = order["type"] == "buy"
+            amount = order["amount"]
+            held = quantities.get(order["stock_id"], 0)
+
+            if stock is None or stock.share_price is None:
+                result["error"] = "stock not found"
+            elif is_buy and money < amount * stock.share_price:
+                result["error"] = "insufficient funds"
+            elif not is_buy and held < amount:
+                result["error"] = "not enough shares owned"
+
+            if "error" in result:
+                result["status"] = "rejected"
+                rejected = True
+                continue
+
+            cost = amount * stock.share_price if is_buy else -(amount * stock.share_price)
+            money -= cost
+            value += cost
+            quantities[stock.id] = held + amount if is_buy else held - amount
+            if is_buy:
+                bought_at[stock.id] = stock.share_price
+
+            transactions.append({
+                "user_id": self.id, "stock_id": stock.id, "stock_symbol": stock.stock_symbol, "time": now,
+                "quantity": amount, "stock_value_at_time": stock.share_price, "is_purchase": is_buy
+            })
+            result.update(status="filled", price=stock.share_price)
+
+        if rejected:
+            db.session.rollback()
+            for result in results:
+                if result["status"] == "filled":
+                    result["status"] = "rolled_back"
+                    del result["price"]
+            return False, results
+
+        new_positions = []
+        for stock_id, quantity in quantities.items():
+            owned_stock = positions.get(stock_id)
+            if owned_stock is None:
+                if quantity:
+                    new_positions.append({"user_id": self.id, "stock_id": stock_id, "quantity": quantity,
+                                          "value_when_purchased": bought_at[stock_id], "time": now})
+            elif quantity == 0:
+                db.session.delete(owned_stock)
+            elif quantity != owned_stock.quantity:
+                owned_stock.quantity = quantity
+                if stock_id in bought_at:
+                    owned_stock.value_when_purchased = bought_at[stock_id]
+                    owned_stock.time = now
+
+        db.session.bulk_insert_mappings(Owned_Stock, new_positions)
+        db.session.bulk_insert_mappings(Transaction, transactions)
+        self.current_money = money
+        self.adjust_asset_value(value)
+        notify_portfolio(db.session, self.id)
+
+        db.session.commit()
+        user_cache.invalidate(self.id)
+        self.update_leaderboard()
+        return True, results
+
+    @classmethod
+    def get_snapshot(cls, user_id):
+        """
+            The UserSnapshot of the user (see engine/user_cache.py), from this process's cache or else
+            from one projected query, which leaves out the password hash. None if there is no such user.
+        """
+        def load():
+            row = db.session.query(cls.id, cls.username, cls.image_url, cls.current_money, cls.total_asset_value) \
+                .filter(cls.id == user_id) \
+                .first()
+            return UserSnapshot(*row) if row else None
+
+        return user_cache.get(user_id, load)
+
+    @classmethod
+    def get_holdings(cls, user_id):
+        """
+            The user's current_money and holdings, a dict of stock id -> (quantity, share_price), in one
+            query. Returns None if there is no such user. Used to start live portfolio streams.
+        """
+        rows = db.session.query(cls.current_money, Owned_Stock.stock_id, Owned_Stock.quantity, Stock.share_price) \
+            .outerjoin(Owned_Stock, Owned_Stock.user_id == cls.id) \
+            .outerjoin(Stock, Stock.id == Owned_Stock.stock_id) \
+            .filter(cls.id == user_id) \
+            .all()
+        if not rows:
+            return None
+        return rows[0].current_money, {row.stock_id: (row.quantity, row.share_price) for row in rows if row.stock_id is not None}
+
+    @classmethod
+    def get_portfolio_value(cls, user_id):
+        """Value of every stock owned by the user at its current share price, summed in the database."""
+        return db.session.query(db.func.coalesce(db.func.sum(Owned_Stock.quantity * Stock.share_price), 0)) \
+            .join(Stock, Stock.id == Owned_Stock.stock_id) \
+            .filter(Owned_Stock.user_id == user_id) \
+            .scalar()
+
+    def update_asset_value(self, commit=True):
         """
             Sums the value of each stock owned by the user, multiplied by
-            the number of each respective stock that the user owns. 
+            the number of each respective stock that the user owns, in one aggregate query.
             The value is stored as User.total_asset_value
         """
-        stocks = Owned_Stock.get_owned_stock_for_user(self.id)
-        val = 0
-        for stock in stocks:
-            val += (stock.Owned_Stock.quantity * stock.share_price)
-        
-        self.total_asset_value = val
+        self.total_asset_value = User.get_portfolio_value(self.id)
+        self.asset_adjustments = 0
+
         db.session.add(self)
+        if commit:
+            db.session.commit()
+            user_cache.invalidate(self.id)
+
+    def adjust_asset_value(self, delta):
+        """
+            Adds delta, the value of a traded position, to total_asset_value without re-summing
+            the portfolio. The addition happens in the UPDATE statement, and nothing is committed.
+            Every ASSET_RECONCILE_INTERVAL adjustments a full valuation is done instead, to
+            correct the drift from price changes of the other owned stocks. The adjustments are
+            counted in the user's row, which the trade has locked, so they add up across processes.
+        """
+        adjustments = (self.asset_adjustments or 0) + 1
+
+        if adjustments >= ASSET_RECONCILE_INTERVAL:
+            self.update_asset_value(commit=False)
+        else:
+            self.asset_adjustments = adjustments
+            self.total_asset_value = db.func.coalesce(User.total_asset_value, 0) + delta     #a missing value counts as 0
+            db.session.add(self)
+
+    @classmethod
+    def revalue_all(cls):
+        """
+            Recomputes total_asset_value of every user in one set-based UPDATE ... FROM over
+            owned_stocks joined to stocks, and resets their counts of adjustments. Only rows whose
+            value changed, or that were adjusted since, are written. Meant to run right after a price
+            refresh. Returns the number of users written.
+        """
+        holdings = db.session.query(
+                Owned_Stock.user_id.label('user_id'),
+                db.func.sum(Owned_Stock.quantity * Stock.share_price).label('value')) \
+            .join(Stock, Stock.id == Owned_Stock.stock_id) \
+            .group_by(Owned_Stock.user_id) \
+            .subquery()
+
+        holder = db.aliased(User)       #users without holdings are valued at 0
+        values = db.session.query(
+                holder.id.label('user_id'),
+                db.func.coalesce(holdings.c.value, 0).label('value')) \
+            .outerjoin(holdings, holdings.c.user_id == holder.id) \
+            .subquery()
+
+        db.session.execute("SET LOCAL work_mem = '64MB'")     #keeps the aggregate for large user tables in memory
+        updated = cls.query \
+            .filter(cls.id == values.c.user_id) \
+            .filter(db.or_(cls.total_asset_value.is_distinct_from(values.c.value), cls.asset_adjustments != 0)) \
+            .update({cls.total_asset_value: values.c.value, cls.asset_adjustments: 0}, synchronize_session=False)
+
         db.session.commit()
+        leaderboard.invalidate()
+        user_cache.clear()
+        return updated
+
+    @classmethod
+    def get_leaderboard(cls):
+        """
+            Ranking of all users by net worth (current_money + total_asset_value). The ranking is
+            kept in memory and reloaded in one projected query once it is older than LEADERBOARD_MAX_AGE.
+        """
+        if leaderboard.is_stale():
+            leaderboard.load(
+                db.session.query(cls.id, cls.username, cls.current_money + db.func.coalesce(cls.total_asset_value, 0)).all()
+            )
+        return leaderboard
+
+    def update_leaderboard(self):
+        """Moves the user to the position of their current net worth in the ranking."""
+        leaderboard.update(self.id, self.username, self.current_money + (self.total_asset_value or 0))
 
     @classmethod
     def signup(cls, username, password):
@@ -297,7 +585,7 @@ class User(db.Model):
             username=username,
             password=hashed_pwd,
             current_money=10000,
-            total_asset_value=10000
+            total_asset_value=0
         )
 
         db.session.add(user)
@@ -320,6 +608,9 @@ class User(db.Model):
 
         return False
 
+#leaves free space in each page of users, so revalue_all can rewrite total_asset_value with HOT updates
+db.event.listen(User.__table__, 'after_create', db.DDL("ALTER TABLE users SET (fillfactor = 70)"))
+
 class Stock(db.Model):
     """A comapnies stock that a user can purchase"""
     __tablename__ = "stocks"
@@ -342,11 +633,17 @@ class Stock(db.Model):
         unique=True
     )
 
-    data = db.Column(
+    sector = db.Column(
+        db.Text
+    )
+
+    #the cleaned get-detail payload, tens of KB per stock, so it is only loaded when accessed (or undeferred)
+    data = db.deferred(db.Column(
         db.JSON,
         nullable=False,
         default={}
-    )
+    ))
+
     share_price = db.Column(
         db.Float
     )
@@ -355,6 +652,24 @@ class Stock(db.Model):
         db.DateTime
     )
 
+    def apply_quote(self, json_dict):
+        """
+            Sets share_price, data and last_updated from a get-detail payload of the external api.
+            The stock is added to the session but not committed. Returns False if the payload has no price.
+            json_dict is cleaned in place and becomes the stock's data.
+        """
+        try:
+            price = json_dict['price']['regularMarketPrice']['raw']
+        except (KeyError, TypeError):
+            return False
+
+        self.share_price = price
+        self.last_updated = datetime.now()
+        self.data = clean_empty(json_dict, in_place=True)
+
+        db.session.add(self)
+        return True
+
     @classmethod
     def get_update(cls, stock_id):
         """
@@ -363,30 +678,619 @@ class Stock(db.Model):
             more information on the stock from the api. 
 
         """
-        symbol = cls.query.get(stock_id).stock_symbol
+        s = cls.query.get(stock_id)
+
+        def apply(json_dict):
+            if json_dict is None or not s.apply_quote(json_dict):
+                return False  # TODO: better error handling
+            Price_History.record([s])
+            price = s.share_price
+            notify_prices(db.session, [(s.id, price)])
+            db.session.commit()
+            Price_Alert.trigger_crossed([(s.id, price)])
+            Pending_Order.fill_crossed([(s.id, price)])
+            return True
+
+        #skips the api while s is fresh, and shares one fetch between concurrent requests for s
+        updated = quote_cache.refresh(s, apply)
+        if not quote_cache.is_fresh(s):
+            db.session.expire(s)    #picks up a quote written by a concurrent request
+        return updated
 
-        querystring = {"region": "US", "lang": "en", "symbol": symbol}
-        res = requests.request(
-            "GET", URL, headers=HEADERS, params=querystring
+    @classmethod
+    def get_data_fields(cls, stock_id, fields):
+        """
+            Returns the subtrees of the stock's data named by fields, extracted by Postgres so that
+            the rest of the payload is never loaded. A field is a top level key or a dotted path
+            such as price.regularMarketPrice, and fields missing from the data are left out.
+            Returns None if there is no stock with stock_id.
+        """
+        paths = [field.split(".") for field in fields]
+        row = db.session.query(cls.id, *[cls.data[tuple(path)] for path in paths]) \
+            .filter(cls.id == stock_id) \
+            .first()
+        if row is None:
+            return None
+
+        data = {}
+        for path, value in zip(paths, row[1:]):
+            if value is None:
+                continue
+            node = data
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = value
+        return data
+
+    @classmethod
+    def update_many(cls, stocks, fetcher=None):
+        """
+            Gets updated data for every stock in stocks concurrently, then writes all of them
+            in a single commit. Returns False if any of the stocks could not be updated.
+            fetcher can be any object with a fetch_many(symbols) method, and defaults to the
+            shared QuoteFetcher for the external api.
+        """
+        fetcher = fetcher or quote_fetcher
+        stocks = list(stocks)
+        quotes = fetcher.fetch_many(s.stock_symbol for s in stocks)
+
+        updated = []
+        for s in stocks:
+            json_dict = quotes.get(s.stock_symbol)
+            if json_dict is not None and s.apply_quote(json_dict):
+                updated.append(s)
+
+        Price_History.record(updated)
+        prices = [(s.id, s.share_price) for s in updated]
+        notify_prices(db.session, prices)
+        db.session.commit()
+        Price_Alert.trigger_crossed(prices)
+        Pending_Order.fill_crossed(prices)
+        return len(updated) == len(stocks)
+
+    @classmethod
+    def get_search_index(cls):
+        """
+            Search index over the names and symbols of all stocks. Built from one projected
+            query and kept in memory until the stocks table changes (see listing_cache).
+        """
+        def build():
+            return SymbolSearchIndex(db.session.query(cls.id, cls.stock_symbol, cls.name).order_by(cls.id).all())
+
+        return listing_cache.get("search_index", build)
+
+def _stock_listing_changed(session, connection):
+    """Flags the transaction as changing the listing, and announces that to other processes once in it."""
+    if not session.info.get('stock_listing_changed'):
+        session.info['stock_listing_changed'] = True
+        notify_stocks(connection)
+
+@db.event.listens_for(Stock, 'after_insert')
+@db.event.listens_for(Stock, 'after_delete')
+def _stock_listed_or_delisted(mapper, connection, target):
+    _stock_listing_changed(db.object_session(target), connection)
+
+@db.event.listens_for(Stock, 'after_update')
+def _stock_renamed(mapper, connection, target):
+    state = db.inspect(target)
+    if state.attrs.name.history.has_changes() or state.attrs.stock_symbol.history.has_changes():
+        _stock_listing_changed(db.object_session(target), connection)
+
+@db.event.listens_for(db.session, 'after_bulk_update')
+@db.event.listens_for(db.session, 'after_bulk_delete')
+def _stocks_bulk_changed(context):
+    if context.mapper.class_ is Stock:
+        _stock_listing_changed(context.session, context.session)
+
+@db.event.listens_for(db.session, 'after_commit')
+def _invalidate_stock_listing(session):
+    """Cached stock names and symbols are invalidated once the change is committed"""
+    if session.info.pop('stock_listing_changed', False):
+        listing_cache.invalidate()
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _discard_stock_listing_change(session):
+    session.info.pop('stock_listing_changed', None)
+
+class Price_History(db.Model):
+    """Every quote of a stock's share price, appended by Stock.get_update and Stock.update_many"""
+    __tablename__ = "price_history"
+
+    stock_id = db.Column(
+        db.Integer,
+        db.ForeignKey('stocks.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    time = db.Column(
+        db.DateTime,
+        primary_key=True
+    )
+
+    price = db.Column(
+        db.Float,
+        nullable=False
+    )
+
+    @classmethod
+    def record(cls, stocks):
+        """
+            Appends the share_price of each of stocks at its last_updated time to the history, and
+            folds it into the rollups (see Price_Rollup.add). Two statements for any number of stocks,
+            run in the current transaction without committing. A quote already recorded is skipped.
+        """
+        points = {s.id: (s.last_updated, s.share_price) for s in stocks if s.id is not None}
+        if not points:
+            return
+
+        rows = [{"stock_id": stock_id, "time": time, "price": price} for stock_id, (time, price) in points.items()]
+        db.session.execute(insert(cls.__table__).values(rows).on_conflict_do_nothing())
+        Price_Rollup.add(rows)
+
+class Price_Rollup(db.Model):
+    """
+        Open, high, low and close share price of a stock over each bucket of time, for each
+        bucket size in PRICE_INTERVALS. Kept up to date as quotes are recorded, so charts
+        never read the raw price history.
+    """
+    __tablename__ = "price_rollups"
+
+    stock_id = db.Column(
+        db.Integer,
+        db.ForeignKey('stocks.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    interval = db.Column(
+        db.String(3),
+        primary_key=True
+    )
+
+    bucket = db.Column(
+        db.DateTime,
+        primary_key=True
+    )
+
+    open = db.Column(db.Float, nullable=False)
+    high = db.Column(db.Float, nullable=False)
+    low = db.Column(db.Float, nullable=False)
+    close = db.Column(db.Float, nullable=False)
+
+    #times of the quotes open and close were taken from, so quotes recorded out of order still fold correctly
+    opened_at = db.Column(db.DateTime, nullable=False)
+    closed_at = db.Column(db.DateTime, nullable=False)
+
+    @staticmethod
+    def bucket_start(time, interval):
+        """Start of the bucket of size interval (a key of PRICE_INTERVALS) containing time."""
+        size = PRICE_INTERVALS[interval]
+        return datetime.min + (time - datetime.min) // size * size
+
+    @classmethod
+    def add(cls, points):
+        """
+            Folds points (dicts of stock_id, time and price) into the bucket containing them in
+            every rollup, with one INSERT ... ON CONFLICT DO UPDATE. Points must be of distinct stocks.
+        """
+        table = cls.__table__
+        rows = [
+            {
+                "stock_id": point["stock_id"], "interval": interval, "bucket": cls.bucket_start(point["time"], interval),
+                "open": point["price"], "high": point["price"], "low": point["price"], "close": point["price"],
+                "opened_at": point["time"], "closed_at": point["time"]
+            }
+            for point in points for interval in PRICE_INTERVALS
+        ]
+
+        stmt = insert(table).values(rows)
+        new = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.stock_id, table.c.interval, table.c.bucket],
+            set_={
+                "open": db.case([(new.opened_at < table.c.opened_at, new.open)], else_=table.c.open),
+                "high": db.func.greatest(table.c.high, new.high),
+                "low": db.func.least(table.c.low, new.low),
+                "close": db.case([(new.closed_at >= table.c.closed_at, new.close)], else_=table.c.close),
+                "opened_at": db.func.least(table.c.opened_at, new.opened_at),
+                "closed_at": db.func.greatest(table.c.closed_at, new.closed_at)
+            }
         )
+        db.session.execute(stmt)
+
+    @classmethod
+    def get_range(cls, stock_id, interval, start=None, limit=HISTORY_MAX_POINTS):
+        """
+            The stock's buckets of size interval from start (or all of them) to now, oldest first,
+            as dicts for JSON responses. At most the latest limit buckets are returned.
+            Reads one range of the primary key index.
+        """
+        query = db.session.query(cls.bucket, cls.open, cls.high, cls.low, cls.close) \
+            .filter(cls.stock_id == stock_id, cls.interval == interval)
+        if start is not None:
+            query = query.filter(cls.bucket >= cls.bucket_start(start, interval))
+
+        rows = query.order_by(cls.bucket.desc()).limit(limit).all()
+        return [
+            {"time": bucket.isoformat(), "open": open, "high": high, "low": low, "close": close}
+            for bucket, open, high, low, close in reversed(rows)
+        ]
+
+class Pending_Order(db.Model):
+    """
+        A limit or stop order of a user, waiting for the share price of its stock to reach price.
+        A buy limit or sell stop triggers once the share price is at or below price, a sell limit
+        or buy stop once it is at or above it. Orders are matched by the in-memory matching_engine
+        whenever quotes are refreshed, and filled like a trade made by the user at the new price.
+    """
+    __tablename__ = "pending_orders"
 
-        if res.status_code != 200:
-            return False  # TODO: better error handling
-        json_dict = res.json()
-        price = json_dict['price']['regularMarketPrice']['raw']
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=True
+    )
 
-        
-        s = cls.query.get(stock_id)
-        s.share_price = price
-        s.last_updated = datetime.now()
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+        index=True
+    )
+
+    stock_id = db.Column(
+        db.Integer,
+        db.ForeignKey('stocks.id', ondelete='cascade'),
+        nullable=False
+    )
+
+    is_purchase = db.Column(
+        db.Boolean,
+        nullable=False
+    )
+
+    order_type = db.Column(
+        db.String(5),           #limit or stop
+        nullable=False
+    )
+
+    quantity = db.Column(
+        db.Integer,
+        nullable=False
+    )
+
+    price = db.Column(
+        db.Float,
+        nullable=False
+    )
+
+    status = db.Column(
+        db.String(9),           #open, filled, failed or cancelled
+        nullable=False,
+        default="open"
+    )
+
+    created = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.now
+    )
+
+    filled_at = db.Column(db.DateTime)
+    fill_price = db.Column(db.Float)
+    filled_quantity = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.Index('ix_pending_orders_open', 'stock_id', postgresql_where=db.text("status = 'open'")),    #backs get_matching_engine
+    )
+
+    def serialize(self):
+        """Returns a dict of the order, for JSON responses"""
+        return {
+            "id": self.id,
+            "stock_id": self.stock_id,
+            "type": "buy" if self.is_purchase else "sell",
+            "order_type": self.order_type,
+            "amount": self.quantity,
+            "price": self.price,
+            "status": self.status,
+            "created": self.created.isoformat(),
+            "filled_at": self.filled_at.isoformat() if self.filled_at else None,
+            "fill_price": self.fill_price,
+            "filled_quantity": self.filled_quantity
+        }
+
+    def mark_filled(self, price, quantity):
+        """Records the fill, without committing. Used by User._apply_trade."""
+        self.status = "filled"
+        self.filled_at = datetime.now()
+        self.fill_price = price
+        self.filled_quantity = quantity
+
+    @classmethod
+    def get_matching_engine(cls):
+        """The matching engine, (re)loaded from the open orders in one projected query if stale."""
+        if matching_engine.is_stale():
+            matching_engine.load(
+                db.session.query(cls.id, cls.stock_id, cls.is_purchase, cls.order_type, cls.price) \
+                    .filter(cls.status == "open") \
+                    .all()
+            )
+        return matching_engine
 
-        json_dict = clean_empty(json_dict)
-        s.data=json_dict
+    @classmethod
+    def place(cls, user, stock_id, is_buy, order_type, quantity, price):
+        """
+            Adds an open order of user and puts it in the matching engine. Returns the order, or
+            None if there is no stock with stock_id. The order fills at the first refresh of the
+            stock's share price that reaches price, which may be the next one.
+        """
+        if db.session.query(Stock.id).filter(Stock.id == stock_id).scalar() is None:
+            return None
 
-        db.session.add(s)
+        order = cls(user_id=user.id, stock_id=stock_id, is_purchase=is_buy, order_type=order_type,
+                    quantity=quantity, price=price)
+        db.session.add(order)
         db.session.commit()
-       
-        return True
+
+        cls.get_matching_engine().add(order.id, order.stock_id, order.is_purchase, order.order_type, order.price)
+        return order
+
+    @classmethod
+    def cancel(cls, user_id, order_id):
+        """
+            Cancels an open order of the user. Returns the order, with its status left as is if it
+            was no longer open, or None if the user has no such order.
+        """
+        order = cls.query \
+            .filter(cls.id == order_id, cls.user_id == user_id) \
+            .with_for_update() \
+            .first()
+        if order is None:
+            db.session.rollback()
+            return None
+
+        if order.status == "open":
+            order.status = "cancelled"
+        db.session.commit()
+        matching_engine.remove(order.id)
+        return order
+
+    @classmethod
+    def fill_crossed(cls, prices):
+        """
+            Fills the open orders triggered by prices, (stock_id, share_price) pairs of stocks whose quotes
+            have just been refreshed and committed. Each order is filled through the same path as User.buy_stock and
+            User.sell_stock: its row is locked first, then the user's and the position's, and the fill
+            and the trade are committed together. An order whose trade fails, like a buy the user can no
+            longer afford, is marked failed. Returns the number of orders filled.
+        """
+        engine = cls.get_matching_engine()
+        crossed = [order_id for stock_id, price in prices for order_id in engine.crossed(stock_id, price)]
+
+        filled = 0
+        for order_id in crossed:
+            order = cls.query \
+                .filter(cls.id == order_id, cls.status == "open") \
+                .with_for_update() \
+                .populate_existing() \
+                .first()
+            if order is None:       #cancelled, or filled by another process
+                db.session.rollback()
+                continue
+
+            user = User.query.get(order.user_id)
+            if user._apply_trade(order.quantity, order.stock_id, order.is_purchase, pending_order=order):
+                filled += 1
+            else:
+                order = cls.query.filter(cls.id == order_id, cls.status == "open").with_for_update().first()
+                if order is not None:
+                    order.status = "failed"
+                db.session.commit()
+        return filled
+
+    @classmethod
+    def get_user_orders(cls, user_id, status=None):
+        """The user's orders, newest first, only those of status if given."""
+        query = cls.query.filter(cls.user_id == user_id)
+        if status is not None:
+            query = query.filter(cls.status == status)
+        return query.order_by(cls.created.desc(), cls.id.desc()).all()
+
+class Price_Alert(db.Model):
+    """
+        A user's alert on the share price of a stock: rising to threshold (above), falling to it
+        (below), or moving threshold percent either way from reference_price, the share price when
+        the alert was set (percent). Alerts are checked against each new quote by the in-memory
+        alert_index, trigger once, and are delivered by polling (see Price_Alert.poll).
+    """
+    __tablename__ = "price_alerts"
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=True
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+        index=True
+    )
+
+    stock_id = db.Column(
+        db.Integer,
+        db.ForeignKey('stocks.id', ondelete='cascade'),
+        nullable=False
+    )
+
+    kind = db.Column(
+        db.String(7),           #above, below or percent
+        nullable=False
+    )
+
+    threshold = db.Column(
+        db.Float,
+        nullable=False
+    )
+
+    reference_price = db.Column(db.Float)
+
+    created = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.now
+    )
+
+    triggered_at = db.Column(db.DateTime)
+    triggered_price = db.Column(db.Float)
+
+    delivered = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False
+    )
+
+    __table_args__ = (
+        db.Index('ix_price_alerts_active', 'created', postgresql_where=db.text("triggered_at IS NULL")),        #backs get_alert_index syncs
+        db.Index('ix_price_alerts_undelivered', 'user_id',
+                 postgresql_where=db.text("triggered_at IS NOT NULL AND NOT delivered")),                     #backs poll
+    )
+
+    def serialize(self):
+        """Returns a dict of the alert, for JSON responses"""
+        return {
+            "id": self.id,
+            "stock_id": self.stock_id,
+            "kind": self.kind,
+            "threshold": self.threshold,
+            "reference_price": self.reference_price,
+            "created": self.created.isoformat(),
+            "triggered_at": self.triggered_at.isoformat() if self.triggered_at else None,
+            "triggered_price": self.triggered_price,
+            "delivered": self.delivered
+        }
+
+    @classmethod
+    def load_alert_index(cls):
+        """Loads every active alert into the alert index in one projected query, which takes seconds with millions of alerts."""
+        as_of = datetime.now()
+        alert_index.load(cls._active_alerts().all(), as_of)
+
+    @classmethod
+    def get_alert_index(cls):
+        """
+            The alert index, synced with the active alerts created since it was last read when it is
+            stale, or None until it is first loaded. Full loads, on first use and every ALERTS_RELOAD_AGE,
+            run in a background thread, so no request waits for one.
+        """
+        if alert_index.needs_reload():
+            def load():
+                try:
+                    cls.load_alert_index()
+                finally:
+                    db.session.remove()         #the thread's own session
+            alert_index.reload_in_background(load)
+
+        if alert_index.loaded_at is None:
+            return None
+        if alert_index.is_stale():
+            as_of = datetime.now()
+            alert_index.sync(cls._active_alerts().filter(cls.created >= alert_index.as_of - SYNC_OVERLAP).all(), as_of)
+        return alert_index
+
+    @classmethod
+    def _active_alerts(cls):
+        return db.session.query(cls.id, cls.stock_id, cls.kind, cls.threshold, cls.reference_price) \
+            .filter(cls.triggered_at == None)
+
+    @classmethod
+    def create(cls, user, stock_id, kind, threshold):
+        """
+            Adds an alert of user and puts it in the alert index. Returns the alert, or None if there
+            is no stock with stock_id, or it has no share price to measure a percent move from.
+            The alert is checked from the next quote of the stock on.
+        """
+        share_price = db.session.query(Stock.share_price).filter(Stock.id == stock_id).scalar()
+        if share_price is None:
+            return None
+
+        alert = cls(user_id=user.id, stock_id=stock_id, kind=kind, threshold=threshold, reference_price=share_price)
+        db.session.add(alert)
+        db.session.commit()
+
+        index = cls.get_alert_index()
+        if index is not None:           #else the load in progress, or the sync after it, reads the alert
+            index.add(alert.id, alert.stock_id, alert.kind, alert.threshold, alert.reference_price)
+        return alert
+
+    @classmethod
+    def delete(cls, user_id, alert_id):
+        """Deletes an alert of the user. Returns False if the user has no such alert."""
+        deleted = cls.query.filter(cls.id == alert_id, cls.user_id == user_id).delete()
+        db.session.commit()
+        alert_index.remove(alert_id)
+        return bool(deleted)
+
+    @classmethod
+    def trigger_crossed(cls, prices):
+        """
+            Triggers the alerts crossed by prices, (stock_id, share_price) pairs of stocks whose quotes
+            have just been refreshed and committed. Only the crossed alerts are looked at, and all of them
+            are written with one UPDATE and committed. Returns the number of alerts triggered, none
+            while the alert index is first being loaded.
+        """
+        index = cls.get_alert_index()
+        if index is None:
+            return 0
+
+        crossed = {}        #stock id -> (price, ids of alerts crossed)
+        for stock_id, price in prices:
+            ids = index.crossed(stock_id, price)
+            if ids:
+                crossed[stock_id] = (price, ids)
+        if not crossed:
+            return 0
+
+        triggered = cls.query \
+            .filter(cls.id.in_([id for price, ids in crossed.values() for id in ids]), cls.triggered_at == None) \
+            .update({
+                cls.triggered_at: datetime.now(),
+                cls.triggered_price: db.case({stock_id: price for stock_id, (price, ids) in crossed.items()}, value=cls.stock_id)
+            }, synchronize_session=False)
+        db.session.commit()
+        return triggered
+
+    @classmethod
+    def poll(cls, user_id):
+        """
+            Returns the user's triggered alerts that have not been delivered yet, as dicts, and marks them
+            delivered, in one UPDATE ... RETURNING on the index of undelivered alerts. Polling when
+            nothing has triggered reads no rows.
+        """
+        table = cls.__table__
+        rows = db.session.execute(
+            table.update() \
+                .where(db.and_(table.c.user_id == user_id, table.c.triggered_at != None, table.c.delivered == False)) \
+                .values(delivered=True) \
+                .returning(table.c.id, table.c.stock_id, table.c.kind, table.c.threshold, table.c.reference_price,
+                           table.c.triggered_at, table.c.triggered_price)
+        ).fetchall()
+        db.session.commit()
+
+        return [
+            {
+                "id": row.id, "stock_id": row.stock_id, "kind": row.kind, "threshold": row.threshold,
+                "reference_price": row.reference_price, "triggered_at": row.triggered_at.isoformat(),
+                "triggered_price": row.triggered_price
+            }
+            for row in sorted(rows, key=lambda row: (row.triggered_at, row.id))
+        ]
+
+    @classmethod
+    def get_user_alerts(cls, user_id):
+        """The user's alerts, newest first."""
+        return cls.query.filter(cls.user_id == user_id).order_by(cls.created.desc(), cls.id.desc()).all()
 
 class App_Config(db.Model):
     """
@@ -403,7 +1307,8 @@ class App_Config(db.Model):
 
     name = db.Column(
         db.String(20),
-        nullable=False
+        nullable=False,
+        unique=True
     )
 
     value = db.Column(
@@ -415,18 +1320,44 @@ class App_Config(db.Model):
     )
 
     @classmethod
-    def toggle_large_updates(cls):
-        var = cls.query.get(1)
-        var.toggle = False if var.toggle else True
-        db.session.add(var)
+    def get_runtime_config(cls):
+        """
+            The settings of every app_config row by name (see engine/config.py), kept in memory and
+            reloaded in one projected query once older than CONFIG_MAX_AGE or changed.
+        """
+        if runtime_config.is_stale():
+            runtime_config.load(db.session.query(cls.name, cls.value, cls.toggle).order_by(cls.id).all())
+        return runtime_config
+
+    @classmethod
+    def get_setting(cls, name):
+        """The typed value of the setting, from memory unless the settings are due a reload."""
+        return cls.get_runtime_config().get(name)
+
+    @classmethod
+    def set_toggle(cls, name, toggle=None):
+        """
+            Turns the boolean setting on or off, or flips it when toggle is None, creating its row if
+            it has none. Other processes are notified to reload their settings. Returns the new value.
+        """
+        var = cls.query.filter(cls.name == name).with_for_update().one_or_none()
+        if var is None:
+            var = cls(name=name, toggle=SETTINGS[name][1])
+            db.session.add(var)
+
+        var.toggle = (not var.toggle) if toggle is None else toggle
+        notify_config(db.session, name)
         db.session.commit()
+        runtime_config.invalidate()
+        return var.toggle
+
+    @classmethod
+    def toggle_large_updates(cls):
+        return cls.set_toggle("GET_LARGE_UPDATES")
 
     @classmethod
     def toggle_small_updates(cls):
-        var = cls.query.get(2)
-        var.toggle = False if var.toggle else True
-        db.session.add(var)
-        db.session.commit()
+        return cls.set_toggle("GET_SMALL_UPDATES")
 
 def connect_db(app):
     """Connect to database."""
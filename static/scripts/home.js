@@ -0,0 +1,32 @@
+const API_URL = "/api/"
+
+const $loadTransactionsBtn = $('#load-transactions');
+const $transactionList = $('.transaction-list tbody');
+
+async function getTransactions(userId, cursor) {
+    res = await axios.get(`${API_URL}users/${userId}/transactions`, { params: { cursor: cursor } });
+    return res.data
+}
+
+$loadTransactionsBtn.click(async function () {
+    data = await getTransactions($(this).attr('data-user-id'), $(this).attr('data-cursor'));
+
+    for (const transaction of data.transactions) {
+        $transactionList.append(`
+        <tr>
+            <td>${transaction.stock_symbol}</td>
+            <td>${transaction.time.replace('T', ' ')}</td>
+            <td>${transaction.quantity}</td>
+            <td>${transaction.stock_value_at_time}</td>
+            <td>${transaction.is_purchase ? "Buy" : "Sell"}</td>
+        </tr>
+        `);
+    }
+
+    if (data.next_cursor) {
+        $(this).attr('data-cursor', data.next_cursor);
+    }
+    else {
+        $(this).remove();
+    }
+});
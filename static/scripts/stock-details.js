@@ -6,8 +6,12 @@ const $allData = $('#all-data');
 const stockId = parseInt($('#stock-id').attr('data-id'), 10);
 // const axios = require('axios');
 
+//sections of the stock data shown under "Show All Data" (leaves out the long insider transaction and rating histories)
+const DATA_FIELDS = ["price", "summaryDetail", "summaryProfile", "financialData", "defaultKeyStatistics", "earnings",
+    "calendarEvents", "recommendationTrend", "majorHoldersBreakdown", "netSharePurchaseActivity"];
+
 async function get_all_data() {
-    res = await axios.get(`${API_URL}stocks/${stockId}`);
+    res = await axios.get(`${API_URL}stocks/${stockId}`, { params: { fields: DATA_FIELDS.join(",") } });
     return res.data
 }
 
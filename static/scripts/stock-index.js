@@ -1,32 +1,26 @@
-const API_URL = "http://127.0.0.1:5000/api/"
+const API_URL = "/api/"
 
 const $searchInput = $('#search-input');
 
-async function getSearchLabels(){
-    res = await axios.get(`${API_URL}stocks`);
-    return res.data["stock_names"];
+async function searchStocks(term){
+    res = await axios.get(`${API_URL}stocks/search`, { params: { q: term } });
+    return res.data["results"];
 }
 
-
-// async function autocomplete(terms){
-//     $searchInput.autocomplete({"source":terms});
-// }
-
-// async function get_terms(){
-//     terms = await getSearchLabels();
-//     console.log(terms);
-//     await autocomplete(terms);
-// }
-
-// get_terms();
-// $searchInput.autocomplete({
-//     source:auto_complete_data
-// });
-
-$( async function() {
-    let availableTags = await getSearchLabels();
-    
-    $( "#search-input" ).autocomplete({
-      source: availableTags[0]
+$(function() {
+    $searchInput.autocomplete({
+        delay: 100,
+        source: async function(request, response) {
+            try {
+                let results = await searchStocks(request.term);
+                response(results.map(stock => ({ label: stock.label, value: stock.label, id: stock.id })));
+            }
+            catch (e) {
+                response([]);
+            }
+        },
+        select: function(event, ui) {
+            window.location.href = `/stocks/${ui.item.id}`;
+        }
     });
-  } );
\ No newline at end of file
+});
@@ -0,0 +1,20 @@
+const STREAM_URL = "/api/stream";
+
+//live prices and portfolio value, pushed by the server as they change
+const stream = new EventSource(STREAM_URL);
+
+stream.addEventListener('price', function (e) {
+    const update = JSON.parse(e.data);
+    const $row = $(`.owned-stock[data-stock-id="${update.id}"]`);
+
+    $row.find('.share-price').text(update.price);
+    $row.find('.owned-value').text(update.price * $row.attr('data-quantity'));
+});
+
+stream.addEventListener('portfolio', function (e) {
+    const portfolio = JSON.parse(e.data);
+
+    $('#current-money').text(portfolio.current_money);
+    $('#total-asset-value').text(portfolio.total_asset_value);
+    $('#net-worth').text(portfolio.net_worth);
+});
@@ -0,0 +1,87 @@
+"""
+    Local stand-in for the rapid-api get-detail endpoint, used in tests in place of the
+    external api. Payloads are util/sample.json with the symbol and price swapped in.
+
+        with FakeQuoteServer({"TEST1": 12.5}) as server:
+            fetcher = QuoteFetcher(url=server.url, headers={})
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import copy
+import json
+import threading
+
+with open('util/sample.json') as json_file:
+    SAMPLE_DATA = json.load(json_file)
+
+
+class FakeQuoteServer():
+    """
+        Serves a get-detail payload for every symbol in prices, and a 404 for any other symbol.
+        prices can be changed while the server is running. requests counts the quotes served.
+    """
+
+    def __init__(self, prices):
+        self.prices = dict(prices)
+        self.requests = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/stock/get-detail"
+
+    def payload(self, symbol):
+        data = copy.deepcopy(SAMPLE_DATA)
+        price = self.prices[symbol]
+        data['symbol'] = symbol
+        data['price']['symbol'] = symbol
+        data['price']['regularMarketPrice'] = {"raw": price, "fmt": f"{price:.2f}"}
+        return data
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                symbol = parse_qs(urlparse(self.path).query).get("symbol", [None])[0]
+                server.requests += 1
+
+                if symbol not in server.prices:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                body = json.dumps(server.payload(symbol)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeQuoteFetcher():
+    """
+        In-process stand-in for a QuoteFetcher, for tests that only need prices: fetch_many returns
+        a minimal get-detail payload, just the price, for each symbol in prices.
+    """
+
+    def __init__(self, prices):
+        self.prices = prices
+
+    def fetch_many(self, symbols):
+        return {symbol: {"price": {"regularMarketPrice": {"raw": self.prices[symbol]}}} for symbol in symbols}
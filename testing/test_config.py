@@ -0,0 +1,31 @@
+from unittest import TestCase
+
+from engine.config import RuntimeConfig
+
+# run these tests like:
+#
+#    python -m unittest testing/test_config.py
+
+class RuntimeConfigTestCase(TestCase):
+
+    def test_defaults(self):
+        """Settings without a row read as their default"""
+        config = RuntimeConfig(max_age=60)
+        self.assertTrue(config.is_stale())
+        config.load([])
+        self.assertFalse(config.is_stale())
+        self.assertIs(config.get("GET_LARGE_UPDATES"), False)
+
+    def test_load(self):
+        config = RuntimeConfig(max_age=60)
+        config.load([("GET_LARGE_UPDATES", None, True), ("GET_SMALL_UPDATES", None, None), ("UNKNOWN", "1", None)])
+        self.assertIs(config.get("GET_LARGE_UPDATES"), True)
+        self.assertIs(config.get("GET_SMALL_UPDATES"), False)
+        with self.assertRaises(KeyError):
+            config.get("UNKNOWN")
+
+    def test_invalidate(self):
+        config = RuntimeConfig(max_age=60)
+        config.load([])
+        config.invalidate()
+        self.assertTrue(config.is_stale())
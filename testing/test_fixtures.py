@@ -0,0 +1,39 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from engine.fixtures import QuoteFixtures
+
+# run these tests like:
+#
+#    python -m unittest testing/test_fixtures.py
+
+class QuoteFixturesTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.sample = os.path.join(self.dir.name, "sample.json")
+        with open(self.sample, "w") as f:
+            json.dump({"symbol": "SAMPLE", "price": {"raw": 1}, "list": [{"a": 1}]}, f)
+        with open(os.path.join(self.dir.name, "TEST.json"), "w") as f:
+            json.dump({"symbol": "TEST"}, f)
+        self.fixtures = QuoteFixtures(self.sample, self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_shared_and_read_only(self):
+        """The payload is parsed once, and cannot be changed by whoever reads it"""
+        data = self.fixtures.get()
+        self.assertIs(self.fixtures.get("NOPE"), data)
+        self.assertEqual(data["price"]["raw"], 1)
+        with self.assertRaises(TypeError):
+            data["price"]["raw"] = 2
+        with self.assertRaises(TypeError):
+            data["list"][0]["a"] = 2
+
+    def test_symbol_files(self):
+        self.assertEqual(self.fixtures.get("TEST")["symbol"], "TEST")
+        self.assertEqual(self.fixtures.get("OTHER")["symbol"], "SAMPLE")
+        self.assertEqual(self.fixtures.get("../sample")["symbol"], "SAMPLE")
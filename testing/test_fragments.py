@@ -0,0 +1,56 @@
+from unittest import TestCase
+
+from engine.fragments import FragmentCache
+
+# run these tests like:
+#
+#    python -m unittest testing/test_fragments.py
+
+class FragmentCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = FragmentCache(max_bytes=10)
+        self.renders = []
+
+    def render(self, fragment):
+        def render():
+            self.renders.append(fragment)
+            return fragment
+        return render
+
+    def test_versions(self):
+        """A fragment is rendered once per version, and a new version replaces the old one"""
+        self.assertEqual(self.cache.get_or_render(1, "a", self.render("abc")), "abc")
+        self.assertEqual(self.cache.get_or_render(1, "a", self.render("xyz")), "abc")
+        self.assertEqual(self.cache.get_or_render(1, "b", self.render("de")), "de")
+        self.assertEqual(self.renders, ["abc", "de"])
+        self.assertEqual((len(self.cache), self.cache.size), (1, 2))
+        self.assertEqual({key: self.cache.stats()[key] for key in ("hits", "misses", "bytes")}, {"hits": 1, "misses": 2, "bytes": 2})
+
+    def test_tuples(self):
+        self.assertEqual(self.cache.get_or_render(1, "a", self.render(("ab", "cd"))), ("ab", "cd"))
+        self.assertEqual(self.cache.size, 4)
+
+    def test_lru_eviction(self):
+        """The least recently used fragments are dropped to stay under max_bytes"""
+        self.cache.get_or_render(1, "a", self.render("1234"))
+        self.cache.get_or_render(2, "a", self.render("1234"))
+        self.cache.get_or_render(1, "a", self.render("1234"))
+        self.cache.get_or_render(3, "a", self.render("1234"))
+        self.assertEqual(self.cache.size, 8)
+
+        self.cache.get_or_render(1, "a", self.render("1234"))
+        self.cache.get_or_render(2, "a", self.render("1234"))
+        self.assertEqual(len(self.renders), 4)
+        self.assertLessEqual(self.cache.size, 10)
+
+    def test_too_big(self):
+        self.cache.get_or_render(1, "a", self.render("12345678901"))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.size, 0)
+
+    def test_invalidate(self):
+        self.cache.get_or_render(1, "a", self.render("abc"))
+        self.cache.invalidate(1)
+        self.cache.get_or_render(1, "a", self.render("abc"))
+        self.assertEqual(len(self.renders), 2)
@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+from engine.leaderboard import Leaderboard
+
+# run these tests like:
+#
+#    python -m unittest testing/test_leaderboard.py
+
+class LeaderboardTestCase(TestCase):
+
+    def setUp(self):
+        self.leaderboard = Leaderboard(max_age=60)
+        self.leaderboard.load([
+            (1, "alice", 12000),
+            (2, "bob", 9000),
+            (3, "carol", 15000),
+            (4, "dave", 9000)
+        ])
+
+    def test_ranking(self):
+        """Users are ranked by net worth, ties by user id"""
+        self.assertEqual([u["username"] for u in self.leaderboard.top(4)], ["carol", "alice", "bob", "dave"])
+        self.assertEqual(self.leaderboard.rank(3), 1)
+        self.assertEqual(self.leaderboard.rank(4), 4)
+        self.assertIsNone(self.leaderboard.rank(99))
+        self.assertEqual(self.leaderboard.entry(1), {"rank": 2, "id": 1, "username": "alice", "net_worth": 12000})
+
+    def test_pages(self):
+        page = self.leaderboard.page(2, 3)
+        self.assertEqual(len(page), 1)
+        self.assertEqual(page[0]["rank"], 4)
+        self.assertEqual(self.leaderboard.page(3, 3), [])
+
+    def test_update(self):
+        """Updates move a user to their new position"""
+        self.leaderboard.update(4, "dave", 20000)
+        self.assertEqual(self.leaderboard.rank(4), 1)
+        self.assertEqual(self.leaderboard.rank(3), 2)
+
+        self.leaderboard.update(5, "erin", 100)
+        self.assertEqual(len(self.leaderboard), 5)
+        self.assertEqual(self.leaderboard.rank(5), 5)
+
+        self.leaderboard.remove(4)
+        self.assertEqual(self.leaderboard.rank(3), 1)
+        self.assertEqual(len(self.leaderboard), 4)
+
+    def test_update_before_load(self):
+        """Updates are ignored until the ranking is loaded"""
+        leaderboard = Leaderboard()
+        self.assertTrue(leaderboard.is_stale())
+        leaderboard.update(1, "alice", 10)
+        self.assertEqual(len(leaderboard), 0)
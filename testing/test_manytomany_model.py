@@ -2,7 +2,7 @@ import os
 from unittest import TestCase
 from sqlalchemy import exc
 from engine.engine import seed_stock_symbol_and_names, setup_app_config
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from models import db, User, Stock, Owned_Stock, Transaction
 
@@ -95,6 +95,29 @@ class TransactionModelTestCase(TestCase):
         self.assertEqual(self.s.id, user_transactions[0].Transaction.stock_id)
         self.assertEqual(self.s.name, user_transactions[0].name)
 
+    def test_get_user_transactions_page(self):
+        """
+            Tests the Transaction.get_user_transactions_page method, which should page
+            through the user's transactions newest first using the returned cursor.
+        """
+        now = datetime.now()
+        for i in range(5):
+            t = Transaction(stock_id=self.s.id, user_id=self.u.id, stock_symbol=self.s.stock_symbol, quantity=i,
+                            time=now + timedelta(minutes=i), stock_value_at_time=1.01, is_purchase=True)
+            db.session.add(t)
+        t = Transaction(stock_id=self.s.id, user_id=self.u.id, stock_symbol=self.s.stock_symbol, quantity=5,
+                        time=now + timedelta(minutes=4), stock_value_at_time=1.01, is_purchase=False)
+        db.session.add(t)
+        db.session.commit()
+
+        page, cursor = Transaction.get_user_transactions_page(self.u.id, limit=4)
+        self.assertEqual([t.quantity for t in page], [5, 4, 3, 2])
+        self.assertEqual(cursor, (page[-1].time, page[-1].id))
+
+        page, cursor = Transaction.get_user_transactions_page(self.u.id, cursor, limit=4)
+        self.assertEqual([t.quantity for t in page], [1, 0, 10])
+        self.assertIsNone(cursor)
+
 class OwnedStockModelTestCase(TestCase):
     
     def setUp(self):
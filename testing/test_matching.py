@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+from engine.matching import MatchingEngine, triggers_at_or_below
+from engine.alerts import AlertIndex, alert_thresholds
+
+# run these tests like:
+#
+#    python -m unittest testing/test_matching.py
+
+class MatchingEngineTestCase(TestCase):
+
+    def setUp(self):
+        self.engine = MatchingEngine(max_age=60)
+        self.engine.load([
+            (1, 10, True, "limit", 95),        #buy at or below 95
+            (2, 10, True, "limit", 90),
+            (3, 10, False, "stop", 80),        #sell at or below 80
+            (4, 10, False, "limit", 110),      #sell at or above 110
+            (5, 10, True, "stop", 120),        #buy at or above 120
+            (6, 20, True, "limit", 50)
+        ])
+
+    def test_directions(self):
+        self.assertTrue(triggers_at_or_below(True, "limit"))
+        self.assertTrue(triggers_at_or_below(False, "stop"))
+        self.assertFalse(triggers_at_or_below(False, "limit"))
+        self.assertFalse(triggers_at_or_below(True, "stop"))
+
+    def test_crossed(self):
+        """Only orders whose price was reached trigger, and each only once"""
+        self.assertEqual(self.engine.crossed(10, 100), [])
+        self.assertEqual(self.engine.crossed(10, 90), [1, 2])
+        self.assertEqual(self.engine.crossed(10, 90), [])
+        self.assertEqual(self.engine.crossed(10, 115), [4])
+        self.assertEqual(self.engine.crossed(10, 70), [3])
+        self.assertEqual(self.engine.crossed(10, 120), [5])
+        self.assertEqual(len(self.engine), 1)
+        self.assertEqual(self.engine.crossed(30, 1), [])
+
+    def test_add_and_remove(self):
+        """Removed orders never trigger, added ones do, and adding an order twice has no effect"""
+        self.engine.remove(1)
+        self.engine.add(7, 10, True, "limit", 99)
+        self.engine.add(7, 10, True, "limit", 99)
+        self.assertEqual(self.engine.crossed(10, 95), [7])
+
+    def test_not_loaded(self):
+        engine = MatchingEngine(max_age=60)
+        self.assertTrue(engine.is_stale())
+        engine.add(1, 10, True, "limit", 95)
+        self.assertEqual(engine.crossed(10, 1), [])
+
+class AlertIndexTestCase(TestCase):
+
+    def test_thresholds(self):
+        self.assertEqual(alert_thresholds("above", 120, 100), [(120, False)])
+        self.assertEqual(alert_thresholds("below", 80, 100), [(80, True)])
+        self.assertEqual(alert_thresholds("percent", 5, 100), [(105, False), (95, True)])
+
+    def test_percent_alerts(self):
+        """A percent move triggers on either side, once"""
+        index = AlertIndex(max_age=60)
+        index.load([(1, 10, "percent", 10, 100), (2, 10, "percent", 10, 100), (3, 10, "above", 105, 100)])
+
+        self.assertEqual(index.crossed(10, 95), [])
+        self.assertEqual(index.crossed(10, 111), [3, 1, 2])
+        self.assertEqual(index.crossed(10, 80), [])
+        self.assertEqual(len(index), 0)
+
+    def test_sync(self):
+        """Syncing adds the alerts the index does not have yet"""
+        index = AlertIndex(max_age=0, reload_age=60)
+        index.load([(1, 10, "above", 105, 100)])
+        self.assertEqual(index.crossed(10, 106), [1])
+
+        self.assertTrue(index.is_stale())
+        self.assertFalse(index.needs_reload())
+        index.sync([(2, 10, "below", 95, 100), (3, 20, "above", 5, 1)])
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.crossed(10, 90), [2])
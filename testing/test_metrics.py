@@ -0,0 +1,83 @@
+import os
+from unittest import TestCase
+
+from models import db, Stock
+from engine.metrics import Metrics, Histogram
+
+# run these tests like:
+#
+#    python -m unittest testing/test_metrics.py
+
+os.environ['DATABASE_URL'] = "postgresql:///stocks-app-test"
+
+from app import app
+
+db.create_all()
+
+class HistogramTestCase(TestCase):
+
+    def test_render(self):
+        h = Histogram("test_seconds", "Test.", (0.1, 1), ("route",))
+        h.observe(("/a",), 0.05)
+        h.observe(("/a",), 0.5)
+        h.observe(("/a",), 5)
+        h.observe(('/"b"',), 0.1)
+
+        lines = h.render()
+        self.assertIn('test_seconds_bucket{route="/a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{route="/a",le="1"} 2', lines)
+        self.assertIn('test_seconds_bucket{route="/a",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum{route="/a"} 5.55', lines)
+        self.assertIn('test_seconds_count{route="/a"} 3', lines)
+        self.assertIn('test_seconds_bucket{route="/\\"b\\"",le="0.1"} 1', lines)
+
+class MetricsTestCase(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        db.session.add_all([Stock(stock_symbol=f"TEST{i}", name=f"testStock{i}", share_price=i) for i in range(6)])
+        db.session.commit()
+        self.metrics = Metrics(sample_rate=1, n_plus_one_threshold=5)
+
+    def tearDown(self):
+        res = super().tearDown()
+        self.metrics.close()
+        db.session.rollback()
+        return res
+
+    def test_request_queries(self):
+        """Queries of a request are counted, and a query per item is flagged as N+1"""
+        with app.test_request_context("/stocks"):
+            self.metrics._start_request()
+            ids = [id for id, in db.session.query(Stock.id).all()]
+            for stock_id in ids:
+                db.session.query(Stock.share_price).filter(Stock.id == stock_id).scalar()
+            self.metrics.record_request(200)
+            self.metrics._teardown_request(None)
+
+        output = self.metrics.render()
+        self.assertIn('app_requests_total{route="/stocks",method="GET",status="200"} 1', output)
+        self.assertIn('app_request_queries_sum{route="/stocks"} 7', output)
+        self.assertIn('app_n_plus_one_total{route="/stocks"} 1', output)
+
+    def test_sampling(self):
+        """Requests that are not sampled are only counted"""
+        self.metrics.sample_rate = 0
+        with app.test_request_context("/"):
+            self.metrics._start_request()
+            db.session.query(Stock.id).all()
+            self.metrics.record_request(200)
+
+        output = self.metrics.render()
+        self.assertIn("app_requests_total", output)
+        self.assertNotIn("app_request_queries_count", output)
+
+    def test_metrics_endpoint(self):
+        with app.test_client() as c:
+            c.get("/api/stocks")
+            resp = c.get("/metrics")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        self.assertIn('app_requests_total{route="/api/stocks",method="GET",status="401"}', resp.get_data(as_text=True))
@@ -0,0 +1,166 @@
+import os
+import json
+import select
+from unittest import TestCase
+
+from models import db, User, Stock, Owned_Stock
+from engine.engine import setup_app_config
+from engine.notify import Broadcaster, broadcaster, notify_prices, PRICES_CHANNEL, CONFIG_CHANNEL, STOCKS_CHANNEL, NOTIFY_MAX_BYTES
+from engine.config import runtime_config
+from engine.symbols import listing_cache
+from testing.fake_quote_server import FakeQuoteFetcher
+
+# run these tests like:
+#
+#    python -m unittest testing/test_notify.py
+
+os.environ['DATABASE_URL'] = "postgresql:///stocks-app-test"
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+class RecordingSession():
+    """Records the notifications a session would send"""
+
+    def __init__(self):
+        self.notifications = []
+
+    def execute(self, statement, params):
+        self.notifications.append((params["channel"], params["payload"]))
+
+class BroadcasterTestCase(TestCase):
+
+    def test_fan_out(self):
+        """A price is serialized once and sent to every subscriber of the stock"""
+        b = Broadcaster()
+        s1 = b.subscribe(1, [10, 20])
+        s2 = b.subscribe(2, [10])
+
+        b.publish_prices([[10, 5.5], [30, 1]])
+        update1, = s1.get(0)
+        update2, = s2.get(0)
+        self.assertIs(update1, update2)
+        self.assertEqual(update1[3], b'event: price\ndata: {"id":10,"price":5.5}\n\n')
+
+        b.publish_portfolio(2)
+        self.assertEqual(s1.get(0), [])
+        self.assertEqual(s2.get(0), [("portfolio",)])
+
+        b.follow(s2, [30])
+        b.unsubscribe(s1)
+        b.publish_prices([[10, 6], [30, 2]])
+        self.assertEqual(s1.get(0), [])
+        self.assertEqual([update[1] for update in s2.get(0)], [30])
+        self.assertEqual(len(b), 1)
+
+    def test_notify_chunks(self):
+        """Long price lists are split into payloads Postgres accepts"""
+        session = RecordingSession()
+        prices = [(i, 123.456789) for i in range(2000)]
+        notify_prices(session, prices)
+
+        self.assertGreater(len(session.notifications), 1)
+        received = []
+        for channel, payload in session.notifications:
+            self.assertEqual(channel, PRICES_CHANNEL)
+            self.assertLessEqual(len(payload), NOTIFY_MAX_BYTES)
+            received.extend(tuple(price) for price in json.loads(payload))
+        self.assertEqual(received, prices)
+
+    def test_config_changed(self):
+        """A changed setting makes the process reload its settings"""
+        runtime_config.load([])
+        Broadcaster()._dispatch(CONFIG_CHANNEL, "GET_SMALL_UPDATES")
+        self.assertTrue(runtime_config.is_stale())
+
+    def test_stocks_changed(self):
+        """A changed stock listing drops the process' cached names and symbols"""
+        listing_cache.get("names", lambda: ["TEST"])
+        Broadcaster()._dispatch(STOCKS_CHANNEL, "")
+        self.assertEqual(listing_cache.get("names", lambda: ["NEW"]), ["NEW"])
+
+class StreamTestCase(TestCase):
+    """Updates committed to the database reach streams through LISTEN/NOTIFY"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        setup_app_config()
+
+        u = User.signup("testuser", "testuser")
+        s1 = Stock(stock_symbol="TEST1", name="testStock1", share_price=10)
+        s2 = Stock(stock_symbol="TEST2", name="testStock2", share_price=20)
+        db.session.add_all([s1, s2])
+        db.session.commit()
+        db.session.add(Owned_Stock(user_id=u.id, stock_id=s1.id, quantity=10, value_when_purchased=10))
+        db.session.commit()
+
+        self.uid = u.id
+        self.stock_ids = [s1.id, s2.id]
+        broadcaster.start(app.config['SQLALCHEMY_DATABASE_URI'])
+        self.assertTrue(broadcaster.listening.wait(5))
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def refresh(self, **prices):
+        Stock.update_many(Stock.query.filter(Stock.id.in_(self.stock_ids)).all(), fetcher=FakeQuoteFetcher(prices))
+
+    def read_event(self, chunks, name):
+        """The data of the next event called name in the stream"""
+        for chunk in chunks:
+            for event in chunk.decode().split("\n\n"):
+                if event.startswith(f"event: {name}\n"):
+                    return json.loads(event.split("data: ", 1)[1])
+
+    def test_stream(self):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid
+
+            resp = c.get("/api/stream")
+            self.assertEqual(resp.mimetype, "text/event-stream")
+            chunks = iter(resp.response)
+            self.assertEqual(self.read_event(chunks, "portfolio"), {"current_money": 10000, "total_asset_value": 100, "net_worth": 10100})
+
+            self.refresh(TEST1=12, TEST2=25)
+            self.assertEqual(self.read_event(chunks, "price"), {"id": self.stock_ids[0], "price": 12})
+
+            #a trade reloads the holdings, and the stream follows the newly held stock
+            User.query.get(self.uid).buy_stock(2, self.stock_ids[1])
+            self.assertEqual(self.read_event(chunks, "portfolio"), {"current_money": 9950, "total_asset_value": 170, "net_worth": 10120})
+
+            self.refresh(TEST1=12, TEST2=30)
+            self.assertEqual(self.read_event(chunks, "portfolio")["total_asset_value"], 180)
+            resp.close()
+
+        self.assertEqual(len(broadcaster), 0)
+
+    def test_stock_listing_announced(self):
+        """Renaming a stock tells other processes, once per transaction, and other changes do not"""
+        listener = db.engine.raw_connection()
+        listener.detach()       #closed rather than returned to the pool in autocommit
+        listener.connection.set_session(autocommit=True)
+        listener.cursor().execute(f"LISTEN {STOCKS_CHANNEL}")
+
+        def announcements():
+            select.select([listener.connection], [], [], 1)
+            listener.connection.poll()
+            channels = [n.channel for n in listener.connection.notifies]
+            listener.connection.notifies.clear()
+            return channels
+
+        try:
+            s1, s2 = Stock.query.filter(Stock.id.in_(self.stock_ids)).all()
+            s1.name, s2.name = "renamed1", "renamed2"
+            db.session.commit()
+            self.assertEqual(announcements(), [STOCKS_CHANNEL])
+
+            s1.share_price = 11
+            db.session.commit()
+            self.assertEqual(announcements(), [])
+        finally:
+            listener.close()
@@ -0,0 +1,53 @@
+import json
+from unittest import TestCase
+
+from engine.payload import clean_empty
+
+# run these tests like:
+#
+#    python -m unittest testing/test_payload.py
+
+class CleanEmptyTestCase(TestCase):
+
+    def test_removes_empty_entries(self):
+        """Falsy entries are removed at any depth, as are containers left empty"""
+        payload = {"a": {"b": {}, "c": None}, "d": [0, [], [{}], {"x": ""}, 1], "e": {"raw": 5, "fmt": "5", "longFmt": ""}, "f": False}
+        self.assertEqual(clean_empty(payload), {"d": [1], "e": {"raw": 5, "fmt": "5"}})
+        self.assertEqual(payload["a"], {"b": {}, "c": None})      #not modified
+        self.assertEqual(clean_empty([[[]], {"a": [0]}]), [])
+
+    def test_non_containers(self):
+        self.assertEqual(clean_empty(5), 5)
+        self.assertIsNone(clean_empty(None))
+
+    def test_in_place(self):
+        payload = {"a": [1, None, {"b": 0, "c": 2}], "d": {}}
+        inner = payload["a"]
+        cleaned = clean_empty(payload, in_place=True)
+        self.assertIs(cleaned, payload)
+        self.assertIs(cleaned["a"], inner)
+        self.assertEqual(payload, {"a": [1, {"c": 2}]})
+
+    def test_sample_payload(self):
+        """Keeps the order of entries, so the stored payload matches the previous implementation"""
+        with open('util/sample.json') as json_file:
+            sample = json.load(json_file)
+        cleaned = json.dumps(clean_empty(sample))
+        self.assertEqual(json.dumps(clean_empty(sample, in_place=True)), cleaned)
+        self.assertNotIn('""', cleaned)
+        self.assertNotIn("{}", cleaned)
+
+    def test_deep_nesting(self):
+        """Nesting far deeper than the recursion limit"""
+        payload = leaf = {}
+        for i in range(10000):
+            leaf["child"] = {"i": i, "empty": []}
+            leaf = leaf["child"]
+
+        cleaned = clean_empty(payload)
+        depth = 0
+        while "child" in cleaned:
+            self.assertNotIn("empty", cleaned["child"])
+            cleaned = cleaned["child"]
+            depth += 1
+        self.assertEqual(depth, 10000)
@@ -0,0 +1,99 @@
+import os
+from unittest import TestCase
+
+from models import db, User, Stock, Owned_Stock, Transaction, Pending_Order
+from engine.engine import setup_app_config
+from engine.matching import matching_engine
+from testing.fake_quote_server import FakeQuoteFetcher
+
+# run these tests like:
+#
+#    python -m unittest testing/test_pending_order_model.py
+
+os.environ['DATABASE_URL'] = "postgresql:///stocks-app-test"
+
+from app import app
+
+db.create_all()
+
+class PendingOrderModelTestCase(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        setup_app_config()
+        matching_engine.invalidate()
+
+        u = User.signup("testuser", "testuser")
+        s = Stock(stock_symbol="TEST", name="testStock", share_price=100)
+        db.session.add(s)
+        db.session.commit()
+
+        self.uid = u.id
+        self.sid = s.id
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def refresh(self, price):
+        Stock.update_many(Stock.query.filter_by(id=self.sid).all(), fetcher=FakeQuoteFetcher({"TEST": price}))
+
+    def test_limit_orders(self):
+        """A buy limit fills when the price falls to it, a sell limit when it rises to it"""
+        u = User.query.get(self.uid)
+        buy = Pending_Order.place(u, self.sid, True, "limit", 10, 90).id
+        sell = Pending_Order.place(u, self.sid, False, "limit", 4, 120).id
+
+        self.refresh(95)
+        self.assertEqual(Pending_Order.query.get(buy).status, "open")
+
+        self.refresh(89)
+        order = Pending_Order.query.get(buy)
+        self.assertEqual((order.status, order.fill_price, order.filled_quantity), ("filled", 89, 10))
+        self.assertEqual(Owned_Stock.query.filter_by(user_id=self.uid).one().quantity, 10)
+        self.assertEqual(User.query.get(self.uid).current_money, 10000 - 890)
+
+        self.refresh(125)
+        self.assertEqual(Pending_Order.query.get(sell).status, "filled")
+        self.assertEqual(Owned_Stock.query.filter_by(user_id=self.uid).one().quantity, 6)
+        self.assertEqual(Transaction.query.filter_by(user_id=self.uid).count(), 2)
+
+    def test_stop_orders(self):
+        """A sell stop fills when the price falls to it, orders that cannot trade are marked failed"""
+        u = User.query.get(self.uid)
+        u.buy_stock(5, self.sid)
+        stop = Pending_Order.place(u, self.sid, False, "stop", 5, 80).id
+        expensive = Pending_Order.place(u, self.sid, True, "stop", 1000, 110).id
+
+        self.refresh(79)
+        self.assertEqual(Pending_Order.query.get(stop).status, "filled")
+        self.assertEqual(Owned_Stock.query.filter_by(user_id=self.uid).count(), 0)
+
+        self.refresh(111)
+        self.assertEqual(Pending_Order.query.get(expensive).status, "failed")
+
+    def test_cancel(self):
+        u = User.query.get(self.uid)
+        order_id = Pending_Order.place(u, self.sid, True, "limit", 1, 90).id
+
+        self.assertIsNone(Pending_Order.cancel(self.uid + 1, order_id))
+        self.assertEqual(Pending_Order.cancel(self.uid, order_id).status, "cancelled")
+
+        self.refresh(50)
+        self.assertEqual(Pending_Order.query.get(order_id).status, "cancelled")
+        self.assertEqual(Transaction.query.filter_by(user_id=self.uid).count(), 0)
+
+    def test_other_process_orders(self):
+        """Orders placed elsewhere are picked up when the books are reloaded, and filled once"""
+        self.refresh(100)
+        db.session.add(Pending_Order(user_id=self.uid, stock_id=self.sid, is_purchase=True, order_type="limit",
+                                     quantity=1, price=90))
+        db.session.commit()
+        matching_engine.invalidate()
+
+        self.refresh(90)
+        matching_engine.invalidate()
+        self.refresh(90)
+        self.assertEqual(Transaction.query.filter_by(user_id=self.uid).count(), 1)
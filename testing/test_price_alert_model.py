@@ -0,0 +1,100 @@
+import os
+from unittest import TestCase
+
+from models import db, User, Stock, Price_Alert
+from engine.engine import setup_app_config
+from engine.alerts import alert_index
+from testing.fake_quote_server import FakeQuoteFetcher
+
+# run these tests like:
+#
+#    python -m unittest testing/test_price_alert_model.py
+
+os.environ['DATABASE_URL'] = "postgresql:///stocks-app-test"
+
+from app import app
+
+db.create_all()
+
+class PriceAlertModelTestCase(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        setup_app_config()
+        alert_index.invalidate()
+        Price_Alert.load_alert_index()
+
+        u = User.signup("testuser", "testuser")
+        s1 = Stock(stock_symbol="TEST1", name="testStock1", share_price=100)
+        s2 = Stock(stock_symbol="TEST2", name="testStock2", share_price=50)
+        db.session.add_all([s1, s2])
+        db.session.commit()
+
+        self.uid = u.id
+        self.stock_ids = [s1.id, s2.id]
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def refresh(self, **prices):
+        Stock.update_many(Stock.query.filter(Stock.id.in_(self.stock_ids)).all(), fetcher=FakeQuoteFetcher(prices))
+
+    def test_trigger_and_poll(self):
+        """Alerts trigger on the quote crossing them, and each is delivered by one poll"""
+        u = User.query.get(self.uid)
+        above = Price_Alert.create(u, self.stock_ids[0], "above", 110).id
+        below = Price_Alert.create(u, self.stock_ids[1], "below", 45).id
+        percent = Price_Alert.create(u, self.stock_ids[1], "percent", 20).id
+
+        self.refresh(TEST1=105, TEST2=46)
+        self.assertEqual(Price_Alert.poll(self.uid), [])
+
+        self.refresh(TEST1=112, TEST2=39)
+        alerts = Price_Alert.poll(self.uid)
+        self.assertEqual({alert["id"] for alert in alerts}, {above, below, percent})
+        self.assertEqual({alert["id"]: alert["triggered_price"] for alert in alerts}, {above: 112, below: 39, percent: 39})
+        self.assertEqual(Price_Alert.poll(self.uid), [])
+
+        #triggered alerts stay triggered
+        self.refresh(TEST1=120, TEST2=30)
+        self.assertEqual(Price_Alert.poll(self.uid), [])
+        self.assertTrue(all(alert.delivered for alert in Price_Alert.get_user_alerts(self.uid)))
+
+    def test_reload(self):
+        """Alerts set by other processes are picked up when the index is reloaded, in the background"""
+        db.session.add(Price_Alert(user_id=self.uid, stock_id=self.stock_ids[0], kind="below", threshold=90))
+        db.session.commit()
+        alert_index.invalidate()
+
+        #quotes are not matched, rather than waiting, while the index is being loaded
+        self.assertIsNone(Price_Alert.get_alert_index())
+        self.assertTrue(alert_index.wait(5))
+
+        self.refresh(TEST1=90, TEST2=50)
+        self.assertEqual(len(Price_Alert.poll(self.uid)), 1)
+
+    def test_reload_keeps_index_in_use(self):
+        """A periodic reload runs in the background, and the loaded index is used and synced meanwhile"""
+        u = User.query.get(self.uid)
+        Price_Alert.create(u, self.stock_ids[0], "above", 110)
+        alert_index.loaded_at -= alert_index.reload_age + 1
+        alert_index.synced_at -= alert_index.max_age + 1
+
+        self.assertIs(Price_Alert.get_alert_index(), alert_index)
+        self.assertTrue(alert_index.wait(5))
+        self.assertFalse(alert_index.needs_reload())
+        self.refresh(TEST1=115, TEST2=50)
+        self.assertEqual(len(Price_Alert.poll(self.uid)), 1)
+
+    def test_delete(self):
+        u = User.query.get(self.uid)
+        alert_id = Price_Alert.create(u, self.stock_ids[0], "above", 110).id
+
+        self.assertFalse(Price_Alert.delete(self.uid + 1, alert_id))
+        self.assertTrue(Price_Alert.delete(self.uid, alert_id))
+        self.refresh(TEST1=200, TEST2=50)
+        self.assertEqual(Price_Alert.poll(self.uid), [])
+        self.assertIsNone(Price_Alert.create(u, 999999, "above", 110))
@@ -0,0 +1,94 @@
+import os
+from unittest import TestCase
+from datetime import datetime, timedelta
+
+from models import db, Stock, Price_History, Price_Rollup
+from engine.engine import parse_history_params
+from engine.exceptions import InvalidFormInput
+from engine.quotes import QuoteFetcher
+from testing.fake_quote_server import FakeQuoteServer
+
+# run these tests like:
+#
+#    python -m unittest testing/test_price_history_model.py
+
+os.environ['DATABASE_URL'] = "postgresql:///stocks-app-test"
+
+from app import app
+
+db.create_all()
+
+class PriceHistoryModelTestCase(TestCase):
+    """Tests recording quotes in the price history and its rollups"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        s = Stock(stock_symbol="TEST1", name="testStock1", share_price=10)
+        db.session.add(s)
+        db.session.commit()
+        self.stock = s
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def record(self, time, price):
+        self.stock.last_updated = time
+        self.stock.share_price = price
+        Price_History.record([self.stock])
+        db.session.commit()
+
+    def test_rollups(self):
+        """Quotes are folded into open/high/low/close buckets, even when recorded out of order"""
+        day = datetime(2021, 3, 1, 10, 0)
+        self.record(day + timedelta(seconds=10), 10)
+        self.record(day + timedelta(seconds=50), 12)
+        self.record(day + timedelta(seconds=30), 8)
+        self.record(day + timedelta(seconds=5), 9)
+        self.record(day + timedelta(minutes=1), 11)
+        self.record(day + timedelta(minutes=1), 11)       #recorded twice
+
+        self.assertEqual(Price_History.query.count(), 5)
+
+        minutes = Price_Rollup.get_range(self.stock.id, "1m")
+        self.assertEqual(minutes, [
+            {"time": "2021-03-01T10:00:00", "open": 9, "high": 12, "low": 8, "close": 12},
+            {"time": "2021-03-01T10:01:00", "open": 11, "high": 11, "low": 11, "close": 11}
+        ])
+
+        hours = Price_Rollup.get_range(self.stock.id, "1h")
+        self.assertEqual(hours, [{"time": "2021-03-01T10:00:00", "open": 9, "high": 12, "low": 8, "close": 11}])
+
+        days = Price_Rollup.get_range(self.stock.id, "1d", start=day + timedelta(hours=5))
+        self.assertEqual(days[0]["time"], "2021-03-01T00:00:00")
+
+        self.assertEqual(Price_Rollup.get_range(self.stock.id, "1m", limit=1)[0]["time"], "2021-03-01T10:01:00")
+        self.assertEqual(Price_Rollup.get_range(self.stock.id, "1m", start=day + timedelta(days=1)), [])
+
+    def test_update_many_records_history(self):
+        with FakeQuoteServer({"TEST1": 10.5}) as server:
+            fetcher = QuoteFetcher(url=server.url, headers={}, max_workers=1)
+            Stock.update_many([self.stock], fetcher=fetcher)
+            fetcher.close()
+
+        history = Price_History.query.all()
+        self.assertEqual([(h.stock_id, h.price) for h in history], [(self.stock.id, 10.5)])
+        self.assertEqual(Price_Rollup.query.count(), 3)
+
+    def test_parse_history_params(self):
+        """The finest interval fitting the range is chosen"""
+        self.assertEqual(parse_history_params("1d")[1], "1m")
+        self.assertEqual(parse_history_params("1mo")[1], "1h")
+        self.assertEqual(parse_history_params("1y")[1], "1d")
+        self.assertEqual(parse_history_params("max"), (None, "1d"))
+        self.assertEqual(parse_history_params("1y", "1d")[1], "1d")
+
+        with self.assertRaises(InvalidFormInput):
+            parse_history_params("1y", "1m")
+        with self.assertRaises(InvalidFormInput):
+            parse_history_params("2w")
+        with self.assertRaises(InvalidFormInput):
+            parse_history_params("1d", "5m")
@@ -0,0 +1,73 @@
+import threading
+import time
+from unittest import TestCase
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from engine.quote_cache import QuoteCache
+
+# run these tests like:
+#
+#    python -m unittest testing/test_quote_cache.py
+
+class SlowFetcher():
+    """Fake quote backend that counts calls and takes a while to answer"""
+
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.calls = 0
+
+    def fetch(self, symbol):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {"symbol": symbol}
+
+class QuoteCacheTestCase(TestCase):
+
+    def make_stock(self, age=None, share_price=10):
+        last_updated = datetime.now() - age if age is not None else None
+        return SimpleNamespace(stock_symbol="TEST", share_price=share_price, last_updated=last_updated)
+
+    def test_fresh_stock_is_a_hit(self):
+        """A stock updated within the ttl does not reach the fetcher"""
+        fetcher = SlowFetcher(0)
+        cache = QuoteCache(fetcher, ttl=60)
+
+        self.assertTrue(cache.refresh(self.make_stock(timedelta(seconds=5)), lambda json_dict: True))
+        self.assertEqual(fetcher.calls, 0)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_stale_stock_is_a_miss(self):
+        """Stale stocks, and stocks that never had a price, are fetched"""
+        fetcher = SlowFetcher(0)
+        cache = QuoteCache(fetcher, ttl=60)
+        applied = []
+
+        cache.refresh(self.make_stock(timedelta(minutes=5)), applied.append)
+        cache.refresh(self.make_stock(timedelta(seconds=5), share_price=None), applied.append)
+
+        self.assertEqual(fetcher.calls, 2)
+        self.assertEqual(applied, [{"symbol": "TEST"}, {"symbol": "TEST"}])
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_concurrent_requests_are_coalesced(self):
+        """Concurrent refreshes of one symbol share a single upstream fetch and its result"""
+        fetcher = SlowFetcher(0.2)
+        cache = QuoteCache(fetcher, ttl=60)
+        results = []
+
+        def refresh():
+            results.append(cache.refresh(self.make_stock(), lambda json_dict: json_dict is not None))
+
+        threads = [threading.Thread(target=refresh) for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        stats = cache.stats()
+        self.assertEqual(fetcher.calls, 1)
+        self.assertEqual(results, [True] * 5)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["coalesced"], 4)
+        self.assertEqual(stats["in_flight"], 0)
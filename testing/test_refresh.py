@@ -0,0 +1,95 @@
+import os
+from unittest import TestCase
+from datetime import datetime, timedelta
+
+from models import db, User, Stock, Owned_Stock, App_Config
+from engine.engine import setup_app_config
+from engine.quotes import QuoteFetcher
+from engine.refresh import PriceRefresher
+from testing.fake_quote_server import FakeQuoteServer
+
+# run these tests like:
+#
+#    python -m unittest testing/test_refresh.py
+
+os.environ['DATABASE_URL'] = "postgresql:///stocks-app-test"
+
+from app import app
+
+db.create_all()
+
+class QuoteFetcherTestCase(TestCase):
+    """Tests the pooled quote fetcher against the fake quote server"""
+
+    def test_fetch_many(self):
+        with FakeQuoteServer({"TEST1": 10.5, "TEST2": 20.25}) as server:
+            fetcher = QuoteFetcher(url=server.url, headers={}, max_workers=2)
+            quotes = fetcher.fetch_many(["TEST1", "TEST2", "NOPE", "TEST1"])
+            fetcher.close()
+
+        self.assertEqual(len(quotes), 3)
+        self.assertEqual(quotes["TEST1"]['price']['regularMarketPrice']['raw'], 10.5)
+        self.assertEqual(quotes["TEST2"]['price']['regularMarketPrice']['raw'], 20.25)
+        self.assertIsNone(quotes["NOPE"])
+        self.assertEqual(server.requests, 3)
+
+class PriceRefresherTestCase(TestCase):
+    """Tests the background price refresh worker"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        setup_app_config()
+
+        u = User.signup("testuser", "testuser")
+        old = datetime.now() - timedelta(days=1)
+        s1 = Stock(stock_symbol="TEST1", name="testStock1", share_price=10, last_updated=old)
+        s2 = Stock(stock_symbol="TEST2", name="testStock2", share_price=20, last_updated=old - timedelta(days=1))
+        s3 = Stock(stock_symbol="TEST3", name="testStock3", share_price=30, last_updated=old)
+        db.session.add_all([s1, s2, s3])
+        db.session.commit()
+
+        o = Owned_Stock(user_id=u.id, stock_id=s3.id, quantity=10, value_when_purchased=30)
+        db.session.add(o)
+        db.session.commit()
+
+        self.stock_ids = [s1.id, s2.id, s3.id]
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_refresh_once_held_first(self):
+        """Held stocks are always refreshed, then the stalest of the rest up to batch_size"""
+        with FakeQuoteServer({"TEST1": 11, "TEST2": 22, "TEST3": 33}) as server:
+            fetcher = QuoteFetcher(url=server.url, headers={})
+            refresher = PriceRefresher(fetcher, batch_size=1, force=True)
+            refreshed = refresher.refresh_once()
+            fetcher.close()
+
+        self.assertEqual([s.stock_symbol for s in refreshed], ["TEST3", "TEST2"])
+
+        s1, s2, s3 = [Stock.query.get(stock_id) for stock_id in self.stock_ids]
+        self.assertEqual(s1.share_price, 10)
+        self.assertEqual(s2.share_price, 22)
+        self.assertEqual(s3.share_price, 33)
+        self.assertEqual(s3.data['symbol'], "TEST3")
+
+    def test_refresh_follows_toggle(self):
+        """Without force, the worker only refreshes when GET_LARGE_UPDATES is on"""
+        refresher = PriceRefresher()
+        self.assertFalse(refresher.is_enabled())
+        self.assertTrue(PriceRefresher(force=True).is_enabled())
+
+        #a change made in this process is read at once, without waiting for CONFIG_MAX_AGE
+        self.assertTrue(App_Config.toggle_large_updates())
+        self.assertTrue(refresher.is_enabled())
+        App_Config.set_toggle("GET_LARGE_UPDATES", False)
+        self.assertFalse(refresher.is_enabled())
+
+        #setting up the config again resets the toggles without adding rows
+        App_Config.set_toggle("GET_LARGE_UPDATES", True)
+        setup_app_config()
+        self.assertEqual(App_Config.query.filter_by(name="GET_LARGE_UPDATES").count(), 1)
+        self.assertFalse(refresher.is_enabled())
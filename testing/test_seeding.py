@@ -0,0 +1,98 @@
+import io
+import os
+from unittest import TestCase
+
+from models import db, User, Stock, Owned_Stock, Transaction
+from engine import seeding
+
+# run these tests like:
+#
+#    python -m unittest testing/test_seeding.py
+
+os.environ['DATABASE_URL'] = "postgresql:///stocks-app-test"
+
+from app import app
+
+db.create_all()
+
+STOCKS = b"AAA,Alpha Inc,Industrials\nBBB,Beta Corp,Health Care\n"
+
+class SeedingTestCase(TestCase):
+    """Tests the COPY based bulk loading of engine/seeding.py"""
+
+    def setUp(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        db.session.remove()
+        return res
+
+    def load(self, load, data, **kwargs):
+        count = load(io.BytesIO(data), **kwargs)
+        db.session.commit()
+        return count
+
+    def test_stocks(self):
+        """Stocks are upserted by symbol, loading a file again changes nothing"""
+        self.assertEqual(self.load(seeding.load_stocks, STOCKS), 2)
+        self.assertEqual(self.load(seeding.load_stocks, STOCKS), 0)
+        self.assertEqual(self.load(seeding.load_stocks, b"symbol,name,sector\nAAA,Alpha Inc,Energy\n", header=True), 1)
+
+        stock = Stock.query.filter_by(stock_symbol="AAA").one()
+        self.assertEqual((stock.name, stock.sector, stock.data), ("Alpha Inc", "Energy", {}))
+        self.assertEqual(Stock.query.count(), 2)
+
+    def test_users(self):
+        self.assertEqual(self.load(seeding.load_users, b"alice,secret,\nbob,secret,500\n"), 2)
+        self.assertEqual(self.load(seeding.load_users, b"alice,secret,\nbob,secret,500\n"), 0)
+
+        alice = User.authenticate("alice", "secret")
+        self.assertTrue(alice)
+        self.assertEqual(alice.current_money, 10000)
+        self.assertEqual(User.query.filter_by(username="bob").one().current_money, 500)
+
+    def test_holdings_and_transactions(self):
+        self.load(seeding.load_stocks, STOCKS)
+        self.load(seeding.load_users, b"alice,secret\n")
+
+        holdings = b"alice,AAA,10,5\nalice,BBB,3,2\nnobody,AAA,1,1\n"
+        self.assertEqual(self.load(seeding.load_holdings, holdings), 2)
+        self.assertEqual(self.load(seeding.load_holdings, holdings), 0)
+        self.assertEqual(self.load(seeding.load_holdings, b"alice,AAA,4,5\n"), 1)
+        self.assertEqual(sorted(o.quantity for o in Owned_Stock.query), [3, 4])
+
+        transactions = b"alice,AAA,2020-01-02 10:00:00,10,5,true\nalice,BBB,2020-01-03 10:00:00,3,2,false\n"
+        self.assertEqual(self.load(seeding.load_transactions, transactions), 2)
+        self.assertEqual(self.load(seeding.load_transactions, transactions), 0)
+        self.assertEqual(Transaction.query.filter_by(is_purchase=True).one().stock_symbol, "AAA")
+
+    def test_synthetic(self):
+        """Generated transactions belong to existing users and stocks, the same seed gives the same ones"""
+        self.load(seeding.load_stocks, STOCKS)
+        self.assertEqual(seeding.generate_users(3, "secret"), 3)
+        db.session.commit()
+
+        self.assertEqual(seeding.generate_transactions(200, seed=1), 200)
+        db.session.commit()
+        first = [(t.user_id, t.stock_id, t.quantity) for t in Transaction.query.order_by(Transaction.id)]
+
+        Transaction.query.delete()
+        rebuild_min_rows = seeding.REBUILD_MIN_ROWS
+        seeding.REBUILD_MIN_ROWS = 1        #takes the path of large loads, which rebuilds indexes and foreign keys
+        try:
+            self.assertEqual(seeding.generate_transactions(200, seed=1), 200)
+            db.session.commit()
+        finally:
+            seeding.REBUILD_MIN_ROWS = rebuild_min_rows
+
+        self.assertEqual([(t.user_id, t.stock_id, t.quantity) for t in Transaction.query.order_by(Transaction.id)], first)
+        self.assertEqual(len({user_id for user_id, stock_id, quantity in first}), 3)
+        indexes = db.session.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'transactions'").fetchall()
+        self.assertIn(("ix_transactions_user_time_id",), indexes)
+        foreign_keys = db.session.execute(
+            "SELECT count(*) FROM pg_constraint WHERE conrelid = 'transactions'::regclass AND contype = 'f'").scalar()
+        self.assertEqual(foreign_keys, 2)
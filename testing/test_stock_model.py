@@ -70,3 +70,19 @@ class StockModelTestCase(TestCase):
         
 
 
+
+    def test_stock_data_fields(self):
+        """Stock.data is only loaded when used, and get_data_fields extracts parts of it in the database"""
+        self.stock.data = {"price": {"regularMarketPrice": {"raw": 10.5}}, "summaryDetail": {"open": 10}, "earnings": [1, 2]}
+        db.session.commit()
+        db.session.expunge_all()
+
+        s = Stock.query.get(1)
+        self.assertNotIn("data", s.__dict__)
+        self.assertEqual(s.data["earnings"], [1, 2])
+
+        self.assertEqual(Stock.get_data_fields(1, ["price", "summaryDetail"]),
+                         {"price": {"regularMarketPrice": {"raw": 10.5}}, "summaryDetail": {"open": 10}})
+        self.assertEqual(Stock.get_data_fields(1, ["price.regularMarketPrice.raw", "summaryProfile"]),
+                         {"price": {"regularMarketPrice": {"raw": 10.5}}})
+        self.assertIsNone(Stock.get_data_fields(999999, ["price"]))
@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+from engine.symbols import SymbolSearchIndex, ListingCache
+
+# run these tests like:
+#
+#    python -m unittest testing/test_symbol_search.py
+
+class SymbolSearchIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.index = SymbolSearchIndex([
+            (1, "AAPL", "Apple Inc."),
+            (2, "A", "Agilent Technologies Inc."),
+            (3, "AMZN", "Amazon.com Inc."),
+            (4, "GOOGL", "Alphabet Inc. Class A"),
+            (5, "GOOG", "Alphabet Inc. Class C"),
+            (6, "PNW", "Pinnacle West Capital Corp."),
+            (7, "APA", "Apache Corporation")
+        ])
+
+    def symbols(self, q, limit=10):
+        return [m.symbol for m in self.index.search(q, limit)]
+
+    def test_symbol_ranking(self):
+        """Exact symbols come first, then symbol prefixes, then names"""
+        self.assertEqual(self.symbols("a", 3), ["A", "APA", "AAPL"])
+        self.assertEqual(self.symbols("goog"), ["GOOG", "GOOGL"])
+        self.assertEqual(self.symbols("AAPL")[0], "AAPL")
+
+    def test_name_prefix(self):
+        self.assertEqual(self.symbols("apple"), ["AAPL"])
+        self.assertEqual(self.symbols("alphabet class c")[0], "GOOG")
+        self.assertEqual(self.symbols("west cap"), ["PNW"])
+        #names starting with the query rank above names with a later word matching it
+        self.assertEqual(self.symbols("ap")[:2], ["APA", "AAPL"])
+
+    def test_fuzzy(self):
+        """Misspelled names are found by shared trigrams"""
+        self.assertEqual(self.symbols("pinacle")[0], "PNW")
+        self.assertEqual(self.symbols("amazom")[0], "AMZN")
+
+    def test_resolve(self):
+        self.assertEqual(self.index.resolve("Apple Inc. (AAPL)").id, 1)
+        self.assertEqual(self.index.resolve("apache").id, 7)
+        self.assertIsNone(self.index.resolve("zzzz"))
+        self.assertEqual(self.index.search("  "), [])
+
+    def test_many_words_large_universe(self):
+        """Several words are matched in ranking order across the chunks their lists are intersected in"""
+        rows = [(i, f"S{i}", f"{'Gold' if i % 3 else 'Water'} {'Mining' if i % 5 else 'Energy'} {'x' * (i // 10)}")
+                for i in range(1, 2001)]
+        index = SymbolSearchIndex(rows)
+        expected = [row[1] for row in rows if row[2].startswith("Water Energy")][:SymbolSearchIndex.MAX_CANDIDATES]
+        self.assertEqual([m.symbol for m in index.search("water ener", 100)], expected)
+
+class ListingCacheTestCase(TestCase):
+
+    def test_invalidate_and_max_age(self):
+        cache = ListingCache(max_age=60)
+        self.assertEqual(cache.get("names", lambda: ["A"]), ["A"])
+        self.assertEqual(cache.get("names", lambda: ["B"]), ["A"])
+
+        cache.invalidate()
+        self.assertEqual(cache.get("names", lambda: ["B"]), ["B"])
+
+        #values older than max_age are rebuilt, in case an invalidation was missed
+        cache.max_age = 0
+        self.assertEqual(cache.get("names", lambda: ["C"]), ["C"])
@@ -0,0 +1,98 @@
+import os
+import threading
+from unittest import TestCase
+
+from models import db, User, Stock, Owned_Stock, Transaction
+from engine.engine import setup_app_config
+
+# run these tests like:
+#
+#    python -m unittest testing/test_trade_concurrency.py
+
+os.environ['DATABASE_URL'] = "postgresql:///stocks-app-test"
+
+from app import app
+
+db.create_all()
+
+setup_app_config()
+
+THREADS = 8
+TRADES_PER_THREAD = 15
+
+class TradeConcurrencyTestCase(TestCase):
+    """Concurrent trades by one user, each thread with its own session and connection"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        u = User.signup("testing", "password")
+        s = Stock(stock_symbol="TEST", name="TEST", share_price=10)
+        db.session.add(s)
+        db.session.commit()
+
+        u.current_money = 1000
+        db.session.commit()
+
+        self.uid = u.id
+        self.sid = s.id
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def run_threads(self, trade):
+        """Runs trade(user, i) TRADES_PER_THREAD times in each of THREADS threads. Returns the results."""
+        results = []
+        errors = []
+        start = threading.Barrier(THREADS)
+
+        def worker():
+            with app.app_context():
+                try:
+                    start.wait()
+                    for i in range(TRADES_PER_THREAD):
+                        user = User.query.get(self.uid)
+                        results.append(trade(user, i))
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    db.session.remove()
+
+        threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        db.session.expire_all()
+        return results
+
+    def test_concurrent_buys(self):
+        """Buys past the user's money are refused, none are lost or overspent"""
+        results = self.run_threads(lambda user, i: user.buy_stock(2, self.sid))
+
+        #1000 buys 50 of the 120 attempted buys of 2 shares at 10
+        self.assertEqual(results.count(True), 50)
+        u = User.query.get(self.uid)
+        self.assertEqual(u.current_money, 0)
+        self.assertEqual(Owned_Stock.query.filter_by(user_id=self.uid).one().quantity, 100)
+        self.assertEqual(Transaction.query.filter_by(user_id=self.uid).count(), 50)
+        self.assertEqual(u.total_asset_value, 1000)
+
+    def test_concurrent_buys_and_sells(self):
+        """Interleaved buys and sells of one position add up"""
+        User.query.get(self.uid).buy_stock(50, self.sid)
+
+        results = self.run_threads(lambda user, i: user.buy_stock(1, self.sid) if i % 2 else user.sell_stock(1, self.sid))
+        self.assertTrue(all(results))
+
+        sells = THREADS * ((TRADES_PER_THREAD + 1) // 2)
+        buys = THREADS * TRADES_PER_THREAD - sells
+        u = User.query.get(self.uid)
+        self.assertEqual(Owned_Stock.query.filter_by(user_id=self.uid).one().quantity, 50 + buys - sells)
+        self.assertEqual(u.current_money, 500 - 10 * (buys - sells))
+        self.assertEqual(Transaction.query.filter_by(user_id=self.uid).count(), 1 + THREADS * TRADES_PER_THREAD)
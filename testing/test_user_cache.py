@@ -0,0 +1,68 @@
+import time
+from unittest import TestCase
+
+from engine.user_cache import UserCache, UserSnapshot
+
+# run these tests like:
+#
+#    python -m unittest testing/test_user_cache.py
+
+def snapshot(user_id, money=100):
+    return UserSnapshot(user_id, f"user{user_id}", None, money, 0)
+
+class UserCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = UserCache(max_size=2, max_age=60)
+        self.loads = []
+
+    def loader(self, user_id, money=100):
+        def load():
+            self.loads.append(user_id)
+            return snapshot(user_id, money)
+        return load
+
+    def test_hit(self):
+        self.assertEqual(self.cache.get(1, self.loader(1)), snapshot(1))
+        self.assertEqual(self.cache.get(1, self.loader(1)), snapshot(1))
+        self.assertEqual(self.loads, [1])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_missing_user(self):
+        """Users that do not exist are not cached"""
+        self.assertIsNone(self.cache.get(1, lambda: None))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        """The least recently used user is dropped past max_size"""
+        self.cache.get(1, self.loader(1))
+        self.cache.get(2, self.loader(2))
+        self.cache.get(1, self.loader(1))
+        self.cache.get(3, self.loader(3))
+        self.assertEqual(len(self.cache), 2)
+
+        self.cache.get(1, self.loader(1))
+        self.cache.get(2, self.loader(2))
+        self.assertEqual(self.loads, [1, 2, 3, 2])
+
+    def test_invalidate(self):
+        self.cache.get(1, self.loader(1))
+        self.cache.invalidate(1)
+        self.assertEqual(self.cache.get(1, self.loader(1, money=50)).current_money, 50)
+        self.assertEqual(self.loads, [1, 1])
+
+    def test_max_age(self):
+        cache = UserCache(max_size=2, max_age=0.01)
+        cache.get(1, self.loader(1))
+        time.sleep(0.02)
+        cache.get(1, self.loader(1))
+        self.assertEqual(self.loads, [1, 1])
+
+    def test_invalidated_while_loading(self):
+        """A snapshot read before a concurrent change is returned but not cached"""
+        def load():
+            self.cache.invalidate(1)        #the change commits while the old row is being read
+            return snapshot(1)
+
+        self.assertEqual(self.cache.get(1, load), snapshot(1))
+        self.assertEqual(len(self.cache), 0)
@@ -5,6 +5,8 @@ from datetime import datetime
 
 from models import db, User, Stock, Owned_Stock, Transaction, App_Config
 from engine.engine import setup_app_config
+from engine.leaderboard import leaderboard
+from engine.constants import ASSET_RECONCILE_INTERVAL
 
 
 # from '../models' import db, User, Stock, Owned_Stock, Transaction
@@ -51,6 +53,7 @@ class UserModelTestCase(TestCase):
         """Revert db (called after each test)"""
         res = super().tearDown()
         db.session.rollback()
+        db.session.remove()     #the next setUp recreates the tables, objects of this test must not linger in the session
       
         return res
 
@@ -133,4 +136,94 @@ class UserModelTestCase(TestCase):
         """Tests invalid password authentication"""
         self.assertFalse(User.authenticate(self.u.username, "badpassword"))
 
-        
+    def test_update_asset_value(self):
+        """update_asset_value sums quantity * share_price of every owned stock"""
+        s2 = Stock(stock_symbol="TEST2", name="TEST2", share_price=2.5)
+        self.s.share_price = 10
+        db.session.add_all([self.s, s2])
+        db.session.commit()
+
+        o1 = Owned_Stock(user_id=self.uid, stock_id=self.s.id, quantity=3, value_when_purchased=10)
+        o2 = Owned_Stock(user_id=self.uid, stock_id=s2.id, quantity=4, value_when_purchased=2.5)
+        db.session.add_all([o1, o2])
+        db.session.commit()
+
+        self.u.update_asset_value()
+        self.assertEqual(User.query.get(self.uid).total_asset_value, 40)
+
+        Owned_Stock.query.delete()
+        db.session.commit()
+        self.u.update_asset_value()
+        self.assertEqual(User.query.get(self.uid).total_asset_value, 0)
+
+    def test_buy_sell_adjust_asset_value(self):
+        """Trades adjust total_asset_value by the traded position, and reconcile periodically"""
+        self.s.share_price = 10
+        db.session.add(self.s)
+        self.u.update_asset_value()
+
+        self.assertTrue(self.u.buy_stock(5, self.s.id))
+        self.assertEqual(User.query.get(self.uid).total_asset_value, 50)
+        self.assertEqual(User.query.get(self.uid).current_money, 9950)
+
+        #price moves, the next trade is incremental so the held position is not revalued
+        self.s.share_price = 20
+        db.session.add(self.s)
+        db.session.commit()
+        self.assertTrue(self.u.sell_stock(2, self.s.id))
+        self.assertEqual(User.query.get(self.uid).total_asset_value, 10)
+
+        #a full valuation corrects the drift
+        self.u.update_asset_value()
+        self.assertEqual(User.query.get(self.uid).total_asset_value, 60)
+
+        #the adjustments are counted in the row, so trades made by other processes count too
+        self.assertEqual(User.query.get(self.uid).asset_adjustments, 0)
+        self.assertTrue(self.u.buy_stock(1, self.s.id))
+        self.assertEqual(User.query.get(self.uid).asset_adjustments, 1)
+        self.s.share_price = 30
+        db.session.add(self.s)
+        User.query.filter(User.id == self.uid).update({User.asset_adjustments: ASSET_RECONCILE_INTERVAL - 1})
+        db.session.commit()
+        self.assertTrue(self.u.buy_stock(1, self.s.id))
+        self.assertEqual(User.query.get(self.uid).total_asset_value, 150)
+        self.assertEqual(User.query.get(self.uid).asset_adjustments, 0)
+
+        #a user without a stored value is adjusted from 0
+        User.query.filter(User.id == self.uid).update({User.total_asset_value: None})
+        db.session.commit()
+        self.assertTrue(self.u.sell_stock(1, self.s.id))
+        self.assertEqual(User.query.get(self.uid).total_asset_value, -30)
+
+    def test_revalue_all(self):
+        """revalue_all recomputes every user's total_asset_value in one pass"""
+        u2 = User.signup("testing2", "password")
+        self.s.share_price = 10
+        db.session.add(self.s)
+        db.session.commit()
+
+        o1 = Owned_Stock(user_id=self.uid, stock_id=self.s.id, quantity=3, value_when_purchased=10)
+        o2 = Owned_Stock(user_id=u2.id, stock_id=self.s.id, quantity=7, value_when_purchased=10)
+        db.session.add_all([o1, o2])
+        db.session.commit()
+
+        self.assertEqual(User.revalue_all(), 2)
+        self.assertEqual(User.query.get(self.uid).total_asset_value, 30)
+        self.assertEqual(User.query.get(u2.id).total_asset_value, 70)
+
+        #unchanged values are not rewritten
+        self.assertEqual(User.revalue_all(), 0)
+
+        Owned_Stock.query.filter(Owned_Stock.user_id == u2.id).delete()
+        db.session.commit()
+        self.assertEqual(User.revalue_all(), 1)
+        self.assertEqual(User.query.get(u2.id).total_asset_value, 0)
+
+
+    def test_leaderboard_without_asset_value(self):
+        """Users without a total_asset_value are ranked by their money, as update_leaderboard does"""
+        User.query.filter(User.id == self.uid).update({User.total_asset_value: None})
+        db.session.commit()
+
+        leaderboard.invalidate()
+        self.assertEqual(User.get_leaderboard().entry(self.uid)["net_worth"], self.u.current_money)
@@ -4,13 +4,20 @@
 
 
 import os
+import json
+import gzip
 from unittest import TestCase
 from datetime import datetime
 from bs4 import BeautifulSoup
+from sqlalchemy import event
 
 from forms import StockTransactionForm
-from models import db, User, Stock, Owned_Stock, Transaction, App_Config
+from models import db, User, Stock, Owned_Stock, Transaction, App_Config, Price_History
 from engine.engine import *
+from engine.leaderboard import leaderboard
+from engine.user_cache import user_cache
+from engine.config import runtime_config
+from engine.fragments import fragment_cache
 
 os.environ['DATABASE_URL'] = "postgresql:///stocks-app-test"
 
@@ -28,6 +35,7 @@ def setup_test_app_config():
     b = App_Config(name="GET_SMALL_UPDATES", toggle=False) 
     db.session.add_all([a,b])
     db.session.commit()
+    runtime_config.invalidate()
 
 class TestUserViews(TestCase):
 
@@ -36,6 +44,9 @@ class TestUserViews(TestCase):
         db.create_all()
 
         setup_test_app_config()
+        leaderboard.invalidate()
+        user_cache.clear()
+        fragment_cache.clear()
         self.client = app.test_client()
 
         self.testuser = User.signup("testuser", "testuser")
@@ -77,6 +88,28 @@ class TestUserViews(TestCase):
             self.assertIn("testuser3", str(resp.data))
             self.assertIn("testuser4", str(resp.data))
 
+    def test_leaderboard_api(self):
+        self.u1.current_money = 50000
+        self.u2.current_money = 20000
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get("/api/leaderboard?per_page=2")
+            data = resp.get_json()
+
+            self.assertEqual(data["total"], 5)
+            self.assertEqual([u["username"] for u in data["users"]], ["testuser1", "testuser2"])
+            self.assertEqual(data["users"][0]["rank"], 1)
+            self.assertEqual(data["users"][0]["net_worth"], 50000)
+            self.assertEqual(data["me"]["username"], "testuser")
+            self.assertEqual(data["me"]["rank"], 5)      #ties are ranked by user id
+
+            resp = c.get("/api/leaderboard?page=3&per_page=2")
+            self.assertEqual(len(resp.get_json()["users"]), 1)
+
     def test_user_edit_view(self):
         with self.client as c:
             with c.session_transaction() as sess:
@@ -141,6 +174,52 @@ class TestUserViews(TestCase):
             t2s = transaction_list[0].find_all("td",text="TEST2")
             self.assertEqual(len(t2s), 1)
 
+    def test_user_transactions_api(self):
+        self.setup_transactions()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f"/api/users/{self.testuser_id}/transactions?limit=2")
+            data = resp.get_json()
+            self.assertEqual(len(data["transactions"]), 2)
+            self.assertEqual(data["transactions"][0]["stock_value_at_time"], 30)
+            self.assertIsNotNone(data["next_cursor"])
+
+            resp = c.get(f"/api/users/{self.testuser_id}/transactions", query_string={"limit": 2, "cursor": data["next_cursor"]})
+            data = resp.get_json()
+            self.assertEqual(len(data["transactions"]), 1)
+            self.assertEqual(data["transactions"][0]["stock_value_at_time"], 10)
+            self.assertIsNone(data["next_cursor"])
+
+            resp = c.get(f"/api/users/{self.u1_id}/transactions")
+            self.assertEqual(resp.status_code, 403)
+
+            resp = c.get(f"/api/users/{self.testuser_id}/transactions?cursor=bad")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_user_transactions_export(self):
+        self.setup_transactions()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f"/api/users/{self.testuser_id}/transactions/export")
+            lines = resp.get_data(as_text=True).splitlines()
+            self.assertEqual(resp.mimetype, "text/csv")
+            self.assertEqual(lines[0], "id,user_id,stock_id,stock_symbol,time,quantity,stock_value_at_time,is_purchase")
+            self.assertEqual(len(lines), 4)
+
+            resp = c.get(f"/api/users/{self.testuser_id}/transactions/export?format=ndjson")
+            records = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+            self.assertEqual([r["stock_symbol"] for r in records], ["TEST1", "TEST2", "TEST1"])
+            self.assertEqual([r["is_purchase"] for r in records], [True, True, False])
+
+            resp = c.get(f"/api/users/{self.testuser_id}/transactions/export?format=xml")
+            self.assertEqual(resp.status_code, 400)
+
 class TestStockViews(TestCase):
     #Currently Fails due to csrf_token field in jinja template. 
     def setUp(self):
@@ -149,6 +228,8 @@ class TestStockViews(TestCase):
 
         Stock.query.delete()
         setup_test_app_config()
+        user_cache.clear()
+        fragment_cache.clear()
 
         self.client = app.test_client()
 
@@ -195,3 +276,193 @@ class TestStockViews(TestCase):
 
             self.assrtIn("Transaction Successful!", str(resp.data))
             self.assrtIn("Current Amount Owned: 10", str(resp.data))
+
+    def test_stock_name_list(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get("/api/stocks")
+            self.assertEqual(resp.get_json(), {"stock_names": [["testStock1 (TEST1)", "testStock2 (TEST2)", "testStock3 (TEST3)"]]})
+            etag = resp.headers["ETag"]
+
+            #unchanged list is not sent again
+            resp = c.get("/api/stocks", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+
+            resp = c.get("/api/stocks", headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+            self.assertEqual(json.loads(gzip.decompress(resp.data))["stock_names"][0][0], "testStock1 (TEST1)")
+
+            #adding a stock invalidates the cached list
+            db.session.add(Stock(stock_symbol="TEST4", name="testStock4", share_price=40))
+            db.session.commit()
+            resp = c.get("/api/stocks", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("testStock4 (TEST4)", resp.get_json()["stock_names"][0])
+
+    def test_stock_json_fields(self):
+        s = Stock.query.filter_by(stock_symbol="TEST1").one()
+        s.data = {"price": {"raw": 10}, "summaryDetail": {"open": 9}, "insiderTransactions": ["..."]}
+        db.session.commit()
+        stock_id = s.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f"/api/stocks/{stock_id}")
+            self.assertIn("insiderTransactions", resp.get_json())
+
+            resp = c.get(f"/api/stocks/{stock_id}?fields=price,summaryDetail")
+            self.assertEqual(resp.get_json(), {"price": {"raw": 10}, "summaryDetail": {"open": 9}})
+
+            resp = c.get(f"/api/stocks/{stock_id}?fields=price;drop")
+            self.assertEqual(resp.status_code, 400)
+
+            resp = c.get("/api/stocks/999999?fields=price")
+            self.assertEqual(resp.status_code, 404)
+
+    def test_stock_history(self):
+        s = Stock.query.filter_by(stock_symbol="TEST1").one()
+        stock_id = s.id
+        s.last_updated = datetime.now()
+        Price_History.record([s])
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f"/api/stocks/{stock_id}/history?range=1d")
+            data = resp.get_json()
+            self.assertEqual(data["interval"], "1m")
+            self.assertEqual(len(data["points"]), 1)
+            self.assertEqual(data["points"][0]["close"], 10)
+
+            resp = c.get(f"/api/stocks/{stock_id}/history?range=1y&interval=1m")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_stock_search(self):
+        with self.client as c:
+            resp = c.get("/api/stocks/search?q=test")
+            self.assertEqual(resp.status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get("/api/stocks/search?q=TEST2")
+            results = resp.get_json()["results"]
+            self.assertEqual(results[0]["symbol"], "TEST2")
+            self.assertEqual(results[0]["label"], "testStock2 (TEST2)")
+
+            resp = c.get("/api/stocks/search?q=teststock&limit=2")
+            self.assertEqual(len(resp.get_json()["results"]), 2)
+
+            #the search page accepts a name as well as an autocomplete label
+            resp = c.post("/stocks", data={"search": "teststock3"})
+            self.assertEqual(resp.status_code, 302)
+            self.assertTrue(resp.location.endswith(f"/stocks/{Stock.query.filter_by(stock_symbol='TEST3').one().id}"))
+
+            #the index is rebuilt when a stock is added
+            db.session.add(Stock(stock_symbol="ZZZ", name="Zebra Holdings", share_price=40))
+            db.session.commit()
+            resp = c.get("/api/stocks/search?q=zebra")
+            self.assertEqual(resp.get_json()["results"][0]["symbol"], "ZZZ")
+
+
+    def test_batch_orders(self):
+        stock_ids = [s.id for s in Stock.query.order_by(Stock.id)]
+        user_id = User.query.filter_by(username="testuser").one().id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            orders = [{"stock_id": stock_id, "type": "buy", "amount": 10} for stock_id in stock_ids]
+            orders.append({"stock_id": stock_ids[0], "type": "sell", "amount": 4})
+
+            queries = []
+            count_query = lambda *args: queries.append(args[2])
+            event.listen(db.engine, "before_cursor_execute", count_query)
+            try:
+                resp = c.post("/api/orders/batch", json={"orders": orders})
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_query)
+
+            data = resp.get_json()
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(data["executed"])
+            self.assertEqual([r["status"] for r in data["results"]], ["filled"] * 4)
+            self.assertEqual(data["current_money"], 10000 - 600 + 40)
+            self.assertLessEqual(len(queries), 12)      #the same for any number of orders
+            self.assertEqual(Owned_Stock.query.filter_by(user_id=user_id, stock_id=stock_ids[0]).one().quantity, 6)
+            self.assertEqual(Transaction.query.filter_by(user_id=user_id).count(), 4)
+            #the user's cached snapshot, loaded for the request, is dropped by the trade
+            self.assertEqual(User.get_snapshot(user_id).current_money, 10000 - 600 + 40)
+
+            #all or nothing: the sell of more shares than owned rejects the buy before it
+            resp = c.post("/api/orders/batch", json={"orders": [
+                {"stock_id": stock_ids[1], "type": "buy", "amount": 1},
+                {"stock_id": stock_ids[2], "type": "sell", "amount": 11},
+                {"stock_id": stock_ids[2], "type": "buy", "amount": 1},
+            ]})
+            self.assertEqual(resp.status_code, 409)
+            results = resp.get_json()["results"]
+            self.assertEqual([r["status"] for r in results], ["rolled_back", "rejected", "skipped"])
+            self.assertNotIn("price", results[0])
+            self.assertEqual(Transaction.query.filter_by(user_id=user_id).count(), 4)
+            self.assertEqual(User.query.get(user_id).current_money, 10000 - 600 + 40)
+
+            resp = c.post("/api/orders/batch", json={"orders": [{"stock_id": stock_ids[0], "type": "buy", "amount": 0}]})
+            self.assertEqual(resp.status_code, 400)
+            resp = c.post("/api/orders/batch", data={"orders": "x"})
+            self.assertEqual(resp.status_code, 400)
+
+    def test_pending_orders(self):
+        stock_id = Stock.query.filter_by(stock_symbol="TEST1").one().id
+        user_id = User.query.filter_by(username="testuser").one().id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            order = {"stock_id": stock_id, "type": "buy", "order_type": "limit", "amount": 5, "price": 9.5}
+            resp = c.post("/api/orders", json=order)
+            self.assertEqual(resp.status_code, 201)
+            order_id = resp.get_json()["id"]
+
+            resp = c.get("/api/orders?status=open")
+            self.assertEqual([o["id"] for o in resp.get_json()["orders"]], [order_id])
+
+            resp = c.delete(f"/api/orders/{order_id}")
+            self.assertEqual(resp.get_json()["status"], "cancelled")
+            resp = c.delete("/api/orders/999999")
+            self.assertEqual(resp.status_code, 404)
+
+            resp = c.post("/api/orders", json=dict(order, order_type="market"))
+            self.assertEqual(resp.status_code, 400)
+            resp = c.post("/api/orders", json=dict(order, price=-1))
+            self.assertEqual(resp.status_code, 400)
+            resp = c.post("/api/orders", json=dict(order, stock_id=999999))
+            self.assertEqual(resp.status_code, 404)
+
+    def test_price_alerts(self):
+        stock_id = Stock.query.filter_by(stock_symbol="TEST1").one().id
+        user_id = User.query.filter_by(username="testuser").one().id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            resp = c.post("/api/alerts", json={"stock_id": stock_id, "kind": "above", "threshold": 12})
+            self.assertEqual(resp.status_code, 201)
+            alert_id = resp.get_json()["id"]
+            self.assertEqual([a["id"] for a in c.get("/api/alerts").get_json()["alerts"]], [alert_id])
+            self.assertEqual(c.get("/api/alerts/triggered").get_json(), {"alerts": []})
+
+            resp = c.post("/api/alerts", json={"stock_id": stock_id, "kind": "sideways", "threshold": 12})
+            self.assertEqual(resp.status_code, 400)
+
+            self.assertEqual(c.delete(f"/api/alerts/{alert_id}").status_code, 200)
+            self.assertEqual(c.delete(f"/api/alerts/{alert_id}").status_code, 404)
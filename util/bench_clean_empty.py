@@ -0,0 +1,81 @@
+"""
+    Compares engine.payload.clean_empty with the recursive version it replaced, on util/sample.json
+    and on synthetic deep and wide payloads.
+
+        python -m util.bench_clean_empty
+"""
+import argparse
+import json
+import timeit
+
+from engine.payload import clean_empty
+
+
+def recursive_clean_empty(d):
+    """The previous implementation, from engine/engine.py"""
+    if not isinstance(d, (dict, list)):
+        return d
+    if isinstance(d, list):
+        return [v for v in (recursive_clean_empty(v) for v in d) if v]
+    return {k: v for k, v in ((k, recursive_clean_empty(v)) for k, v in d.items()) if v}
+
+
+def wide_payload(n):
+    """A list of n quote-like records, about a third of their fields empty."""
+    return [
+        {"raw": i, "fmt": str(i), "longFmt": "", "empty": {}, "values": [i, 0, None, {"a": i % 3}]}
+        for i in range(n)
+    ]
+
+
+def deep_payload(depth):
+    """depth levels of dicts nested in lists, every level with a few empty entries."""
+    payload = {"leaf": 1}
+    for i in range(depth):
+        payload = {"level": i, "child": [payload, {}], "none": None}
+    return payload
+
+
+def best(run, args):
+    """Seconds per call of run, the fastest of args.repeat measurements."""
+    return min(timeit.repeat(run, number=args.number, repeat=args.repeat)) / args.number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20, help="runs per measurement")
+    parser.add_argument('--repeat', type=int, default=5, help="measurements, of which the fastest is shown")
+    args = parser.parse_args()
+
+    with open('util/sample.json') as json_file:
+        sample = json_file.read()
+
+    #makers of each payload, since cleaning in place needs a fresh copy per run
+    payloads = {
+        "sample.json": lambda: json.loads(sample),
+        "wide (20k records)": lambda: wide_payload(20000),
+        "deep (500 levels)": lambda: deep_payload(500),
+        "deep (5000 levels)": lambda: deep_payload(5000),
+    }
+
+    print(f"{'payload':<20}{'recursive':>16}{'iterative':>12}{'in place':>12}")
+    for name, make_payload in payloads.items():
+        payload = make_payload()
+        try:
+            recursive = f"{best(lambda: recursive_clean_empty(payload), args) * 1000:.2f}ms"
+        except RecursionError:
+            recursive = "RecursionError"
+
+        iterative = best(lambda: clean_empty(payload), args)
+
+        in_place = []
+        for _ in range(args.repeat):
+            copies = [make_payload() for _ in range(args.number)]
+            in_place.append(timeit.timeit(lambda: clean_empty(copies.pop(), in_place=True), number=args.number))
+        in_place = min(in_place) / args.number
+
+        print(f"{name:<20}{recursive:>16}{iterative * 1000:>10.2f}ms{in_place * 1000:>10.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
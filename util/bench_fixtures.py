@@ -0,0 +1,54 @@
+"""
+    Compares the stock page's sample data as it was loaded before, opening and parsing
+    util/sample.json on every request, with engine.fixtures.QuoteFixtures, which parses it once.
+    Also times rendering the fields stocks/details.html reads from it.
+
+        python -m util.bench_fixtures
+"""
+import argparse
+import json
+import timeit
+
+from engine.fixtures import QuoteFixtures
+from engine.constants import QUOTE_FIXTURE_PATH
+
+
+def load_per_request():
+    """The previous implementation, from show_stock in app.py"""
+    with open(QUOTE_FIXTURE_PATH) as json_file:
+        return json.load(json_file)
+
+
+def read_fields(data):
+    """The lookups the details page does on the payload."""
+    return (data['summaryProfile']['longBusinessSummary'], data['summaryProfile']['industry'],
+            data['summaryDetail']['fiftyDayAverage']['fmt'], data['financialData']['operatingCashflow']['fmt'],
+            data['financialData']['profitMargins']['fmt'])
+
+
+def best(run, args):
+    """Seconds per call of run, the fastest of args.repeat measurements."""
+    return min(timeit.repeat(run, number=args.number, repeat=args.repeat)) / args.number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=200, help="runs per measurement")
+    parser.add_argument('--repeat', type=int, default=5, help="measurements, of which the fastest is shown")
+    args = parser.parse_args()
+
+    fixtures = QuoteFixtures()
+    first = best(lambda: (fixtures.clear(), fixtures.get()), args)     #the one-time parse, for reference
+
+    per_request = best(lambda: read_fields(load_per_request()), args)
+    shared = best(lambda: read_fields(fixtures.get("AAPL")), args)
+
+    print(f"{'':<32}{'per request':>14}")
+    print(f"{'json.load per request':<32}{per_request * 1e6:>12.1f}us")
+    print(f"{'shared fixture':<32}{shared * 1e6:>12.1f}us")
+    print(f"{'one-time parse and freeze':<32}{first * 1e6:>12.1f}us")
+    print(f"\n{per_request / shared:.0f}x less time per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+    Times SymbolSearchIndex builds and queries over a synthetic universe of stocks.
+
+        python -m util.bench_symbol_search --stocks 50000
+"""
+import argparse
+import random
+import string
+import time
+
+from engine.symbols import SymbolSearchIndex
+
+WORDS = ["american", "global", "capital", "energy", "health", "systems", "technologies", "financial",
+         "pacific", "resources", "industries", "partners", "pharmaceuticals", "motors", "digital",
+         "holdings", "group", "bancorp", "realty", "networks", "semiconductor", "foods", "water", "gold"]
+SUFFIXES = ["Inc.", "Corp.", "Co.", "Ltd.", "Group", "Trust", "plc"]
+QUERIES = ["a", "ap", "glob", "capital ener", "c g", "tech", "zzzz", "pharmaceutcals", "digital net", "AB", "gold"]
+
+
+def synthetic_rows(n, seed=0):
+    """n (id, symbol, name) rows with unique symbols and made up names."""
+    rnd = random.Random(seed)
+    symbols = set()
+    rows = []
+    while len(rows) < n:
+        symbol = "".join(rnd.choices(string.ascii_uppercase, k=rnd.randint(1, 5)))
+        if symbol in symbols:
+            continue
+        symbols.add(symbol)
+        words = [rnd.choice(WORDS).capitalize() for _ in range(rnd.randint(1, 3))]
+        rows.append((len(rows) + 1, symbol, " ".join(words + [rnd.choice(SUFFIXES)])))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stocks', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=200, help="times each query is run")
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.stocks)
+
+    start = time.perf_counter()
+    index = SymbolSearchIndex(rows)
+    print(f"built index of {len(index)} stocks in {time.perf_counter() - start:.2f}s")
+
+    for q in QUERIES:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            matches = index.search(q)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print(f"{q!r:>18}: {elapsed * 1000:.3f}ms  {[m.symbol for m in matches[:5]]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+    Load test of the trading paths. Seeds users, stocks, holdings and transactions into a scratch
+    database, then drives the app with concurrent clients (Flask test clients, one thread and one
+    user each) against a local stand-in for the quote api, and reports latency percentiles and
+    requests/sec per route. Results are saved as JSON, and can be compared with an earlier run.
+
+        python -m util.loadtest --users 50 --clients 8 --duration 30 --output before.json
+        python -m util.loadtest --users 50 --clients 8 --duration 30 --output after.json --compare before.json
+
+    The database (--database-url) is dropped and recreated, so never point it at real data.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+DEFAULT_DATABASE_URL = "postgresql:///stocks-app-loadtest"
+ROUTES = ("GET /", "GET /stocks/<id>", "GET /api/stocks", "POST /user/portfolio")
+CSRF_INPUT = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def seed(args):
+    """Recreates the tables and bulk inserts the load test data. Returns the user and stock ids."""
+    from models import db, bcrypt, User, Stock, Owned_Stock, Transaction, App_Config
+    from engine.payload import clean_empty
+    from engine.symbols import listing_cache
+
+    db.drop_all()
+    db.create_all()
+
+    rnd = random.Random(args.seed)
+    now = datetime.now()
+    with open('util/sample.json') as json_file:
+        data = clean_empty(json.load(json_file))
+
+    db.session.add_all([App_Config(name="GET_LARGE_UPDATES", toggle=False), App_Config(name="GET_SMALL_UPDATES", toggle=True)])
+    db.session.bulk_insert_mappings(Stock, [
+        {"stock_symbol": f"L{i}", "name": f"Load Test Stock {i}", "share_price": round(rnd.uniform(5, 500), 2),
+         "last_updated": now, "data": data}
+        for i in range(args.stocks)
+    ])
+
+    password = bcrypt.generate_password_hash("loadtest").decode('UTF-8')      #hashed once, bcrypt is slow on purpose
+    db.session.bulk_insert_mappings(User, [
+        {"username": f"loadtest{i}", "password": password, "current_money": 1000000, "total_asset_value": 0}
+        for i in range(args.users)
+    ])
+    db.session.commit()
+
+    stocks = db.session.query(Stock.id, Stock.stock_symbol, Stock.share_price).all()
+    user_ids = [id for id, in db.session.query(User.id).order_by(User.id)]
+
+    holdings, transactions = [], []
+    for user_id in user_ids:
+        for stock_id, symbol, price in rnd.sample(stocks, min(args.holdings, len(stocks))):
+            holdings.append({"user_id": user_id, "stock_id": stock_id, "time": now, "quantity": 1000,
+                             "value_when_purchased": price})
+        for _ in range(args.transactions):
+            stock_id, symbol, price = rnd.choice(stocks)
+            transactions.append({"user_id": user_id, "stock_id": stock_id, "stock_symbol": symbol,
+                                 "time": now - timedelta(minutes=rnd.randint(0, 60 * 24 * 365)),
+                                 "quantity": rnd.randint(1, 20), "stock_value_at_time": price,
+                                 "is_purchase": rnd.random() < 0.6})
+    db.session.bulk_insert_mappings(Owned_Stock, holdings)
+    db.session.bulk_insert_mappings(Transaction, transactions)
+    db.session.commit()
+
+    User.revalue_all()
+    listing_cache.invalidate()
+
+    held = {}
+    for holding in holdings:
+        held.setdefault(holding["user_id"], []).append(holding["stock_id"])
+    return user_ids, [s.id for s in stocks], {symbol: price for _, symbol, price in stocks}, held
+
+
+class Client(threading.Thread):
+    """Logs in as one user and sends a random mix of requests until stop is set."""
+
+    def __init__(self, app, user_id, stock_ids, held_stock_ids, mix, stop, seed):
+        super().__init__(daemon=True)
+        self.client = app.test_client()
+        self.user_id = user_id
+        self.stock_ids = stock_ids
+        self.held_stock_ids = held_stock_ids
+        self.routes, self.weights = zip(*mix.items())
+        self.stop = stop
+        self.rnd = random.Random(seed)
+        self.latencies = {route: [] for route in ROUTES}
+        self.errors = {route: 0 for route in ROUTES}
+        self.recording = False
+        self.buy_next = True
+
+    def login(self):
+        from engine.constants import CURR_USER_KEY
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+        page = self.client.get("/user/portfolio").get_data(as_text=True)
+        match = CSRF_INPUT.search(page)
+        self.csrf_token = match.group(1) if match else None
+
+    def request(self, route):
+        if route == "GET /":
+            return self.client.get("/")
+        if route == "GET /stocks/<id>":
+            return self.client.get(f"/stocks/{self.rnd.choice(self.stock_ids)}")
+        if route == "GET /api/stocks":
+            return self.client.get("/api/stocks", headers={"Accept-Encoding": "gzip"})
+
+        #alternates buying and selling one share of a held stock, so holdings stay about the same.
+        #Users seeded without holdings (--holdings 0) trade any stock
+        data = {"stock_id": str(self.rnd.choice(self.held_stock_ids or self.stock_ids)), "amount": "1",
+                "transaction_type": "buy" if self.buy_next else "sell", "csrf_token": self.csrf_token}
+        self.buy_next = not self.buy_next
+        return self.client.post("/user/portfolio", data=data)
+
+    def run(self):
+        self.login()
+        while not self.stop.is_set():
+            route = self.rnd.choices(self.routes, self.weights)[0]
+            started = time.perf_counter()
+            try:
+                ok = self.request(route).status_code < 400
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+
+            if self.recording:
+                if ok:
+                    self.latencies[route].append(elapsed)
+                else:
+                    self.errors[route] += 1
+
+
+def summarize(clients, seconds):
+    """Per route and total request counts, requests/sec and latency percentiles in ms."""
+    results = {}
+    everything = []
+    for route in ROUTES:
+        latencies = sorted(latency for client in clients for latency in client.latencies[route])
+        errors = sum(client.errors[route] for client in clients)
+        everything.extend(latencies)
+        if latencies or errors:
+            results[route] = stats(latencies, errors, seconds)
+
+    results["total"] = stats(sorted(everything), sum(r["errors"] for r in results.values()), seconds)
+    return results
+
+
+def stats(latencies, errors, seconds):
+    ms = lambda seconds: round(seconds * 1000, 2) if seconds is not None else None
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / seconds, 1),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+    }
+
+
+def print_results(results):
+    print(f"{'route':<24}{'requests':>10}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, r in results.items():
+        print(f"{route:<24}{r['requests']:>10}{r['errors']:>8}{r['rps']:>9}{r['p50_ms']!s:>10}{r['p95_ms']!s:>10}{r['p99_ms']!s:>10}")
+
+
+def compare(results, baseline, max_regression=None):
+    """Prints the change of each route against a baseline run. Returns False if p95 regressed more than max_regression %."""
+    print(f"\ncompared with {baseline['meta'].get('commit') or 'baseline'}:")
+    print(f"{'route':<24}{'rps':>18}{'p50 ms':>20}{'p95 ms':>20}")
+    regressed = False
+
+    def change(old, new):
+        if not old or new is None:
+            return f"{new!s:>8} (   n/a)"
+        return f"{new!s:>8} ({(new - old) / old * 100:+5.0f}%)"
+
+    for route, r in results["routes"].items():
+        old = baseline["routes"].get(route)
+        if old is None:
+            continue
+        print(f"{route:<24}{change(old['rps'], r['rps']):>18}{change(old['p50_ms'], r['p50_ms']):>20}"
+              f"{change(old['p95_ms'], r['p95_ms']):>20}")
+        if max_regression is not None and old["p95_ms"] and r["p95_ms"] is not None \
+                and (r["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 > max_regression:
+            regressed = True
+    return not regressed
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(mix):
+    """"home=2,stock=1" style route weights, by the short names of ROUTES."""
+    names = dict(zip(("home", "stock", "stocks_api", "trade"), ROUTES))
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in names:
+            raise argparse.ArgumentTypeError(f"unknown route {name}, expected one of {', '.join(names)}")
+        weights[names[name]] = float(weight or 1)
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.environ.get('LOADTEST_DATABASE_URL', DEFAULT_DATABASE_URL))
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--stocks', type=int, default=200)
+    parser.add_argument('--holdings', type=int, default=10, help="stocks held per user")
+    parser.add_argument('--transactions', type=int, default=200, help="past transactions per user")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent clients, each logged in as its own user")
+    parser.add_argument('--duration', type=float, default=20, help="seconds measured")
+    parser.add_argument('--warmup', type=float, default=3, help="seconds run before measuring")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix("home=2,stock=2,stocks_api=1,trade=2"),
+                        help="route weights, of home, stock, stocks_api and trade")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="file to save the results to, as JSON")
+    parser.add_argument('--compare', help="results file of an earlier run to compare with")
+    parser.add_argument('--max-regression', type=float,
+                        help="exit with status 1 if any route's p95 is this many percent slower than in --compare")
+    args = parser.parse_args()
+
+    if args.clients > args.users:
+        parser.error("--clients cannot be more than --users, each client needs its own user")
+
+    os.environ['DATABASE_URL'] = args.database_url
+    from app import app
+    from engine.quotes import quote_fetcher
+    from testing.fake_quote_server import FakeQuoteServer
+
+    print(f"seeding {args.users} users, {args.stocks} stocks into {args.database_url}")
+    user_ids, stock_ids, prices, held = seed(args)
+
+    with FakeQuoteServer(prices) as server:
+        #quotes come from the stand-in, the fetcher makes a new session for it
+        quote_fetcher.close()
+        quote_fetcher.url = server.url
+        quote_fetcher.headers = {}
+
+        stop = threading.Event()
+        clients = [
+            Client(app, user_ids[i], stock_ids, held.get(user_ids[i], []), args.mix, stop, args.seed + i)
+            for i in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+
+        time.sleep(args.warmup)
+        for client in clients:
+            client.recording = True
+        started = time.perf_counter()
+        time.sleep(args.duration)
+        for client in clients:
+            client.recording = False
+        seconds = time.perf_counter() - started
+
+        stop.set()
+        for client in clients:
+            client.join()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "database_url")},
+            "quote_requests": server.requests,
+        },
+        "routes": summarize(clients, seconds),
+    }
+
+    print_results(results["routes"])
+    if args.output:
+        with open(args.output, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+        print(f"\nsaved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            if not compare(results, json.load(baseline_file), args.max_regression):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
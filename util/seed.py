@@ -1,58 +1,27 @@
-from models import User, Stock, connect_db, Transaction, Owned_Stock, db
-from app import app
-from datetime import datetime
+"""
+    Recreates the tables of the development database and seeds them with the S&P 500 stocks and
+    two test users (password 123456), one holding 10 shares of the first stock. For large or
+    synthetic data sets use the `flask seed` commands (engine/seeding.py) instead.
+
+        python -m util.seed
+"""
+import io
 
-import csv
+from models import db
+from app import app
+from engine.engine import setup_app_config
+from engine.seeding import load_stocks, load_users, load_holdings, load_transactions, after_seeding
 
 db.drop_all()
 db.create_all()
+setup_app_config()
 
-User.query.delete()
-Stock.query.delete()
-Owned_Stock.query.delete()
-Transaction.query.delete()
-
-
-#stocks
-#seed stocks with symbols and names
-
-s = Stock.query.get(1)
-seed_stock_symbol_and_names()
-#users
-u = User.signup("test1", "123456")
-
-u1 = User.signup("test2", "123456")
-
-
-db.session.commit()
-
-#owned stocks
-o = Owned_Stock()
-o.stock_id = s.id
-o.user_id = u.id
-o.time = datetime.now()
-o.quantity = 10
-o.value_when_purchased = 100.00
-db.session.add(o)
-db.session.commit()
+with open('util/stock_seed_data.csv', 'rb') as csv_file:
+    load_stocks(csv_file)
 
-#transactions
-t = Transaction()
-t.user_id = u.id
-t.stock_id = s.id
-t.is_purchase = True
-t.stock_symbol = "AMAT"
-t.stock_value_at_time = 100.00
-t.quantity = 10
-t.time = datetime.now()
+load_users(io.BytesIO(b"test1,123456\ntest2,123456\n"))        #one password, hashed once
+load_holdings(io.BytesIO(b"test1,AMAT,10,100.00\n"))
+load_transactions(io.BytesIO(b"test1,AMAT,2020-09-01 12:00:00,10,100.00,true\n"))
 
-db.session.add(t)
 db.session.commit()
-
-
-
-
-
-
-
-
+after_seeding()